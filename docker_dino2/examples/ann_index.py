@@ -0,0 +1,438 @@
+#!/usr/bin/env python3
+"""
+DINOv2 近似最近邻索引 (IVF)
+用球面 k-means 把归一化特征划分为 nlist 个倒排列表，查询时只扫描与查询
+最接近的 nprobe 个列表；nprobe 越大召回率越高、速度越慢
+
+构建与加载都不需要把全部特征放进内存: 特征按块从特征存储读取，
+按列表顺序写入内存映射文件，加载时以 mmap 方式打开
+
+目录结构:
+    <index>/
+    ├── meta.json          # nlist、维度、数量、来源特征存储
+    ├── centroids.npy      # (nlist, D) 归一化聚类中心
+    ├── offsets.npy        # (nlist + 1,) 每个列表在 vectors 中的起止位置
+    ├── ids.npy            # (N,) 每行对应的原始行号 (特征存储中的行)
+    └── vectors.npy        # (N, D) 按列表顺序排列的归一化特征
+
+用法:
+    python examples/ann_index.py build --store output/features_store --index output/ivf_index
+    python examples/ann_index.py benchmark --index output/ivf_index --nprobe 1 4 16 64
+"""
+
+import json
+import time
+from pathlib import Path
+
+import numpy as np
+
+from feature_store import FeatureStore
+from similarity import FeatureIndex, normalize, topk_rows
+
+META_NAME = "meta.json"
+
+# k-means 默认迭代次数与每个聚类中心的训练样本数
+DEFAULT_KMEANS_ITERS = 20
+TRAIN_POINTS_PER_LIST = 64
+
+# 构建时每次读取的行数
+DEFAULT_BUILD_BLOCK = 65536
+
+# 分配聚类中心时 (行数 x 中心数) 相似度块的字节上限，块行数由中心数推出，
+# 列表数随 sqrt(N) 增长时内存占用仍然固定
+ASSIGN_BLOCK_BYTES = 256 * 1024**2
+
+DEFAULT_NPROBE = 8
+
+
+def default_nlist(num_vectors):
+    """倒排列表数: 约 4 * sqrt(N)"""
+    return max(1, min(num_vectors, int(4 * np.sqrt(num_vectors))))
+
+
+def read_rows(source, start, stop):
+    """从特征存储或数组 (可以是内存映射) 中读取一段行"""
+    if isinstance(source, FeatureStore):
+        return source.read(start, stop)
+    return source[start:stop]
+
+
+def sample_rows(source, size, seed=0, block_size=DEFAULT_BUILD_BLOCK):
+    """按块顺序读取，随机抽取 size 行 (保持原始顺序)"""
+    n = len(source)
+    sample = np.sort(np.random.default_rng(seed).choice(n, min(size, n), replace=False))
+    return np.concatenate(
+        [
+            np.asarray(read_rows(source, lo, lo + block_size), dtype=np.float32)[
+                sample[(sample >= lo) & (sample < lo + block_size)] - lo
+            ]
+            for lo in range(0, n, block_size)
+        ]
+    )
+
+
+def assign_block_rows(num_centroids, max_bytes=ASSIGN_BLOCK_BYTES):
+    """每块的行数，使 (行数, num_centroids) 的 float32 相似度块不超过 max_bytes"""
+    return max(1, max_bytes // (4 * num_centroids))
+
+
+def _assign(vectors, centroids, spherical=True):
+    """
+    把向量分配到最近的聚类中心
+
+    spherical 为 True 时按内积 (向量应已归一化)，否则按欧氏距离；
+    按 assign_block_rows 分块，相似度块的内存与中心数无关
+    """
+    block_size = assign_block_rows(len(centroids))
+    # argmin ||x - c||^2 = argmax (x·c - ||c||^2 / 2)
+    half_norms = None if spherical else 0.5 * np.einsum("ij,ij->i", centroids, centroids)
+    labels = np.empty(len(vectors), dtype=np.int64)
+    for start in range(0, len(vectors), block_size):
+        stop = min(start + block_size, len(vectors))
+        scores = vectors[start:stop] @ centroids.T
+        if half_norms is not None:
+            scores -= half_norms
+        labels[start:stop] = scores.argmax(axis=1)
+    return labels
+
+
+def train_kmeans(vectors, k, iters=DEFAULT_KMEANS_ITERS, seed=0, spherical=True):
+    """
+    k-means 聚类
+
+    参数:
+        vectors: (N, D) 训练数据 (spherical 时应已归一化)
+        k: 聚类数
+        iters: 迭代次数
+        seed: 随机种子 (初始中心从数据中随机抽取)
+        spherical: True 时按余弦相似度分配，中心归一化；否则按欧氏距离
+
+    返回:
+        centroids: (k, D) float32
+    """
+    vectors = np.asarray(vectors, dtype=np.float32)
+    if k > len(vectors):
+        raise ValueError(f"聚类数 {k} 超过训练样本数 {len(vectors)}")
+    rng = np.random.default_rng(seed)
+    centroids = vectors[rng.choice(len(vectors), k, replace=False)].copy()
+
+    for _ in range(iters):
+        labels = _assign(vectors, centroids, spherical)
+        counts = np.bincount(labels, minlength=k)
+        # 按标签排序后分段求和，比 np.add.at 快得多
+        order = np.argsort(labels, kind="stable")
+        present = np.nonzero(counts)[0]
+        starts = np.concatenate([[0], np.cumsum(counts)[:-1]])[present]
+        sums = np.zeros_like(centroids)
+        sums[present] = np.add.reduceat(vectors[order], starts, axis=0)
+
+        empty = counts == 0
+        centroids = sums / np.maximum(counts, 1)[:, None]
+        # 空簇重新从数据中随机抽取中心
+        if empty.any():
+            centroids[empty] = vectors[rng.choice(len(vectors), int(empty.sum()), replace=False)]
+        if spherical:
+            centroids = normalize(centroids)
+    return centroids.astype(np.float32)
+
+
+class IVFIndex:
+    """
+    倒排文件 (IVF) 近似最近邻索引，余弦相似度
+
+    使用 IVFIndex.build() 构建并保存，IVFIndex.load() 以内存映射方式打开
+    """
+
+    def __init__(self, root, meta, centroids, offsets, ids, vectors):
+        self.root = Path(root)
+        self.meta = meta
+        self.centroids = centroids
+        self.offsets = offsets
+        self.ids = ids
+        self.vectors = vectors
+        self._paths = None
+
+    @classmethod
+    def build(
+        cls,
+        source,
+        root,
+        nlist=None,
+        train_size=None,
+        iters=DEFAULT_KMEANS_ITERS,
+        seed=0,
+        block_size=DEFAULT_BUILD_BLOCK,
+    ):
+        """
+        从特征构建索引并保存到 root
+
+        参数:
+            source: 特征存储目录、FeatureStore 或 (N, D) 数组 (可以是内存映射)
+            root: 索引目录 (已存在时覆盖)
+            nlist: 倒排列表数，默认约 4 * sqrt(N)
+            train_size: k-means 训练样本数，默认 64 * nlist
+            iters: k-means 迭代次数
+            seed: 随机种子
+            block_size: 每次读取的行数
+
+        返回:
+            index: 以内存映射方式打开的 IVFIndex
+        """
+        store_dir = None
+        if isinstance(source, (str, Path)):
+            store_dir = str(source)
+            source = FeatureStore.open(source)
+        elif isinstance(source, FeatureStore):
+            store_dir = str(source.root)
+
+        n = len(source)
+        if n == 0:
+            raise ValueError("没有可索引的特征")
+        dim = read_rows(source, 0, 1).shape[1]
+        nlist = nlist or default_nlist(n)
+        train_size = min(n, train_size or TRAIN_POINTS_PER_LIST * nlist)
+        root = Path(root)
+        root.mkdir(parents=True, exist_ok=True)
+
+        # 1. 在随机样本上训练聚类中心
+        start = time.perf_counter()
+        train = normalize(sample_rows(source, train_size, seed, block_size))
+        centroids = train_kmeans(train, nlist, iters, seed)
+        del train
+        print(f"训练聚类中心: {nlist} 个列表, {train_size} 个样本, {time.perf_counter() - start:.1f} 秒")
+
+        # 2. 逐块分配列表
+        start = time.perf_counter()
+        labels = np.empty(n, dtype=np.int64)
+        for lo in range(0, n, block_size):
+            labels[lo : lo + block_size] = _assign(
+                normalize(read_rows(source, lo, lo + block_size)), centroids
+            )
+        counts = np.bincount(labels, minlength=nlist)
+        offsets = np.zeros(nlist + 1, dtype=np.int64)
+        np.cumsum(counts, out=offsets[1:])
+
+        # 3. 按列表顺序写入: 顺序读取每一块，把每行写到它在列表中的位置
+        order = np.argsort(labels, kind="stable")
+        position = np.empty(n, dtype=np.int64)
+        position[order] = np.arange(n)
+        del labels
+        np.save(root / "ids.npy", order)
+        vectors = np.lib.format.open_memmap(
+            root / "vectors.npy", mode="w+", dtype=np.float32, shape=(n, dim)
+        )
+        for lo in range(0, n, block_size):
+            block = normalize(read_rows(source, lo, lo + block_size))
+            vectors[position[lo : lo + len(block)]] = block
+        vectors.flush()
+        del vectors
+        print(f"写入倒排列表: {n} 条, {time.perf_counter() - start:.1f} 秒")
+
+        np.save(root / "centroids.npy", centroids)
+        np.save(root / "offsets.npy", offsets)
+        meta = {
+            "version": 1,
+            "metric": "cosine",
+            "num_vectors": n,
+            "dim": dim,
+            "nlist": nlist,
+            "train_size": train_size,
+            "store_dir": store_dir,
+            "model_name": source.model_name if isinstance(source, FeatureStore) else None,
+        }
+        with open(root / META_NAME, "w", encoding="utf-8") as f:
+            json.dump(meta, f, ensure_ascii=False, indent=2)
+        return cls.load(root)
+
+    @classmethod
+    def load(cls, root, mmap=True):
+        """
+        打开索引
+
+        参数:
+            mmap: True 时倒排向量与行号以只读内存映射方式打开 (聚类中心总是读入内存)
+        """
+        root = Path(root)
+        with open(root / META_NAME, "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        mmap_mode = "r" if mmap else None
+        return cls(
+            root,
+            meta,
+            np.load(root / "centroids.npy"),
+            np.load(root / "offsets.npy"),
+            np.load(root / "ids.npy", mmap_mode=mmap_mode),
+            np.load(root / "vectors.npy", mmap_mode=mmap_mode),
+        )
+
+    def __len__(self):
+        return self.meta["num_vectors"]
+
+    @property
+    def nlist(self):
+        return self.meta["nlist"]
+
+    @property
+    def dim(self):
+        return self.meta["dim"]
+
+    @property
+    def paths(self):
+        """来源特征存储中与原始行号对应的图像路径"""
+        if self._paths is None and self.meta.get("store_dir"):
+            self._paths = FeatureStore.open(self.meta["store_dir"]).paths
+        return self._paths
+
+    def list_sizes(self):
+        return np.diff(self.offsets)
+
+    def search(self, queries, k=10, nprobe=DEFAULT_NPROBE, exclude=None):
+        """
+        近似查询最相似的 k 个特征
+
+        参数:
+            queries: (B, D) 查询特征 (不必归一化) 或单个 (D,) 向量
+            k: 返回个数
+            nprobe: 每个查询扫描的倒排列表数
+            exclude: 可选的长度为 B 的原始行号数组，第 i 个查询不返回 exclude[i]，-1 表示不排除
+
+        返回:
+            (ids, scores): (B, k) 原始行号与余弦相似度，按相似度从高到低；
+                候选不足 k 个时用 -1 / -inf 填充
+        """
+        queries = normalize(np.atleast_2d(queries))
+        if queries.shape[1] != self.dim:
+            raise ValueError(f"查询维度 {queries.shape[1]} 与索引维度 {self.dim} 不一致")
+        nprobe = min(nprobe, self.nlist)
+        probes, _ = topk_rows(queries @ self.centroids.T, nprobe)
+
+        # 按列表而不是按查询遍历: 每个列表只从磁盘读取一次，
+        # 与所有探测它的查询做一次矩阵乘法，列表内的 top-k 作为候选
+        num_queries = len(queries)
+        cand_ids = np.full((num_queries, nprobe, k), -1, dtype=np.int64)
+        cand_scores = np.full((num_queries, nprobe, k), -np.inf, dtype=np.float32)
+        flat = probes.ravel()
+        order = np.argsort(flat, kind="stable")
+        bounds = np.searchsorted(flat[order], np.arange(self.nlist + 1))
+        for list_id in np.unique(flat):
+            lo, hi = self.offsets[list_id], self.offsets[list_id + 1]
+            if lo == hi:
+                continue
+            pairs = order[bounds[list_id] : bounds[list_id + 1]]
+            q, slot = pairs // nprobe, pairs % nprobe
+            ids = np.asarray(self.ids[lo:hi])
+            scores = queries[q] @ self.vectors[lo:hi].T
+            if exclude is not None:
+                scores[ids[None, :] == np.asarray(exclude)[q, None]] = -np.inf
+            kk = min(k, hi - lo)
+            top, top_scores = topk_rows(scores, kk, ids)
+            cand_ids[q, slot, :kk] = top
+            cand_scores[q, slot, :kk] = top_scores
+
+        result_ids, result_scores = topk_rows(
+            cand_scores.reshape(num_queries, -1), k, cand_ids.reshape(num_queries, -1)
+        )
+        # 候选不足 k 个时填充位的分数为 -inf，行号统一为 -1
+        result_ids[np.isneginf(result_scores)] = -1
+        return result_ids, result_scores
+
+
+def recall_at_k(approx_ids, exact_ids):
+    """每个查询的近似结果覆盖精确 top-k 的比例的平均值"""
+    k = exact_ids.shape[1]
+    hits = [len(np.intersect1d(a[:k], e)) for a, e in zip(approx_ids, exact_ids)]
+    return float(np.mean(hits)) / k
+
+
+def benchmark_index(index, features, queries, k=10, nprobes=(1, 4, 16, 64), exclude=None):
+    """
+    对比 IVF 索引与精确搜索的 recall@k 与 queries/sec
+
+    参数:
+        index: IVFIndex
+        features: 精确搜索使用的全部特征 (与索引的原始行号对应)
+        queries: (B, D) 查询特征
+        k: top-k
+        nprobes: 待评估的 nprobe 取值
+        exclude: 可选的每个查询要排除的原始行号 (查询来自索引自身时传入)
+
+    返回:
+        report: {"num_vectors", "num_queries", "k", "exact_qps", "results": [...]}
+    """
+    exact = FeatureIndex(features)
+    start = time.perf_counter()
+    exact_ids, _ = exact.topk(queries, k, exclude=exclude)
+    exact_seconds = time.perf_counter() - start
+
+    results = []
+    for nprobe in nprobes:
+        start = time.perf_counter()
+        approx_ids, _ = index.search(queries, k, nprobe, exclude)
+        seconds = time.perf_counter() - start
+        results.append(
+            {
+                "nprobe": min(nprobe, index.nlist),
+                "recall": recall_at_k(approx_ids, exact_ids),
+                "qps": len(queries) / seconds,
+            }
+        )
+    return {
+        "num_vectors": len(index),
+        "num_queries": len(queries),
+        "k": k,
+        "nlist": index.nlist,
+        "exact_qps": len(queries) / exact_seconds,
+        "results": results,
+    }
+
+
+def print_benchmark_report(report):
+    """打印 IVF 索引基准报告"""
+    print("\n" + "=" * 60)
+    print(
+        f"IVF 索引基准: {report['num_vectors']} 条, nlist={report['nlist']}, "
+        f"{report['num_queries']} 个查询"
+    )
+    print("=" * 60)
+    print(f"  精确搜索: {report['exact_qps']:>10.1f} queries/sec")
+    print(f"  {'nprobe':>8} {'recall@' + str(report['k']):>10} {'queries/sec':>12}")
+    for r in report["results"]:
+        print(f"  {r['nprobe']:>8} {r['recall']:>10.4f} {r['qps']:>12.1f}")
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="DINOv2 IVF 近似最近邻索引")
+    parser.add_argument("command", choices=["build", "benchmark"], help="构建索引或运行基准")
+    parser.add_argument("--store", type=str, help="特征存储目录 (build)")
+    parser.add_argument("--index", type=str, required=True, help="索引目录")
+    parser.add_argument("--nlist", type=int, default=None, help="倒排列表数 (默认约 4*sqrt(N))")
+    parser.add_argument("--iters", type=int, default=DEFAULT_KMEANS_ITERS, help="k-means 迭代次数")
+    parser.add_argument("--nprobe", type=int, nargs="+", default=[1, 4, 16, 64], help="基准的 nprobe")
+    parser.add_argument("--k", type=int, default=10, help="基准的 top-k")
+    parser.add_argument("--num-queries", type=int, default=1000, help="基准查询数 (从索引中抽样)")
+    args = parser.parse_args()
+
+    if args.command == "build":
+        if not args.store:
+            parser.error("build 需要 --store")
+        index = IVFIndex.build(args.store, args.index, nlist=args.nlist, iters=args.iters)
+        sizes = index.list_sizes()
+        print(f"索引已保存: {args.index} ({len(index)} 条, 列表大小 {sizes.min()}-{sizes.max()})")
+        return
+
+    index = IVFIndex.load(args.index)
+    if not index.meta.get("store_dir"):
+        parser.error("基准需要索引记录的来源特征存储")
+    features = FeatureStore.open(index.meta["store_dir"]).features()
+    rng = np.random.default_rng(0)
+    rows = rng.choice(len(features), min(args.num_queries, len(features)), replace=False)
+    report = benchmark_index(
+        index, features, features[np.sort(rows)], args.k, args.nprobe, exclude=np.sort(rows)
+    )
+    print_benchmark_report(report)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,324 @@
+#!/usr/bin/env python3
+"""
+DINOv2 批大小自动调优
+在短时间预热中依次尝试递增的批大小，测量吞吐量与峰值内存，
+选出吞吐量曲线的拐点，并按机器、模型、执行模式、输入分辨率与推理后端缓存结果
+
+torch 与模型注册表在真正调优时才导入，batch_size_arg 可用于不加载 torch 的命令行解析
+"""
+
+import json
+import os
+import platform
+import threading
+import time
+from pathlib import Path
+
+from execution import BASELINE_MODE
+
+# 候选批大小、拐点容差与结果缓存位置
+DEFAULT_CANDIDATES = (1, 2, 4, 8, 16, 32, 64)
+DEFAULT_TOLERANCE = 0.05
+DEFAULT_CACHE_PATH = Path.home() / ".cache" / "dinov2" / "autotune.json"
+DEFAULT_IMAGE_SIZE = 224
+
+# CPU 上采样进程 RSS 的间隔 (秒)
+RSS_SAMPLE_INTERVAL = 0.001
+
+
+def machine_fingerprint(device):
+    """标识当前机器与运行环境，调优结果只在相同环境下复用"""
+    import torch
+
+    parts = [
+        platform.node(),
+        platform.machine(),
+        str(os.cpu_count()),
+        f"threads={torch.get_num_threads()}",
+        f"torch={torch.__version__}",
+    ]
+    if torch.device(device).type == "cuda":
+        parts.append(torch.cuda.get_device_name(torch.device(device)))
+    return "|".join(parts)
+
+
+def _current_rss_bytes():
+    """当前进程的常驻内存 (Linux 读取 /proc/self/statm)，无法读取时返回 None"""
+    try:
+        with open("/proc/self/statm", "r") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+class RssSampler:
+    """
+    在后台线程中周期采样进程 RSS，记录一段代码执行期间的最大值
+
+    ru_maxrss 是整个进程生命周期的峰值，只增不减，无法区分各批大小；
+    这里只统计 with 块内的采样，得到该批大小运行期间的峰值 RSS。
+    平台不支持时 peak 为 None
+    """
+
+    def __init__(self, interval=RSS_SAMPLE_INTERVAL):
+        self.interval = interval
+        self.peak = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _sample(self):
+        rss = _current_rss_bytes()
+        if rss is not None:
+            self.peak = rss if self.peak is None else max(self.peak, rss)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self._sample()
+
+    def __enter__(self):
+        self._sample()
+        if self.peak is not None:
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self._sample()
+        return False
+
+
+class _CudaPeak:
+    """CUDA 上用 PyTorch 的显存峰值统计，接口与 RssSampler 相同"""
+
+    def __init__(self, device):
+        self.device = device
+        self.peak = None
+
+    def __enter__(self):
+        import torch
+
+        torch.cuda.reset_peak_memory_stats(self.device)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        import torch
+
+        self.peak = torch.cuda.max_memory_allocated(self.device)
+        return False
+
+
+def _memory_meter(device):
+    """CUDA 为显存峰值，CPU 为采样得到的峰值 RSS"""
+    import torch
+
+    if torch.device(device).type == "cuda":
+        return _CudaPeak(device)
+    return RssSampler()
+
+
+def _synchronize(device):
+    import torch
+
+    if torch.device(device).type == "cuda":
+        torch.cuda.synchronize(device)
+
+
+def probe_batch_sizes(
+    model_name="dinov2_vits14",
+    device="cuda",
+    mode=None,
+    candidates=DEFAULT_CANDIDATES,
+    image_size=DEFAULT_IMAGE_SIZE,
+    warmup=1,
+    iters=3,
+    max_memory_bytes=None,
+    backend="torch",
+):
+    """
+    依次测量各批大小的吞吐量与峰值内存
+
+    出现内存不足、超过 max_memory_bytes 或吞吐量明显下降时提前停止
+
+    参数:
+        image_size: 输入分辨率，应与实际提取时的预处理分辨率一致
+        backend: 推理后端 ('torch' 或 'onnx')
+
+    返回:
+        probes: [{"batch_size", "images_per_sec", "peak_memory_bytes"}, ...]
+            peak_memory_bytes 为该批大小运行期间的峰值 (CUDA 显存或 CPU 进程 RSS)，
+            无法测量时为 None
+    """
+    import torch
+
+    from extract_features import load_model
+
+    mode = mode or BASELINE_MODE
+    model = load_model(model_name, device, mode, backend, image_size)
+
+    probes = []
+    best = 0.0
+    for batch_size in candidates:
+        dummy = mode.prepare_input(torch.randn(batch_size, 3, image_size, image_size), device)
+        meter = _memory_meter(device)
+        try:
+            with mode.grad_context(), meter:
+                for _ in range(warmup):
+                    model(dummy)
+                _synchronize(device)
+                start = time.perf_counter()
+                for _ in range(iters):
+                    model(dummy)
+                _synchronize(device)
+        except RuntimeError as e:
+            # 显存/内存不足时停止继续增大批次
+            print(f"  批大小 {batch_size} 失败，停止探测: {e}")
+            break
+        elapsed = time.perf_counter() - start
+
+        probe = {
+            "batch_size": batch_size,
+            "images_per_sec": batch_size * iters / elapsed,
+            "peak_memory_bytes": meter.peak,
+        }
+        probes.append(probe)
+        memory = "未知" if meter.peak is None else f"{meter.peak / 1024**2:.0f} MB"
+        print(f"  批大小 {batch_size:>4}: {probe['images_per_sec']:8.2f} images/sec, 峰值内存 {memory}")
+
+        if _over_memory(probe, max_memory_bytes):
+            break
+        # 吞吐量已经明显回落，更大的批次不会更好
+        if probe["images_per_sec"] < best * 0.8:
+            break
+        best = max(best, probe["images_per_sec"])
+
+    return probes
+
+
+def _over_memory(probe, max_memory_bytes):
+    """峰值内存已知且超过上限"""
+    peak = probe["peak_memory_bytes"]
+    return bool(max_memory_bytes) and peak is not None and peak > max_memory_bytes
+
+
+def pick_knee(probes, tolerance=DEFAULT_TOLERANCE, max_memory_bytes=None):
+    """
+    选择拐点: 吞吐量达到最大值 (1 - tolerance) 的最小批大小
+
+    更大的批次只带来很小的收益，却会增加内存占用和单批延迟
+    """
+    usable = [p for p in probes if not _over_memory(p, max_memory_bytes)]
+    if not usable:
+        return 1
+    best = max(p["images_per_sec"] for p in usable)
+    for p in usable:
+        if p["images_per_sec"] >= best * (1 - tolerance):
+            return p["batch_size"]
+    return usable[-1]["batch_size"]
+
+
+def _load_cache(cache_path):
+    try:
+        with open(cache_path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+
+def _save_cache(cache_path, cache):
+    cache_path = Path(cache_path)
+    cache_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = cache_path.with_suffix(".tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(cache, f, ensure_ascii=False, indent=2)
+    os.replace(tmp, cache_path)
+
+
+def autotune_batch_size(
+    model_name="dinov2_vits14",
+    device="cuda",
+    mode=None,
+    candidates=DEFAULT_CANDIDATES,
+    tolerance=DEFAULT_TOLERANCE,
+    max_memory_bytes=None,
+    cache_path=DEFAULT_CACHE_PATH,
+    refresh=False,
+    image_size=DEFAULT_IMAGE_SIZE,
+    backend="torch",
+):
+    """
+    自动选择批大小
+
+    参数:
+        model_name: 模型名称
+        device: 计算设备
+        mode: 推理执行模式 (ExecutionMode)
+        candidates: 候选批大小 (递增)
+        tolerance: 拐点容差，吞吐量不低于最大值的 (1 - tolerance)
+        max_memory_bytes: 峰值内存上限
+        cache_path: 调优结果缓存文件，为 None 时不缓存
+        refresh: 忽略已缓存的结果重新调优
+        image_size: 输入分辨率
+        backend: 推理后端 ('torch' 或 'onnx')
+
+    返回:
+        batch_size: 选定的批大小
+    """
+    mode = mode or BASELINE_MODE
+    key = "|".join(
+        [
+            machine_fingerprint(device),
+            model_name,
+            str(device),
+            mode.describe(),
+            f"resolution={image_size}",
+            f"backend={backend}",
+        ]
+    )
+
+    cache = _load_cache(cache_path) if cache_path else {}
+    if not refresh and key in cache:
+        batch_size = cache[key]["batch_size"]
+        print(f"使用已缓存的自动调优结果: batch_size={batch_size}")
+        return batch_size
+
+    print(f"自动调优批大小 ({model_name}, {device}, {mode.describe()}, {image_size}px, {backend})...")
+    probes = probe_batch_sizes(
+        model_name,
+        device,
+        mode,
+        candidates,
+        image_size=image_size,
+        max_memory_bytes=max_memory_bytes,
+        backend=backend,
+    )
+    batch_size = pick_knee(probes, tolerance, max_memory_bytes)
+    print(f"选定批大小: {batch_size}")
+
+    if cache_path:
+        cache[key] = {"batch_size": batch_size, "probes": probes}
+        _save_cache(cache_path, cache)
+    return batch_size
+
+
+def resolve_batch_size(
+    batch_size, model_name, device, mode=None, image_size=DEFAULT_IMAGE_SIZE, backend="torch"
+):
+    """batch_size 为 'auto' 时按输入分辨率与推理后端自动调优，否则原样返回整数"""
+    if batch_size == "auto":
+        return autotune_batch_size(
+            model_name, device, mode, image_size=image_size, backend=backend
+        )
+    return int(batch_size)
+
+
+def batch_size_arg(value):
+    """argparse 类型: 正整数或 'auto'"""
+    if value == "auto":
+        return value
+    batch_size = int(value)
+    if batch_size <= 0:
+        raise ValueError(f"批大小必须为正整数: {value}")
+    return batch_size
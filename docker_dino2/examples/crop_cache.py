@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+"""
+DINOv2 预处理裁剪缓存
+把 Resize/CenterCrop 之后的 uint8 图像以 (图像内容哈希, 预处理参数) 为键
+追加到一个可内存映射的数组文件中；所有 DINOv2 变体共用同一套预处理，
+后续运行任何模型时都可以直接读取裁剪结果，完全跳过解码与缩放
+
+目录结构:
+    <root>/
+    ├── meta.json      # 裁剪尺寸与数据类型
+    ├── crops.u8       # (N, crop, crop, 3) uint8 原始数组，可 np.memmap
+    └── index.jsonl    # 每行 {"key": ..., "row": ...}，只追加
+"""
+
+import fcntl
+import hashlib
+import json
+import os
+import threading
+from pathlib import Path
+
+import numpy as np
+
+from feature_cache import DEFAULT_MAX_DIGESTS, DigestMemo
+
+META_NAME = "meta.json"
+DATA_NAME = "crops.u8"
+INDEX_NAME = "index.jsonl"
+LOCK_NAME = ".lock"
+
+
+class CropCache:
+    """
+    内容寻址的预处理裁剪缓存
+
+    数据文件只追加，先写数据再写索引，中途中断只会留下未被索引的尾部数据；
+    多个进程可以共用同一个缓存目录，追加时通过文件锁串行化
+
+    参数:
+        root: 缓存目录
+        crop: 裁剪尺寸 (与预处理配置中的 crop 一致)
+        max_digests: 进程内记忆的内容哈希条数上限
+    """
+
+    def __init__(self, root, crop=224, max_digests=DEFAULT_MAX_DIGESTS):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.crop = crop
+        self.row_shape = (crop, crop, 3)
+        self.row_bytes = crop * crop * 3
+        self.hits = 0
+        self.misses = 0
+        self._index = {}
+        self._index_offset = 0
+        self._mmap = None
+        self._digests = DigestMemo(max_digests)
+        self._lock = threading.Lock()
+
+        meta_path = self.root / META_NAME
+        if meta_path.exists():
+            with open(meta_path, "r", encoding="utf-8") as f:
+                meta = json.load(f)
+            if meta["crop"] != crop:
+                raise ValueError(
+                    f"裁剪缓存尺寸不匹配: 缓存为 {meta['crop']}，当前为 {crop}"
+                )
+        else:
+            with open(meta_path, "w", encoding="utf-8") as f:
+                json.dump({"crop": crop, "dtype": "uint8"}, f)
+        (self.root / DATA_NAME).touch()
+        self._refresh()
+
+    def __getstate__(self):
+        # 跨进程传递时只保留目录与尺寸，在子进程中重新打开
+        return {"root": self.root, "crop": self.crop, "max_digests": self._digests.max_entries}
+
+    def __setstate__(self, state):
+        self.__init__(state["root"], state["crop"], state["max_digests"])
+
+    def content_hash(self, path):
+        """图像内容哈希，按 (路径, 大小, 修改时间) 在进程内记忆 (见 DigestMemo)"""
+        return self._digests.digest(path)
+
+    def make_key(self, path, params):
+        """
+        生成缓存键
+
+        参数:
+            path: 图像路径
+            params: 影响裁剪像素的预处理参数 (resize/crop/解码方式)，不含归一化
+        """
+        payload = json.dumps(
+            {"content": self.content_hash(path), "params": params}, sort_keys=True
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _refresh(self):
+        """读取索引中新追加的条目 (包括其他进程写入的)"""
+        with open(self.root / INDEX_NAME, "a+", encoding="utf-8") as f:
+            f.seek(self._index_offset)
+            for line in f:
+                if not line.endswith("\n"):
+                    break  # 另一个进程正在写的半行
+                entry = json.loads(line)
+                self._index[entry["key"]] = entry["row"]
+                self._index_offset += len(line.encode("utf-8"))
+
+    def _rows(self, min_rows):
+        """返回覆盖至少 min_rows 行的只读内存映射"""
+        if self._mmap is None or self._mmap.shape[0] < min_rows:
+            rows = os.path.getsize(self.root / DATA_NAME) // self.row_bytes
+            self._mmap = np.memmap(
+                self.root / DATA_NAME, dtype=np.uint8, mode="r", shape=(rows,) + self.row_shape
+            )
+        return self._mmap
+
+    def get(self, key):
+        """命中返回 (crop, crop, 3) uint8 数组 (内存映射视图)，否则返回 None"""
+        with self._lock:
+            row = self._index.get(key)
+            if row is None:
+                self._refresh()
+                row = self._index.get(key)
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return self._rows(row + 1)[row]
+
+    def put(self, key, crop):
+        """追加一条裁剪结果"""
+        crop = np.ascontiguousarray(crop, dtype=np.uint8)
+        if crop.shape != self.row_shape:
+            raise ValueError(f"裁剪形状应为 {self.row_shape}，实际为 {crop.shape}")
+
+        with self._lock, open(self.root / LOCK_NAME, "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            self._refresh()
+            if key in self._index:
+                return
+            data_path = self.root / DATA_NAME
+            # 按整行对齐，丢弃之前中断写入留下的不完整尾部
+            row = os.path.getsize(data_path) // self.row_bytes
+            with open(data_path, "r+b") as f:
+                f.seek(row * self.row_bytes)
+                f.write(crop.tobytes())
+                f.truncate()
+            with open(self.root / INDEX_NAME, "a", encoding="utf-8") as f:
+                f.write(json.dumps({"key": key, "row": row}) + "\n")
+            self._refresh()
+
+    def __len__(self):
+        return len(self._index)
+
+    def crops(self):
+        """返回全部裁剪结果的只读内存映射 (N, crop, crop, 3)"""
+        with self._lock:
+            self._refresh()
+            if not self._index:
+                return np.empty((0,) + self.row_shape, dtype=np.uint8)
+            return self._rows(len(self._index))[: len(self._index)]
+
+    def clear(self):
+        with self._lock:
+            self._mmap = None
+            self._index.clear()
+            self._index_offset = 0
+            for name in (DATA_NAME, INDEX_NAME):
+                (self.root / name).unlink(missing_ok=True)
+            (self.root / DATA_NAME).touch()
+
+    def stats(self):
+        """返回命中/未命中计数与当前条目数、占用"""
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "entries": len(self._index),
+            "bytes": os.path.getsize(self.root / DATA_NAME),
+        }
@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+"""
+DINOv2 推理执行模式
+统一管理推理精度 (fp32/bf16/int8)、torch.compile、channels_last 内存布局
+与 torch.inference_mode，供特征提取函数和命令行共用
+
+torch 在第一次需要时才导入，解析命令行参数不会触发 torch 的加载
+"""
+
+# 支持的推理精度及对应的激活数据类型 (torch 数据类型名称)
+# int8 为 Linear 层动态量化: 权重 int8，输入输出仍为 fp32
+PRECISIONS = {
+    "fp32": "float32",
+    "bf16": "bfloat16",
+    "int8": "float32",
+}
+
+
+class ExecutionMode:
+    """
+    推理执行模式
+
+    参数:
+        precision: 推理精度 ('fp32'、'bf16' 或 'int8'，int8 仅支持 CPU)
+        compile: 是否使用 torch.compile 编译模型
+        channels_last: 是否使用 channels_last 内存布局
+        inference_mode: 是否使用 torch.inference_mode 代替 torch.no_grad
+    """
+
+    def __init__(
+        self, precision="fp32", compile=False, channels_last=False, inference_mode=False
+    ):
+        if precision not in PRECISIONS:
+            raise ValueError(f"不支持的精度: {precision} (可选: {list(PRECISIONS)})")
+        self.precision = precision
+        self.compile = compile
+        self.channels_last = channels_last
+        self.inference_mode = inference_mode
+
+    @property
+    def dtype(self):
+        import torch
+
+        return getattr(torch, PRECISIONS[self.precision])
+
+    @property
+    def model_options(self):
+        """传给模型注册表的加载选项"""
+        return {
+            "compile": self.compile,
+            "channels_last": self.channels_last,
+            "quantize": "int8" if self.precision == "int8" else None,
+        }
+
+    def grad_context(self):
+        """推理时的梯度上下文"""
+        import torch
+
+        if self.inference_mode:
+            return torch.inference_mode()
+        return torch.no_grad()
+
+    def prepare_input(self, batch, device):
+        """
+        把输入批次移动到目标设备，并转换为对应精度与内存布局
+
+        锁页内存中的批次异步拷贝到 GPU
+        """
+        import torch
+
+        memory_format = (
+            torch.channels_last if self.channels_last else torch.contiguous_format
+        )
+        return batch.to(
+            device=device,
+            dtype=self.dtype,
+            memory_format=memory_format,
+            non_blocking=batch.is_pinned(),
+        )
+
+    def to_numpy(self, features):
+        """输出统一转换为 float32 numpy 数组 (numpy 不支持 bf16)"""
+        return features.float().cpu().numpy()
+
+    def cache_extra(self):
+        """
+        特征缓存键中与执行模式相关的部分
+
+        只有精度会改变特征数值；fp32 返回 None，与未指定模式时的缓存共用
+        """
+        if self.precision == "fp32":
+            return None
+        return {"precision": self.precision}
+
+    def describe(self):
+        parts = [self.precision]
+        if self.compile:
+            parts.append("compile")
+        if self.channels_last:
+            parts.append("channels_last")
+        if self.inference_mode:
+            parts.append("inference_mode")
+        return "+".join(parts)
+
+    def __repr__(self):
+        return f"ExecutionMode({self.describe()})"
+
+
+# 与原始实现完全一致的基准模式: fp32 + torch.no_grad
+BASELINE_MODE = ExecutionMode()
+
+
+def add_execution_args(parser):
+    """为命令行解析器添加执行模式相关参数"""
+    parser.add_argument(
+        "--precision",
+        type=str,
+        default="fp32",
+        choices=list(PRECISIONS),
+        help="推理精度",
+    )
+    parser.add_argument(
+        "--compile", action="store_true", help="使用 torch.compile 编译模型"
+    )
+    parser.add_argument(
+        "--channels-last", action="store_true", help="使用 channels_last 内存布局"
+    )
+    parser.add_argument(
+        "--inference-mode",
+        action="store_true",
+        help="使用 torch.inference_mode 代替 torch.no_grad",
+    )
+
+
+def mode_from_args(args):
+    """根据命令行参数构造 ExecutionMode"""
+    return ExecutionMode(
+        precision=args.precision,
+        compile=args.compile,
+        channels_last=args.channels_last,
+        inference_mode=args.inference_mode,
+    )
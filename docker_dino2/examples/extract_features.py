@@ -2,16 +2,162 @@
 """
 DINOv2 特征提取示例
 展示如何使用 DINOv2 进行图像特征提取
+
+torch 与模型注册表在真正需要时才导入，参数解析、--help 与参数错误不会等待 torch 加载
 """
 
-import torch
-import torchvision.transforms as transforms
-from PIL import Image
+import time
+
+# 模块导入时刻，作为命令行启动耗时的起点 (不含解释器自身的启动)
+_PROCESS_START = time.perf_counter()
+
 import numpy as np
 from pathlib import Path
 
+from autotune import batch_size_arg, resolve_batch_size
+from execution import BASELINE_MODE, add_execution_args, mode_from_args
+from feature_cache import FeatureCache
+from feature_store import FeatureStore, DEFAULT_SHARD_SIZE
+from pipeline import (
+    BatchPrefetcher,
+    DEFAULT_NUM_WORKERS,
+    DEFAULT_QUEUE_DEPTH,
+    DEFAULT_PREPROCESS,
+    PATCH_SIZE,
+    TRANSFORM_CONFIG,
+    ErrorLog,
+    PreprocessConfig,
+    add_preprocess_args,
+    preprocess_from_args,
+)
+from tta import add_tta_args, tta_from_args
+
+# 示例测试图片目录
+DEFAULT_IMAGE_DIR = Path(__file__).resolve().parent.parent / "data" / "test_images"
+
+# 目录模式支持的图像扩展名 (与 tests/test_photos.py 一致)
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".webp", ".bmp")
+
+# 目录模式默认每处理多少批保存一次检查点
+DEFAULT_CHECKPOINT_EVERY = 10
+
+# 目录模式下被跳过图像的错误清单文件名 (位于特征存储目录中)
+ERRORS_NAME = "errors.jsonl"
+
+# 一次前向可以同时得到的输出类型
+OUTPUT_TYPES = ("cls", "patch_mean", "patch_grid")
 
-def extract_features(image_path, model_name="dinov2_vits14", device="cuda"):
+# 命令行可选的模型
+MODEL_NAMES = ("dinov2_vits14", "dinov2_vitb14", "dinov2_vitl14", "dinov2_vitg14")
+
+# 可选的推理后端 (与 onnx_backend.BACKENDS 一致，这里不导入以免加载 onnxruntime)
+BACKENDS = ("torch", "onnx")
+
+
+def load_model(model_name, device, mode, backend="torch", resolution=None):
+    """
+    按推理后端获取模型 (首次调用时加载)
+
+    backend 为 'onnx' 时返回 ONNX Runtime 会话 (onnx_backend.OnnxModel)，
+    调用方式与 PyTorch 模型相同，但只支持 CLS 输出；ONNX 模型的输入分辨率固定，
+    resolution 为 None 时使用默认预处理的分辨率
+    """
+    if backend not in BACKENDS:
+        raise ValueError(f"不支持的推理后端: {backend} (可选: {BACKENDS})")
+    if backend == "onnx":
+        from onnx_backend import get_onnx_model
+
+        return get_onnx_model(
+            model_name, device, mode, image_size=resolution or DEFAULT_PREPROCESS.resolution
+        )
+
+    from model_registry import get_model
+
+    return get_model(model_name, device, mode.dtype, **mode.model_options)
+
+
+def forward_outputs(model, batch, outputs, mode=None):
+    """
+    运行一次 forward_features，同时得到多种输出
+
+    参数:
+        model: DINOv2 模型
+        batch: 预处理并已移动到设备上的输入批次 (B, 3, H, W)
+        outputs: 需要的输出类型，OUTPUT_TYPES 的任意组合
+            cls: CLS token 特征 (B, D)，float32，与 model(batch) 相同
+            patch_mean: patch token 平均池化 (B, D)，float32
+            patch_grid: 完整 patch 网格 (B, H/14, W/14, D)，float16 以节省空间
+        mode: 推理执行模式 (ExecutionMode)
+
+    返回:
+        results: {输出类型: numpy array}
+    """
+    mode = mode or BASELINE_MODE
+    unknown = set(outputs) - set(OUTPUT_TYPES)
+    if unknown:
+        raise ValueError(f"不支持的输出类型: {sorted(unknown)} (可选: {OUTPUT_TYPES})")
+
+    with mode.grad_context():
+        feats = model.forward_features(batch)
+
+    results = {}
+    patch_tokens = feats["x_norm_patchtokens"]
+    if "cls" in outputs:
+        results["cls"] = mode.to_numpy(feats["x_norm_clstoken"])
+    if "patch_mean" in outputs:
+        results["patch_mean"] = mode.to_numpy(patch_tokens.float().mean(dim=1))
+    if "patch_grid" in outputs:
+        patch_size = getattr(model, "patch_size", 14)
+        b, _, d = patch_tokens.shape
+        h, w = batch.shape[-2] // patch_size, batch.shape[-1] // patch_size
+        grid = patch_tokens.reshape(b, h, w, d)
+        results["patch_grid"] = grid.half().cpu().numpy()
+    return results
+
+
+def _run_model(model, batch, mode, outputs=None, tta=None):
+    """
+    outputs 为 None 时只返回 CLS 特征数组，否则返回多输出字典
+
+    给出 tta 时整批展开为 K 个视图一次前向，再按图像平均回原批大小
+    """
+    if outputs is not None and not hasattr(model, "forward_features"):
+        raise ValueError("ONNX 后端只支持默认的 CLS 输出")
+    if tta is not None:
+        if outputs is not None and "patch_grid" in outputs:
+            raise ValueError("TTA 不支持 patch_grid 输出 (视图之间空间位置不对齐)")
+        batch = tta.expand(batch)
+    if outputs is not None:
+        features = forward_outputs(model, batch, outputs, mode)
+    else:
+        with mode.grad_context():
+            features = mode.to_numpy(model(batch))
+    if tta is not None:
+        features = tta.reduce(features)
+    return features
+
+
+def _cache_extra(mode, tta=None, backend="torch"):
+    """特征缓存键中与执行模式、TTA 和推理后端相关的部分"""
+    extra = mode.cache_extra()
+    if tta is not None:
+        extra = dict(extra or {}, **tta.cache_extra())
+    if backend != "torch":
+        extra = dict(extra or {}, backend=backend)
+    return extra
+
+
+def extract_features(
+    image_path,
+    model_name="dinov2_vits14",
+    device="cuda",
+    cache=None,
+    mode=None,
+    outputs=None,
+    preprocess=None,
+    tta=None,
+    backend="torch",
+):
     """
     从图像中提取 DINOv2 特征
 
@@ -19,46 +165,135 @@ def extract_features(image_path, model_name="dinov2_vits14", device="cuda"):
         image_path: 图像路径
         model_name: 模型名称 ('dinov2_vits14', 'dinov2_vitb14', 'dinov2_vitl14', 'dinov2_vitg14')
         device: 计算设备 ('cuda' 或 'cpu')
+        cache: 可选的 FeatureCache，命中时跳过推理
+        mode: 推理执行模式 (ExecutionMode)，默认 fp32 + torch.no_grad
+        outputs: 需要的输出类型 (见 OUTPUT_TYPES)，为 None 时只返回 CLS 特征
+        preprocess: 预处理配置 (PreprocessConfig)，默认为标准预处理
+        tta: 可选的测试时增强 (TestTimeAugmentation)
+        backend: 推理后端 ('torch' 或 'onnx')
 
     返回:
-        features: 特征向量 (numpy array)
-    """
-    # 加载模型
-    print(f"加载模型: {model_name}...")
-    model = torch.hub.load("facebookresearch/dinov2", model_name)
-    model = model.to(device)
-    model.eval()
-
-    # 图像预处理
-    transform = transforms.Compose(
-        [
-            transforms.Resize(256),
-            transforms.CenterCrop(224),
-            transforms.ToTensor(),
-            transforms.Normalize(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225]),
-        ]
-    )
+        features: 特征向量 (numpy array)；给出 outputs 时为 {输出类型: array}
+    """
+    mode = mode or BASELINE_MODE
+    preprocess = preprocess or DEFAULT_PREPROCESS
+    if cache is not None and outputs is not None:
+        raise ValueError("特征缓存只支持默认的 CLS 输出")
+    if cache is not None:
+        key = cache.make_key(
+            image_path, model_name, preprocess.cache_config(), _cache_extra(mode, tta, backend)
+        )
+        features = cache.get(key)
+        if features is not None:
+            print(f"命中特征缓存: {image_path}")
+            return features
+
+    # 获取模型 (首次调用时加载)
+    model = load_model(model_name, device, mode, backend, preprocess.resolution)
 
-    # 加载图像
-    image = Image.open(image_path).convert("RGB")
-    input_tensor = transform(image).unsqueeze(0).to(device)
+    # 加载图像并预处理
+    input_tensor = mode.prepare_input(preprocess.load_batch([image_path]), device)
 
     # 提取特征
     print(f"提取特征...")
-    with torch.no_grad():
-        features = model(input_tensor)
-
-    # 转换为 numpy
-    features = features.cpu().numpy()
+    features = _run_model(model, input_tensor, mode, outputs, tta)
+    if outputs is not None:
+        for name, value in features.items():
+            print(f"{name}: {value.shape} {value.dtype}")
+        return features
 
     print(f"特征维度: {features.shape}")
     print(f"特征范数: {np.linalg.norm(features):.4f}")
 
+    if cache is not None:
+        cache.put(key, features)
+
     return features
 
 
+def iter_features(
+    image_paths,
+    model_name="dinov2_vits14",
+    batch_size=8,
+    device="cuda",
+    num_workers=DEFAULT_NUM_WORKERS,
+    queue_depth=DEFAULT_QUEUE_DEPTH,
+    per_batch=False,
+    mode=None,
+    outputs=None,
+    preprocess=None,
+    tta=None,
+    errors=None,
+    backend="torch",
+):
+    """
+    流式提取图像特征，每完成一批就立即产出，内存占用与数据集大小无关
+
+    参数:
+        image_paths: 图像路径列表或可迭代对象 (可以是惰性生成器)
+        model_name: 模型名称
+        batch_size: 批处理大小 ('auto' 表示按机器自动调优)
+        device: 计算设备
+        num_workers: 后台解码线程数 (0 表示串行解码)
+        queue_depth: 预先解码好的批次数上限
+        per_batch: True 时按批产出 (batch_paths, features)，否则逐张产出 (path, vector)
+        mode: 推理执行模式 (ExecutionMode)，默认 fp32 + torch.no_grad
+        outputs: 需要的输出类型 (见 OUTPUT_TYPES)，为 None 时只产出 CLS 特征
+        preprocess: 预处理配置 (PreprocessConfig)，默认为标准预处理
+        tta: 可选的测试时增强，每批实际前向 K*batch_size 个视图
+        errors: 可选的 ErrorLog，给出时跳过无法读取的图像并用后续图像补齐批次
+        backend: 推理后端 ('torch' 或 'onnx')
+
+    产出:
+        (path, vector) 或 (batch_paths, features) 其中 features 形状为 (B, D)；
+        给出 outputs 时 vector/features 换成 {输出类型: array}
+    """
+    mode = mode or BASELINE_MODE
+    preprocess = preprocess or DEFAULT_PREPROCESS
+    batch_size = resolve_batch_size(
+        batch_size, model_name, device, mode, preprocess.resolution, backend
+    )
+
+    # 获取模型 (首次调用时加载)
+    model = load_model(model_name, device, mode, backend, preprocess.resolution)
+
+    # 分批处理: 后台线程解码下一批的同时，主线程对当前批推理
+    prefetcher = BatchPrefetcher(
+        image_paths,
+        preprocess,
+        batch_size=batch_size,
+        num_workers=num_workers,
+        queue_depth=queue_depth,
+        errors=errors,
+    )
+    for batch_paths, batch in prefetcher:
+        # 批处理推理
+        batch = mode.prepare_input(batch, device)
+        features = _run_model(model, batch, mode, outputs, tta)
+
+        if per_batch:
+            yield batch_paths, features
+        elif outputs is not None:
+            for i, path in enumerate(batch_paths):
+                yield path, {name: value[i] for name, value in features.items()}
+        else:
+            yield from zip(batch_paths, features)
+
+
 def batch_extract_features(
-    image_paths, model_name="dinov2_vits14", batch_size=8, device="cuda"
+    image_paths,
+    model_name="dinov2_vits14",
+    batch_size=8,
+    device="cuda",
+    num_workers=DEFAULT_NUM_WORKERS,
+    queue_depth=DEFAULT_QUEUE_DEPTH,
+    cache=None,
+    mode=None,
+    outputs=None,
+    preprocess=None,
+    tta=None,
+    errors=None,
+    backend="torch",
 ):
     """
     批量提取图像特征
@@ -66,59 +301,526 @@ def batch_extract_features(
     参数:
         image_paths: 图像路径列表
         model_name: 模型名称
-        batch_size: 批处理大小
+        batch_size: 批处理大小 ('auto' 表示按机器自动调优)
         device: 计算设备
+        num_workers: 后台解码线程数 (0 表示串行解码)
+        queue_depth: 预先解码好的批次数上限
+        cache: 可选的 FeatureCache，只对未命中的图像做推理
+        mode: 推理执行模式 (ExecutionMode)，默认 fp32 + torch.no_grad
+        outputs: 需要的输出类型 (见 OUTPUT_TYPES)，为 None 时只返回 CLS 特征
+        preprocess: 预处理配置 (PreprocessConfig)，默认为标准预处理
+        tta: 可选的测试时增强 (TestTimeAugmentation)，K 个视图在同一批次中
+            一次前向，再平均为每张图像一个特征；每批实际前向 K*batch_size 个视图
+        errors: 可选的 ErrorLog，给出时无法读取的图像被记录并跳过，不会中断整个任务
+        backend: 推理后端 ('torch' 或 'onnx')
 
     返回:
-        features_list: 特征列表
-    """
-    # 加载模型
-    model = torch.hub.load("facebookresearch/dinov2", model_name)
-    model = model.to(device)
-    model.eval()
-
-    transform = transforms.Compose(
-        [
-            transforms.Resize(256),
-            transforms.CenterCrop(224),
-            transforms.ToTensor(),
-            transforms.Normalize(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225]),
-        ]
-    )
-
-    all_features = []
-
-    # 分批处理
-    for i in range(0, len(image_paths), batch_size):
-        batch_paths = image_paths[i : i + batch_size]
+        features_list: 特征列表；给出 outputs 时为 {输出类型: 合并后的数组}
+            被跳过的图像不出现在结果中，对应路径见 errors.paths()
+    """
+    mode = mode or BASELINE_MODE
+    preprocess = preprocess or DEFAULT_PREPROCESS
+    if outputs is not None:
+        if cache is not None:
+            raise ValueError("特征缓存只支持默认的 CLS 输出")
+        return _batch_extract_outputs(
+            image_paths,
+            model_name,
+            batch_size,
+            device,
+            num_workers,
+            queue_depth,
+            mode,
+            outputs,
+            preprocess,
+            tta,
+            errors,
+            backend,
+        )
 
-        # 加载并预处理图像
-        batch_tensors = []
-        for path in batch_paths:
-            image = Image.open(path).convert("RGB")
-            tensor = transform(image)
-            batch_tensors.append(tensor)
+    all_features = [None] * len(image_paths)
+    keys = [None] * len(image_paths)
+    skipped = set()
 
-        # 批处理推理
-        batch = torch.stack(batch_tensors).to(device)
-        with torch.no_grad():
-            features = model(batch)
+    # 先查缓存，只把未命中的图像送入模型
+    if cache is not None:
+        for i, path in enumerate(image_paths):
+            try:
+                keys[i] = cache.make_key(
+                    path, model_name, preprocess.cache_config(), _cache_extra(mode, tta, backend)
+                )
+            except OSError as e:
+                # 计算缓存键要读取文件内容；文件不存在或不可读时与解码失败一样记录并跳过
+                # (PIL 的 UnidentifiedImageError 也是 OSError 的子类)
+                if errors is None:
+                    raise
+                errors.record(path, e)
+                skipped.add(i)
+                continue
+            all_features[i] = cache.get(keys[i])
+    pending = [
+        i for i, features in enumerate(all_features) if features is None and i not in skipped
+    ]
+    if cache is not None:
+        print(f"特征缓存命中 {len(image_paths) - len(pending) - len(skipped)}/{len(image_paths)} 张")
 
-        all_features.append(features.cpu().numpy())
+    processed = 0
+    if pending:
+        stream = iter_features(
+            [image_paths[i] for i in pending],
+            model_name,
+            batch_size=batch_size,
+            device=device,
+            num_workers=num_workers,
+            queue_depth=queue_depth,
+            per_batch=True,
+            mode=mode,
+            preprocess=preprocess,
+            tta=tta,
+            errors=errors,
+            backend=backend,
+        )
+        position = 0
+        for batch_idx, (batch_paths, features) in enumerate(stream, 1):
+            for path, vector in zip(batch_paths, features):
+                # 被跳过的图像不会出现在流中，按顺序对齐到下一个匹配的路径
+                while image_paths[pending[position]] != path:
+                    position += 1
+                idx = pending[position]
+                position += 1
+                all_features[idx] = vector
+                if cache is not None:
+                    cache.put(keys[idx], vector)
+                processed += 1
 
-        if (i // batch_size + 1) % 10 == 0:
-            print(
-                f"已处理 {min(i + batch_size, len(image_paths))}/{len(image_paths)} 张图像"
-            )
+            if batch_idx % 10 == 0:
+                print(f"已处理 {processed}/{len(pending)} 张图像")
 
     # 合并所有特征
+    all_features = [features for features in all_features if features is not None]
+    if not all_features:
+        raise ValueError("没有可用的特征: 所有图像都无法读取")
     all_features = np.vstack(all_features)
     print(f"\n总特征数量: {all_features.shape[0]}")
     print(f"特征维度: {all_features.shape[1]}")
+    if cache is not None:
+        print(f"缓存统计: {cache.stats()}")
+    if errors:
+        print(f"跳过无法读取的图像: {len(errors)} 张")
 
     return all_features
 
 
+def _batch_extract_outputs(
+    image_paths,
+    model_name,
+    batch_size,
+    device,
+    num_workers,
+    queue_depth,
+    mode,
+    outputs,
+    preprocess,
+    tta,
+    errors,
+    backend,
+):
+    """batch_extract_features 的多输出版本，按输出类型分别合并"""
+    collected = {name: [] for name in outputs}
+    processed = 0
+
+    stream = iter_features(
+        image_paths,
+        model_name,
+        batch_size=batch_size,
+        device=device,
+        num_workers=num_workers,
+        queue_depth=queue_depth,
+        per_batch=True,
+        mode=mode,
+        outputs=outputs,
+        preprocess=preprocess,
+        tta=tta,
+        errors=errors,
+        backend=backend,
+    )
+    for batch_idx, (batch_paths, results) in enumerate(stream, 1):
+        for name, value in results.items():
+            collected[name].append(value)
+        processed += len(batch_paths)
+
+        if batch_idx % 10 == 0:
+            print(f"已处理 {processed}/{len(image_paths)} 张图像")
+
+    all_outputs = {name: np.concatenate(values) for name, values in collected.items()}
+    print(f"\n总图像数量: {processed}")
+    for name, value in all_outputs.items():
+        print(f"{name}: {value.shape} {value.dtype}")
+
+    return all_outputs
+
+
+def collect_image_paths(input_dir, extensions=IMAGE_EXTENSIONS, recursive=True):
+    """
+    收集目录下的图像文件 (扩展名不区分大小写)
+
+    返回:
+        image_paths: 排序后的绝对路径列表，保证多次运行顺序一致
+    """
+    root = Path(input_dir).resolve()
+    pattern = "**/*" if recursive else "*"
+    extensions = {ext.lower() for ext in extensions}
+    return sorted(
+        str(p) for p in root.glob(pattern) if p.is_file() and p.suffix.lower() in extensions
+    )
+
+
+class ProgressMeter:
+    """
+    实时打印已处理数量、处理速度与预计剩余时间
+
+    参数:
+        total: 待处理总数 (未知时为 None，只显示速度)
+        interval: 两次刷新之间的最短秒数
+    """
+
+    def __init__(self, total=None, interval=1.0):
+        self.total = total
+        self.interval = interval
+        self.count = 0
+        self.start = time.perf_counter()
+        self._last = 0.0
+
+    @property
+    def rate(self):
+        elapsed = time.perf_counter() - self.start
+        return self.count / elapsed if elapsed > 0 else 0.0
+
+    @staticmethod
+    def _format_seconds(seconds):
+        seconds = int(seconds)
+        return f"{seconds // 3600}:{seconds % 3600 // 60:02d}:{seconds % 60:02d}"
+
+    def update(self, n):
+        self.count += n
+        now = time.perf_counter()
+        if now - self._last >= self.interval:
+            self._last = now
+            print(f"\r{self._line()}", end="", flush=True)
+
+    def _line(self):
+        rate = self.rate
+        if self.total:
+            eta = (self.total - self.count) / rate if rate > 0 else 0
+            return (
+                f"已处理 {self.count}/{self.total} 张 | {rate:.2f} images/sec | "
+                f"剩余 {self._format_seconds(eta)}"
+            )
+        return f"已处理 {self.count} 张 | {rate:.2f} images/sec"
+
+    def close(self):
+        elapsed = time.perf_counter() - self.start
+        print(f"\r{self._line()} | 用时 {self._format_seconds(elapsed)}")
+
+
+def extract_to_store(
+    image_paths,
+    store_dir,
+    model_name="dinov2_vits14",
+    batch_size=8,
+    device="cuda",
+    num_workers=DEFAULT_NUM_WORKERS,
+    queue_depth=DEFAULT_QUEUE_DEPTH,
+    shard_size=DEFAULT_SHARD_SIZE,
+    mode=None,
+    checkpoint_every=DEFAULT_CHECKPOINT_EVERY,
+    progress=False,
+    preprocess=None,
+    tta=None,
+    errors=None,
+    backend="torch",
+):
+    """
+    流式提取特征并逐批写入分片特征存储，支持断点续跑
+
+    存储本身就是检查点: 每 checkpoint_every 批落盘一次清单，
+    重新运行时跳过存储中已有的路径，只处理剩余图像
+
+    参数:
+        image_paths: 图像路径列表或可迭代对象
+        store_dir: 特征存储目录 (不存在则新建，存在则继续追加)
+        model_name: 模型名称
+        batch_size: 批处理大小 ('auto' 表示按机器自动调优)
+        device: 计算设备
+        num_workers: 后台解码线程数
+        queue_depth: 预先解码好的批次数上限
+        shard_size: 每个分片的行数
+        mode: 推理执行模式 (ExecutionMode)
+        checkpoint_every: 每处理多少批落盘一次检查点
+        progress: 是否实时打印速度与剩余时间
+        preprocess: 预处理配置 (PreprocessConfig)，默认为标准预处理
+        tta: 可选的测试时增强 (TestTimeAugmentation)
+        errors: 可选的 ErrorLog，给出时跳过无法读取的图像 (重新运行时会再次尝试)
+        backend: 推理后端 ('torch' 或 'onnx')
+
+    返回:
+        store: 已关闭的 FeatureStore，可用 FeatureStore.open() 重新只读打开
+    """
+    mode = mode or BASELINE_MODE
+    preprocess = preprocess or DEFAULT_PREPROCESS
+    store = FeatureStore.open_or_create(
+        store_dir,
+        model_name=model_name,
+        shard_size=shard_size,
+        extra={
+            "precision": mode.precision,
+            "preprocess": preprocess.describe(),
+            "tta": tta.describe() if tta is not None else None,
+            "backend": backend,
+        },
+    )
+    if store.model_name != model_name:
+        store.close()
+        raise ValueError(f"存储中的特征来自 {store.model_name}，与当前模型 {model_name} 不一致")
+
+    # 跳过已经写入存储的图像
+    done = set(store.paths)
+    if isinstance(image_paths, (list, tuple)):
+        pending = [p for p in image_paths if str(p) not in done]
+        total = len(pending)
+    else:
+        pending = (p for p in image_paths if str(p) not in done)
+        total = None
+    if done:
+        remaining = total if total is not None else "未知"
+        print(f"从检查点恢复: 已完成 {len(done)} 张，剩余 {remaining} 张")
+
+    meter = ProgressMeter(total) if progress else None
+    with store:
+        stream = iter_features(
+            pending,
+            model_name,
+            batch_size=batch_size,
+            device=device,
+            num_workers=num_workers,
+            queue_depth=queue_depth,
+            per_batch=True,
+            mode=mode,
+            preprocess=preprocess,
+            tta=tta,
+            errors=errors,
+            backend=backend,
+        )
+        skipped = 0
+        for batch_idx, (batch_paths, features) in enumerate(stream, 1):
+            store.append(batch_paths, features)
+            if meter is not None:
+                # 被跳过的图像同样计入进度
+                done_errors = len(errors) if errors is not None else 0
+                meter.update(len(batch_paths) + done_errors - skipped)
+                skipped = done_errors
+            if batch_idx % checkpoint_every == 0:
+                store.flush()
+
+    if meter is not None:
+        if errors is not None:
+            meter.update(len(errors) - skipped)
+        meter.close()
+    print(f"\n特征已写入存储: {store_dir} ({len(store)} 条)")
+    if errors:
+        where = f"，清单: {errors.path}" if errors.path else ""
+        print(f"跳过无法读取的图像: {len(errors)} 张{where}")
+    return store
+
+
+def _forward_batches(model, batches, mode, device):
+    """对预处理好的批次逐批推理，返回合并后的特征"""
+    outputs = []
+    with mode.grad_context():
+        for batch in batches:
+            outputs.append(mode.to_numpy(model(mode.prepare_input(batch, device))))
+    if device == "cuda":
+        import torch
+
+        torch.cuda.synchronize()
+    return np.vstack(outputs)
+
+
+def benchmark_execution_mode(
+    image_paths,
+    mode,
+    model_name="dinov2_vits14",
+    batch_size=8,
+    device="cuda",
+    repeats=3,
+):
+    """
+    对比执行模式与 fp32 基准的吞吐量和特征偏差
+
+    图像只解码一次，计时只覆盖模型前向，避免解码耗时掩盖推理差异
+
+    参数:
+        image_paths: 图像路径列表
+        mode: 待评估的执行模式 (ExecutionMode)
+        model_name: 模型名称
+        batch_size: 批处理大小 ('auto' 表示按机器自动调优)
+        device: 计算设备
+        repeats: 计时重复次数
+
+    返回:
+        report: 包含两种模式吞吐量、加速比、最大绝对偏差和余弦相似度的字典
+    """
+    batch_size = resolve_batch_size(batch_size, model_name, device, mode)
+    batches = [
+        DEFAULT_PREPROCESS.load_batch(image_paths[i : i + batch_size])
+        for i in range(0, len(image_paths), batch_size)
+    ]
+
+    from model_registry import get_model
+
+    report = {"num_images": len(image_paths), "batch_size": batch_size}
+    outputs = {}
+    for name, m in (("baseline", BASELINE_MODE), ("mode", mode)):
+        model = get_model(model_name, device, m.dtype, **m.model_options)
+        # 预热 (torch.compile 在这里完成编译)
+        outputs[name] = _forward_batches(model, batches, m, device)
+
+        start = time.perf_counter()
+        for _ in range(repeats):
+            _forward_batches(model, batches, m, device)
+        elapsed = (time.perf_counter() - start) / repeats
+        report[name] = {
+            "mode": m.describe(),
+            "seconds": elapsed,
+            "images_per_sec": len(image_paths) / elapsed,
+        }
+
+    baseline, candidate = outputs["baseline"], outputs["mode"]
+    cosine = np.sum(baseline * candidate, axis=1) / (
+        np.linalg.norm(baseline, axis=1) * np.linalg.norm(candidate, axis=1)
+    )
+    report["speedup"] = report["baseline"]["seconds"] / report["mode"]["seconds"]
+    report["max_abs_deviation"] = float(np.max(np.abs(baseline - candidate)))
+    report["min_cosine"] = float(np.min(cosine))
+    report["mean_cosine"] = float(np.mean(cosine))
+    return report
+
+
+def print_benchmark_report(report):
+    """打印执行模式对比报告"""
+    print("\n" + "=" * 60)
+    print("执行模式对比")
+    print("=" * 60)
+    print(f"  图像数量: {report['num_images']}  批大小: {report['batch_size']}")
+    for name in ("baseline", "mode"):
+        r = report[name]
+        print(f"  {r['mode']:<35} {r['images_per_sec']:>8.2f} images/sec")
+    print(f"  加速比: {report['speedup']:.2f}x")
+    print(f"  最大特征偏差 (vs fp32): {report['max_abs_deviation']:.6f}")
+    print(f"  最小余弦相似度 (vs fp32): {report['min_cosine']:.6f}")
+    print(f"  平均余弦相似度 (vs fp32): {report['mean_cosine']:.6f}")
+
+
+def top1_neighbors(features):
+    """每张图像在同一组图像中的最近邻索引 (余弦相似度，排除自身)"""
+    normed = features / np.linalg.norm(features, axis=1, keepdims=True)
+    similarity = normed @ normed.T
+    np.fill_diagonal(similarity, -np.inf)
+    return similarity.argmax(axis=1)
+
+
+def benchmark_resolutions(
+    image_paths,
+    resolutions,
+    model_name="dinov2_vits14",
+    batch_size=8,
+    device="cuda",
+    repeats=3,
+    fast_decode=False,
+):
+    """
+    对比不同输入分辨率的吞吐量，以及最近邻检索结果与 224 基准的一致程度
+
+    每个分辨率的图像只解码一次，计时只覆盖模型前向
+
+    参数:
+        image_paths: 图像路径列表 (至少 2 张)
+        resolutions: 待比较的分辨率 (14 的倍数)，224 基准会自动加入
+        model_name: 模型名称
+        batch_size: 批处理大小
+        device: 计算设备
+        repeats: 计时重复次数
+        fast_decode: 是否使用缩放解码
+
+    返回:
+        report: {"num_images", "batch_size", "results": [...]}，每个分辨率一项:
+            resolution、tokens (patch token 数)、images_per_sec、speedup (相对 224)、
+            top1_agreement (最近邻与 224 基准相同的比例)、mean_cosine (与 224 特征的余弦相似度)
+    """
+    from model_registry import get_model
+
+    if len(image_paths) < 2:
+        raise ValueError("最近邻一致性至少需要 2 张图像")
+    baseline = TRANSFORM_CONFIG["crop"]
+    resolutions = sorted(set(resolutions) | {baseline})
+    model = get_model(model_name, device)
+
+    features = {}
+    results = []
+    for resolution in resolutions:
+        preprocess = PreprocessConfig(fast_decode=fast_decode, resolution=resolution)
+        batches = [
+            preprocess.load_batch(image_paths[i : i + batch_size])
+            for i in range(0, len(image_paths), batch_size)
+        ]
+        # 预热
+        features[resolution] = _forward_batches(model, batches, BASELINE_MODE, device)
+
+        start = time.perf_counter()
+        for _ in range(repeats):
+            _forward_batches(model, batches, BASELINE_MODE, device)
+        elapsed = (time.perf_counter() - start) / repeats
+        results.append(
+            {
+                "resolution": resolution,
+                "tokens": (resolution // PATCH_SIZE) ** 2,
+                "seconds": elapsed,
+                "images_per_sec": len(image_paths) / elapsed,
+            }
+        )
+
+    reference = features[baseline]
+    reference_nn = top1_neighbors(reference)
+    baseline_seconds = next(r["seconds"] for r in results if r["resolution"] == baseline)
+    for r in results:
+        candidate = features[r["resolution"]]
+        cosine = np.sum(reference * candidate, axis=1) / (
+            np.linalg.norm(reference, axis=1) * np.linalg.norm(candidate, axis=1)
+        )
+        r["speedup"] = baseline_seconds / r["seconds"]
+        r["top1_agreement"] = float(np.mean(top1_neighbors(candidate) == reference_nn))
+        r["mean_cosine"] = float(np.mean(cosine))
+
+    return {"num_images": len(image_paths), "batch_size": batch_size, "results": results}
+
+
+def print_resolution_report(report):
+    """打印分辨率对比报告"""
+    print("\n" + "=" * 60)
+    print("分辨率对比 (基准 224)")
+    print("=" * 60)
+    print(f"  图像数量: {report['num_images']}  批大小: {report['batch_size']}")
+    print(
+        f"  {'分辨率':<8} {'tokens':>6} {'images/sec':>12} {'加速比':>8} "
+        f"{'top-1 一致':>10} {'余弦(vs 224)':>12}"
+    )
+    for r in report["results"]:
+        print(
+            f"  {r['resolution']:<8} {r['tokens']:>6} {r['images_per_sec']:>12.2f} "
+            f"{r['speedup']:>7.2f}x {r['top1_agreement']:>10.1%} {r['mean_cosine']:>12.4f}"
+        )
+
+
 def compute_similarity(features1, features2):
     """
     计算两组特征之间的余弦相似度
@@ -140,41 +842,283 @@ def compute_similarity(features1, features2):
     return similarity
 
 
+def load_model_timed(
+    model_name, device, mode, import_sec=0.0, backend="torch", resolution=None
+):
+    """
+    加载模型，打印从启动到模型就绪的耗时
+
+    参数:
+        model_name: 模型名称
+        device: 计算设备
+        mode: 推理执行模式 (ExecutionMode)
+        import_sec: 调用方导入 torch 与模型注册表花费的时间
+        backend: 推理后端 ('torch' 或 'onnx')
+        resolution: ONNX 模型的输入分辨率
+
+    返回:
+        timings: {"import_sec", "load_sec", "total_sec"}
+    """
+    start = time.perf_counter()
+    load_model(model_name, device, mode, backend, resolution)
+    ready = time.perf_counter()
+
+    timings = {
+        "import_sec": import_sec,
+        "load_sec": ready - start,
+        "total_sec": ready - _PROCESS_START,
+    }
+    print(
+        f"启动耗时: {timings['total_sec']:.2f} 秒 "
+        f"(导入 torch {timings['import_sec']:.2f} 秒, 加载模型 {timings['load_sec']:.2f} 秒)"
+    )
+    return timings
+
+
 def main():
     """示例主函数"""
     import argparse
 
     parser = argparse.ArgumentParser(description="DINOv2 特征提取示例")
     parser.add_argument("--image", type=str, help="输入图像路径")
+    parser.add_argument(
+        "--input-dir", type=str, help="输入图像目录 (递归查找 jpg/jpeg/png/webp/bmp)"
+    )
+    parser.add_argument(
+        "--output",
+        type=str,
+        default="features_store",
+        help="目录模式的特征存储目录 (已存在时从检查点继续)",
+    )
+    parser.add_argument(
+        "--checkpoint-every",
+        type=int,
+        default=DEFAULT_CHECKPOINT_EVERY,
+        help="目录模式每处理多少批保存一次检查点",
+    )
+    parser.add_argument(
+        "--fail-fast",
+        action="store_true",
+        help="目录模式遇到无法读取的图像时立即停止 (默认跳过并记入存储目录下的 errors.jsonl)",
+    )
+    parser.add_argument(
+        "--num-workers", type=int, default=DEFAULT_NUM_WORKERS, help="后台解码线程数"
+    )
+    parser.add_argument(
+        "--num-procs",
+        type=int,
+        default=1,
+        help="目录模式的工作进程数，大于 1 时按路径分片并行提取后合并",
+    )
+    parser.add_argument(
+        "--threads-per-proc",
+        type=int,
+        default=None,
+        help="每个工作进程的 torch 线程数 (默认平分 CPU 核心)",
+    )
+    parser.add_argument(
+        "--queue-depth", type=int, default=DEFAULT_QUEUE_DEPTH, help="预取批次数上限"
+    )
     parser.add_argument(
         "--model",
         type=str,
         default="dinov2_vits14",
-        choices=["dinov2_vits14", "dinov2_vitb14", "dinov2_vitl14", "dinov2_vitg14"],
+        choices=MODEL_NAMES,
         help="模型名称",
     )
     parser.add_argument(
         "--device", type=str, default="cuda", choices=["cuda", "cpu"], help="计算设备"
     )
+    parser.add_argument(
+        "--backend",
+        type=str,
+        default="torch",
+        choices=BACKENDS,
+        help="推理后端: onnx 使用 ONNX Runtime (导出文件不存在时自动导出，只支持 fp32 CLS 输出)",
+    )
+    parser.add_argument(
+        "--model-source",
+        type=str,
+        default="auto",
+        choices=["auto", "local", "hub"],
+        help="模型来源: local 从本地检查点离线构建，hub 使用 torch.hub，auto 优先本地",
+    )
+    parser.add_argument(
+        "--checkpoint-dir",
+        type=str,
+        default=None,
+        help="本地检查点目录 (默认 $DINOV2_CHECKPOINT_DIR 或 $TORCH_HOME/hub/checkpoints)",
+    )
+    parser.add_argument(
+        "--measure-startup",
+        action="store_true",
+        help="只加载模型并报告启动耗时",
+    )
+    parser.add_argument(
+        "--cache-dir", type=str, default=None, help="单张图像模式的特征缓存目录 (内容未变的图像跳过推理；目录模式不可用)"
+    )
+    parser.add_argument(
+        "--batch-size",
+        type=batch_size_arg,
+        default=8,
+        help="批处理大小 (正整数或 auto: 按机器自动调优并缓存结果)",
+    )
+    add_execution_args(parser)
+    add_preprocess_args(parser)
+    add_tta_args(parser)
+    parser.add_argument(
+        "--outputs",
+        nargs="+",
+        choices=OUTPUT_TYPES,
+        default=None,
+        help="单张图像模式单次前向同时输出的类型 (cls/patch_mean/patch_grid)，结果保存为 .npz；目录模式不可用",
+    )
+    parser.add_argument(
+        "--benchmark",
+        action="store_true",
+        help="对比所选执行模式与 fp32 基准的吞吐量和特征偏差",
+    )
 
     args = parser.parse_args()
+    if args.input_dir and not args.benchmark:
+        # 目录模式写入只保存 CLS 特征的特征存储，并靠存储自身的检查点跳过已完成的图像
+        unsupported = [
+            flag
+            for flag, value in (("--outputs", args.outputs), ("--cache-dir", args.cache_dir))
+            if value
+        ]
+        if unsupported:
+            parser.error(
+                f"{' 与 '.join(unsupported)} 不能与 --input-dir 同时使用: "
+                "目录模式只写入 CLS 特征，断点续跑由特征存储的检查点完成"
+            )
+    mode = mode_from_args(args)
+    preprocess = preprocess_from_args(args)
+    tta = tta_from_args(args)
+
+    # 多进程模式下模型在各工作进程中加载，主进程不需要
+    sharded = args.input_dir and args.num_procs > 1 and not args.benchmark
+    needs_model = args.measure_startup or args.benchmark or args.input_dir or args.image
+    if needs_model:
+        import_start = time.perf_counter()
+        import torch
+
+        from model_registry import get_registry
+
+        import_sec = time.perf_counter() - import_start
+
+        # 检查设备可用性
+        if args.device == "cuda" and not torch.cuda.is_available():
+            print("警告: CUDA 不可用，切换到 CPU")
+            args.device = "cpu"
+
+        registry = get_registry()
+        registry.source = args.model_source
+        registry.checkpoint_dir = args.checkpoint_dir
+        if not sharded or args.measure_startup:
+            load_model_timed(
+                args.model, args.device, mode, import_sec, args.backend, preprocess.resolution
+            )
+
+    if args.measure_startup:
+        return
+
+    if args.benchmark:
+        # 执行模式对比: 默认使用示例测试图片
+        if args.image:
+            image_paths = [args.image]
+        else:
+            image_paths = sorted(str(p) for p in DEFAULT_IMAGE_DIR.glob("*.jpg"))
+        report = benchmark_execution_mode(
+            image_paths, mode, args.model, args.batch_size, args.device
+        )
+        print_benchmark_report(report)
 
-    # 检查设备可用性
-    if args.device == "cuda" and not torch.cuda.is_available():
-        print("警告: CUDA 不可用，切换到 CPU")
-        args.device = "cpu"
+    elif args.input_dir:
+        # 目录模式: 批量提取并写入特征存储，中断后重新运行同一命令即可继续
+        if not Path(args.input_dir).is_dir():
+            print(f"错误: 目录不存在: {args.input_dir}")
+            return
+        image_paths = collect_image_paths(args.input_dir)
+        print(f"找到 {len(image_paths)} 张图像: {args.input_dir}")
+
+        if sharded:
+            from sharded import extract_sharded, print_sharded_report
+
+            try:
+                report = extract_sharded(
+                    image_paths,
+                    args.output,
+                    args.model,
+                    num_procs=args.num_procs,
+                    threads_per_worker=args.threads_per_proc,
+                    batch_size=args.batch_size,
+                    device=args.device,
+                    num_workers=args.num_workers,
+                    queue_depth=args.queue_depth,
+                    mode=mode,
+                    checkpoint_every=args.checkpoint_every,
+                    preprocess=preprocess,
+                    tta=tta,
+                    skip_errors=not args.fail_fast,
+                    model_source=args.model_source,
+                    checkpoint_dir=args.checkpoint_dir,
+                    backend=args.backend,
+                )
+            except KeyboardInterrupt:
+                print("\n已中断: 各工作进程已完成的批次已保存，重新运行同一命令即可继续")
+                return
+            print_sharded_report(report)
+            return
 
-    if args.image:
+        try:
+            extract_to_store(
+                image_paths,
+                args.output,
+                args.model,
+                batch_size=args.batch_size,
+                device=args.device,
+                num_workers=args.num_workers,
+                queue_depth=args.queue_depth,
+                mode=mode,
+                checkpoint_every=args.checkpoint_every,
+                progress=True,
+                preprocess=preprocess,
+                tta=tta,
+                errors=None if args.fail_fast else ErrorLog(Path(args.output) / ERRORS_NAME),
+                backend=args.backend,
+            )
+        except KeyboardInterrupt:
+            print("\n已中断: 已完成的批次已保存，重新运行同一命令即可继续")
+        if preprocess.crop_cache is not None:
+            print(f"裁剪缓存统计: {preprocess.crop_cache.stats()}")
+
+    elif args.image:
         # 单张图像特征提取
         if not Path(args.image).exists():
             print(f"错误: 图像不存在: {args.image}")
             return
 
-        features = extract_features(args.image, args.model, args.device)
+        cache = FeatureCache(args.cache_dir) if args.cache_dir else None
+        features = extract_features(
+            args.image,
+            args.model,
+            args.device,
+            cache=cache,
+            mode=mode,
+            outputs=args.outputs,
+            preprocess=preprocess,
+            tta=tta,
+            backend=args.backend,
+        )
 
         # 保存特征
-        output_path = Path(args.image).stem + "_features.npy"
-        np.save(output_path, features)
+        if args.outputs:
+            output_path = Path(args.image).stem + "_features.npz"
+            np.savez(output_path, **features)
+        else:
+            output_path = Path(args.image).stem + "_features.npy"
+            np.save(output_path, features)
         print(f"\n特征已保存到: {output_path}")
 
     else:
@@ -192,6 +1136,12 @@ def main():
         print(
             f"  python examples/extract_features.py --image path/to/image.jpg --model dinov2_vitb14"
         )
+        print(
+            f"  python examples/extract_features.py --input-dir data/ --output output/features_store"
+        )
+        print(
+            f"  python examples/extract_features.py --benchmark --device cpu --precision bf16 --inference-mode"
+        )
 
 
 if __name__ == "__main__":
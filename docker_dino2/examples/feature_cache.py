@@ -0,0 +1,214 @@
+#!/usr/bin/env python3
+"""
+DINOv2 特征缓存
+以 (图像内容哈希, 模型名称, 预处理配置) 为键把特征持久化到磁盘，
+图像内容、模型与预处理都未变化时直接复用，跳过重复提取
+"""
+
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from pathlib import Path
+
+import numpy as np
+
+DEFAULT_MAX_BYTES = 2 * 1024**3
+# 进程内记忆的图像内容哈希条数上限 (长时间运行的服务中按 LRU 淘汰)
+DEFAULT_MAX_DIGESTS = 100_000
+_CHUNK_SIZE = 1024 * 1024
+
+
+def file_digest(path):
+    """计算文件内容的 SHA-256"""
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(_CHUNK_SIZE), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class DigestMemo:
+    """
+    文件内容哈希的进程内记忆，按 (路径, 大小, 修改时间) 查找
+
+    最多记忆 max_entries 条，超出时淘汰最久未用的；可在多个线程中共用
+
+    参数:
+        max_entries: 记忆条数上限
+    """
+
+    def __init__(self, max_entries=DEFAULT_MAX_DIGESTS):
+        self.max_entries = max_entries
+        self._digests = OrderedDict()
+        self._lock = threading.Lock()
+
+    def digest(self, path):
+        """返回文件内容的 SHA-256，文件未变化时不重复读取"""
+        st = os.stat(path)
+        memo_key = (str(path), st.st_size, st.st_mtime_ns)
+        with self._lock:
+            digest = self._digests.get(memo_key)
+            if digest is not None:
+                self._digests.move_to_end(memo_key)
+                return digest
+        # 在锁外读文件，不阻塞其他线程的查询
+        digest = file_digest(path)
+        with self._lock:
+            self._digests[memo_key] = digest
+            while len(self._digests) > self.max_entries:
+                self._digests.popitem(last=False)
+        return digest
+
+    def __len__(self):
+        return len(self._digests)
+
+    def __iter__(self):
+        """按从旧到新的顺序返回记忆的 (路径, 大小, 修改时间)"""
+        with self._lock:
+            return iter(list(self._digests))
+
+
+class FeatureCache:
+    """
+    内容寻址的磁盘特征缓存
+
+    每条特征保存为 <root>/<key[:2]>/<key>.npy，命中时刷新修改时间，
+    超过 max_bytes 后按最久未使用的顺序淘汰。
+
+    参数:
+        root: 缓存目录
+        max_bytes: 缓存总大小上限 (字节)
+        max_digests: 进程内记忆的内容哈希条数上限
+    """
+
+    def __init__(self, root, max_bytes=DEFAULT_MAX_BYTES, max_digests=DEFAULT_MAX_DIGESTS):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._total_bytes = None
+        self._digests = DigestMemo(max_digests)
+        self._lock = threading.Lock()
+
+    def content_hash(self, path):
+        """
+        图像内容哈希，按 (路径, 大小, 修改时间) 在进程内记忆，
+        同一次运行中重复查询不会重复读文件；最多记忆 max_digests 条 (见 DigestMemo)
+        """
+        return self._digests.digest(path)
+
+    def make_key(self, path, model_name, transform_config, extra=None):
+        """
+        生成缓存键
+
+        参数:
+            path: 图像路径
+            model_name: 模型名称
+            transform_config: 预处理参数 (dict)
+            extra: 其他影响特征结果的参数 (例如精度、输出类型)
+        """
+        payload = json.dumps(
+            {
+                "content": self.content_hash(path),
+                "model": model_name,
+                "transform": transform_config,
+                "extra": extra,
+            },
+            sort_keys=True,
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _entry_path(self, key):
+        return self.root / key[:2] / f"{key}.npy"
+
+    def get(self, key):
+        """命中返回特征数组，否则返回 None"""
+        entry = self._entry_path(key)
+        try:
+            features = np.load(entry)
+        except (FileNotFoundError, ValueError, OSError):
+            with self._lock:
+                self.misses += 1
+            return None
+        # 刷新修改时间，作为 LRU 淘汰依据；读取后条目可能已被其他进程淘汰，按未命中处理
+        try:
+            os.utime(entry)
+        except FileNotFoundError:
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+        return features
+
+    def put(self, key, features):
+        """写入一条特征 (先写临时文件再原子替换)"""
+        entry = self._entry_path(key)
+        entry.parent.mkdir(parents=True, exist_ok=True)
+        tmp = entry.with_name(f"{entry.stem}.{os.getpid()}.{threading.get_ident()}.tmp")
+        with open(tmp, "wb") as f:
+            np.save(f, np.asarray(features))
+
+        with self._lock:
+            # 在替换前取得总大小 (首次会扫描磁盘)；覆盖已有条目时减去旧文件的大小，避免总量漂移
+            total = self.total_bytes()
+            try:
+                old_size = entry.stat().st_size
+            except FileNotFoundError:
+                old_size = 0
+            os.replace(tmp, entry)
+            self._total_bytes = total - old_size + entry.stat().st_size
+            if self._total_bytes > self.max_bytes:
+                self._evict()
+
+    def _entries(self):
+        return [p for p in self.root.glob("??/*.npy") if p.is_file()]
+
+    def total_bytes(self):
+        if self._total_bytes is None:
+            self._total_bytes = sum(p.stat().st_size for p in self._entries())
+        return self._total_bytes
+
+    def _evict(self):
+        # 淘汰到上限的 90%，避免每次写入都触发全目录扫描
+        target = int(self.max_bytes * 0.9)
+        entries = []
+        for p in self._entries():
+            try:
+                st = p.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((st.st_mtime, st.st_size, p))
+        entries.sort()
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, p in entries:
+            if total <= target:
+                break
+            try:
+                p.unlink()
+            except FileNotFoundError:
+                pass
+            total -= size
+            self.evictions += 1
+        self._total_bytes = total
+
+    def clear(self):
+        for p in self._entries():
+            p.unlink()
+        self._total_bytes = 0
+
+    def stats(self):
+        """返回命中/未命中计数、淘汰次数与当前占用"""
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "evictions": self.evictions,
+            "bytes": self.total_bytes(),
+        }
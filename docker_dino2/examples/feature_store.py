@@ -0,0 +1,382 @@
+#!/usr/bin/env python3
+"""
+DINOv2 特征存储
+以固定行数的内存映射分片增量写入特征，并用清单文件记录元数据
+
+目录结构:
+    store/
+    ├── manifest.json      # 模型名称、数据类型、特征维度、各分片的行偏移
+    ├── paths.txt          # 每行一个图像路径，与特征行一一对应 (仅追加)
+    ├── shard_00000.npy    # 固定大小的 .npy 分片 (可 np.load(mmap_mode="r"))
+    └── shard_00001.npy
+"""
+
+import json
+import os
+import shutil
+from contextlib import ExitStack
+from pathlib import Path
+
+import numpy as np
+
+MANIFEST_NAME = "manifest.json"
+PATHS_NAME = "paths.txt"
+DEFAULT_SHARD_SIZE = 16384
+# 合并时的临时目录与被替换下来的旧存储目录后缀
+MERGING_SUFFIX = ".merging"
+REPLACED_SUFFIX = ".replaced"
+
+
+class FeatureStore:
+    """
+    追加写入的分片特征存储
+
+    使用 FeatureStore.create() 新建，FeatureStore.open() 打开已有存储。
+    读取任意行区间都只映射涉及的分片，不会加载整个数据集。
+    """
+
+    def __init__(self, root, manifest, mode="r"):
+        self.root = Path(root)
+        self.manifest = manifest
+        self.mode = mode
+        self._shards = {}
+        self._paths = None
+        self._paths_file = None
+
+    # ------------------------------------------------------------------
+    # 创建与打开
+    # ------------------------------------------------------------------
+    @classmethod
+    def create(
+        cls,
+        root,
+        dim=None,
+        dtype="float32",
+        model_name=None,
+        shard_size=DEFAULT_SHARD_SIZE,
+        extra=None,
+    ):
+        """
+        新建空的特征存储
+
+        参数:
+            root: 存储目录
+            dim: 特征维度 (为 None 时由第一次写入决定)
+            dtype: 特征数据类型
+            model_name: 生成特征所用的模型名称
+            shard_size: 每个分片的行数
+            extra: 额外写入清单的元数据 (dict)
+
+        返回:
+            store: 可追加写入的 FeatureStore
+        """
+        root = Path(root)
+        if (root / MANIFEST_NAME).exists():
+            raise FileExistsError(f"特征存储已存在: {root}")
+        root.mkdir(parents=True, exist_ok=True)
+
+        manifest = {
+            "version": 1,
+            "model_name": model_name,
+            "dtype": np.dtype(dtype).name,
+            "dim": dim,
+            "shard_size": shard_size,
+            "num_rows": 0,
+            "paths_file": PATHS_NAME,
+            "shards": [],
+            "extra": extra or {},
+        }
+        (root / PATHS_NAME).touch()
+        store = cls(root, manifest, mode="a")
+        store._write_manifest()
+        return store
+
+    @classmethod
+    def open(cls, root, mode="r"):
+        """
+        打开已有的特征存储
+
+        参数:
+            root: 存储目录
+            mode: 'r' 只读，'a' 继续追加
+        """
+        root = Path(root)
+        with open(root / MANIFEST_NAME, "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+        store = cls(root, manifest, mode=mode)
+        if mode == "a":
+            store._truncate_paths()
+        return store
+
+    @classmethod
+    def open_or_create(cls, root, **kwargs):
+        """存储存在则以追加模式打开，否则新建"""
+        if (Path(root) / MANIFEST_NAME).exists():
+            return cls.open(root, mode="a")
+        return cls.create(root, **kwargs)
+
+    @classmethod
+    def merge(cls, root, sources, shard_size=None, overwrite=False):
+        """
+        按顺序把多个特征存储合并为一个新存储，行顺序为各来源依次拼接
+
+        先写入临时目录，完成后把旧的 root 移到一旁、换入新存储，最后才删除旧存储；
+        任何时刻崩溃都至少保留一份完整存储，下次调用 recover() 或 merge() 时恢复
+
+        参数:
+            root: 合并后的存储目录
+            sources: 来源存储目录列表 (模型与特征维度必须一致)，可以包含 root 本身
+            shard_size: 合并后每个分片的行数，默认与第一个来源相同
+            overwrite: root 已存在时是否替换
+
+        返回:
+            store: 已关闭的合并后存储
+        """
+        root = Path(root)
+        cls.recover(root)
+        if (root / MANIFEST_NAME).exists() and not overwrite:
+            raise FileExistsError(f"特征存储已存在: {root}")
+        if not sources:
+            raise ValueError("没有可合并的特征存储")
+
+        tmp = root.with_name(root.name + MERGING_SUFFIX)
+        if tmp.exists():
+            shutil.rmtree(tmp)
+        # 来源中可能包含 root 本身，替换前关闭全部来源，释放其内存映射
+        with ExitStack() as stack:
+            stores = [stack.enter_context(cls.open(source)) for source in sources]
+            first = stores[0]
+            for store in stores[1:]:
+                if store.model_name != first.model_name or (
+                    store.dim and first.dim and store.dim != first.dim
+                ):
+                    raise ValueError(
+                        f"无法合并不同模型或维度的存储: {first.root} ({first.model_name}, {first.dim}) "
+                        f"与 {store.root} ({store.model_name}, {store.dim})"
+                    )
+            with cls.create(
+                tmp,
+                dim=first.dim,
+                dtype=first.dtype,
+                model_name=first.model_name,
+                shard_size=shard_size or first.shard_size,
+                extra=first.manifest.get("extra"),
+            ) as merged:
+                for store in stores:
+                    merged._append_store(store)
+
+        replaced = root.with_name(root.name + REPLACED_SUFFIX)
+        if root.exists():
+            os.replace(root, replaced)
+        os.replace(tmp, root)
+        if replaced.exists():
+            shutil.rmtree(replaced)
+        return cls(root, merged.manifest, mode="r")
+
+    @classmethod
+    def recover(cls, root):
+        """
+        清理 merge() 中断留下的状态
+
+        旧存储已移到一旁但新存储尚未换入时，把旧存储移回 root；
+        新存储已换入时删除旧存储。未完成的临时目录留给下一次 merge() 覆盖
+        """
+        root = Path(root)
+        replaced = root.with_name(root.name + REPLACED_SUFFIX)
+        if not replaced.exists():
+            return
+        if (root / MANIFEST_NAME).exists():
+            shutil.rmtree(replaced)
+        else:
+            if root.exists():
+                shutil.rmtree(root)
+            os.replace(replaced, root)
+
+    # ------------------------------------------------------------------
+    # 元数据
+    # ------------------------------------------------------------------
+    def __len__(self):
+        return self.manifest["num_rows"]
+
+    @property
+    def dim(self):
+        return self.manifest["dim"]
+
+    @property
+    def dtype(self):
+        return np.dtype(self.manifest["dtype"])
+
+    @property
+    def model_name(self):
+        return self.manifest["model_name"]
+
+    @property
+    def shard_size(self):
+        return self.manifest["shard_size"]
+
+    @property
+    def paths(self):
+        """与特征行对应的图像路径列表"""
+        if self._paths is None:
+            with open(self.root / PATHS_NAME, "r", encoding="utf-8") as f:
+                self._paths = f.read().splitlines()[: len(self)]
+        return self._paths
+
+    # ------------------------------------------------------------------
+    # 写入
+    # ------------------------------------------------------------------
+    def _shard_file(self, index):
+        return f"shard_{index:05d}.npy"
+
+    def _new_shard(self):
+        shards = self.manifest["shards"]
+        offset = shards[-1]["offset"] + shards[-1]["rows"] if shards else 0
+        entry = {"file": self._shard_file(len(shards)), "offset": offset, "rows": 0}
+        np.lib.format.open_memmap(
+            self.root / entry["file"],
+            mode="w+",
+            dtype=self.dtype,
+            shape=(self.shard_size, self.dim),
+        )
+        self.manifest["shards"].append(entry)
+        return entry
+
+    def _truncate_paths(self):
+        # 中断的写入可能让 paths.txt 比清单记录的行数多，以清单为准
+        paths = self.paths
+        with open(self.root / PATHS_NAME, "w", encoding="utf-8") as f:
+            f.writelines(p + "\n" for p in paths)
+
+    def append(self, paths, features):
+        """
+        追加一批特征
+
+        参数:
+            paths: 图像路径列表，长度与 features 行数一致
+            features: (N, D) 特征数组
+        """
+        if self.mode != "a":
+            raise IOError("特征存储以只读模式打开")
+        features = np.asarray(features)
+        if features.ndim == 1:
+            features = features[None, :]
+        paths = [str(p) for p in paths]
+        if len(paths) != features.shape[0]:
+            raise ValueError(f"路径数量 {len(paths)} 与特征行数 {features.shape[0]} 不一致")
+        if self.dim is None:
+            self.manifest["dim"] = int(features.shape[1])
+        elif features.shape[1] != self.dim:
+            raise ValueError(f"特征维度不匹配: {features.shape[1]} != {self.dim}")
+
+        written = 0
+        while written < len(paths):
+            shards = self.manifest["shards"]
+            if not shards or shards[-1]["rows"] >= self.shard_size:
+                # 已写满的分片落盘后不再保留映射
+                self._flush_shards()
+                self._shards.clear()
+                self._new_shard()
+            index = len(shards) - 1
+            entry = shards[index]
+            shard = self._shard(index)
+            n = min(self.shard_size - entry["rows"], len(paths) - written)
+            shard[entry["rows"] : entry["rows"] + n] = features[written : written + n]
+            entry["rows"] += n
+            written += n
+
+        if self._paths_file is None:
+            self._paths_file = open(self.root / PATHS_NAME, "a", encoding="utf-8")
+        self._paths_file.writelines(p + "\n" for p in paths)
+        if self._paths is not None:
+            self._paths.extend(paths)
+        self.manifest["num_rows"] += len(paths)
+
+    def _append_store(self, source):
+        """按分片把另一个存储的全部行追加到本存储"""
+        paths = source.paths
+        for offset, view in source.shard_views():
+            self.append(paths[offset : offset + len(view)], view)
+
+    def _flush_shards(self):
+        for shard in self._shards.values():
+            if isinstance(shard, np.memmap):
+                shard.flush()
+
+    def flush(self):
+        """把分片数据、路径与清单落盘"""
+        if self.mode != "a":
+            return
+        self._flush_shards()
+        if self._paths_file is not None:
+            self._paths_file.flush()
+            os.fsync(self._paths_file.fileno())
+        self._write_manifest()
+
+    def _write_manifest(self):
+        tmp = self.root / (MANIFEST_NAME + ".tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self.manifest, f, ensure_ascii=False, indent=2)
+        os.replace(tmp, self.root / MANIFEST_NAME)
+
+    def close(self):
+        self.flush()
+        if self._paths_file is not None:
+            self._paths_file.close()
+            self._paths_file = None
+        self._shards.clear()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    # ------------------------------------------------------------------
+    # 读取
+    # ------------------------------------------------------------------
+    def _shard(self, index):
+        """返回第 index 个分片的内存映射 (整个固定大小的分片)"""
+        if index not in self._shards:
+            entry = self.manifest["shards"][index]
+            mmap_mode = "r+" if self.mode == "a" else "r"
+            self._shards[index] = np.load(self.root / entry["file"], mmap_mode=mmap_mode)
+        return self._shards[index]
+
+    def shard_views(self):
+        """
+        逐个分片产出 (offset, view)，view 是截断到有效行数的零拷贝内存映射
+        """
+        for index, entry in enumerate(self.manifest["shards"]):
+            if entry["rows"]:
+                yield entry["offset"], self._shard(index)[: entry["rows"]]
+
+    def read(self, start=0, stop=None):
+        """
+        读取行区间 [start, stop) 的特征
+
+        区间落在单个分片内时返回零拷贝视图，跨分片时拼接为新数组
+        """
+        stop = len(self) if stop is None else min(stop, len(self))
+        start = max(0, start)
+        if start >= stop:
+            return np.empty((0, self.dim or 0), dtype=self.dtype)
+
+        parts = []
+        for index, entry in enumerate(self.manifest["shards"]):
+            lo = max(start, entry["offset"])
+            hi = min(stop, entry["offset"] + entry["rows"])
+            if lo < hi:
+                shard = self._shard(index)
+                parts.append(shard[lo - entry["offset"] : hi - entry["offset"]])
+        if len(parts) == 1:
+            return parts[0]
+        return np.concatenate(parts)
+
+    def features(self):
+        """
+        返回全部特征
+
+        只有一个分片时为零拷贝内存映射视图；多个分片时会拼接到内存中，
+        大数据集请改用 shard_views() 或 read() 分段处理
+        """
+        return self.read(0, len(self))
@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+"""
+DINOv2 动态微批处理
+把并发到达的单张图像请求放入队列，凑满 max_batch 或等待超过 max_wait_ms
+时合并为一个批次推理，再把结果逐个返回给各自的请求
+"""
+
+import asyncio
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+DEFAULT_MAX_BATCH = 16
+DEFAULT_MAX_WAIT_MS = 5.0
+
+
+def _bucket(value):
+    """队列深度按 2 的幂分桶: 0、1、2-3、4-7、8-15 ..."""
+    if value < 2:
+        return str(value)
+    low = 1 << (value.bit_length() - 1)
+    return f"{low}-{2 * low - 1}"
+
+
+class MicroBatcher:
+    """
+    异步微批处理器
+
+    参数:
+        run_batch: 同步函数，接收输入列表，返回按行对应的结果 (长度相同)；
+            在单独的推理线程中执行，不阻塞事件循环
+        max_batch: 单批最大请求数
+        max_wait_ms: 第一个请求到达后最多等待多久凑批 (毫秒)
+    """
+
+    def __init__(self, run_batch, max_batch=DEFAULT_MAX_BATCH, max_wait_ms=DEFAULT_MAX_WAIT_MS):
+        self.run_batch = run_batch
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000.0
+        self._queue = None
+        self._task = None
+        # 单线程推理: 批次按顺序执行，推理期间新请求在队列中累积
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="dinov2-infer")
+        self.requests = 0
+        self.batches = 0
+        self.batch_sizes = Counter()
+        self.queue_depths = Counter()
+
+    def start(self):
+        """在当前事件循环中启动后台凑批任务"""
+        self._queue = asyncio.Queue()
+        self._task = asyncio.get_running_loop().create_task(self._loop())
+
+    async def stop(self):
+        """停止后台任务并释放推理线程"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        self._executor.shutdown(wait=True)
+
+    async def submit(self, item):
+        """
+        提交一个输入，等待并返回它在批次中对应的结果
+
+        返回:
+            (result, batch_size): 结果与该请求所在批次的大小
+        """
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((item, future))
+        return await future
+
+    async def _collect(self):
+        """取出第一个请求后在截止时间内继续凑批"""
+        batch = [await self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch:
+            # 队列中已有的请求直接取走，不必等待
+            if not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+                continue
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), remaining))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _loop(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = await self._collect()
+            self.requests += len(batch)
+            self.batches += 1
+            self.batch_sizes[len(batch)] += 1
+            # 出批时仍在排队的请求数
+            self.queue_depths[_bucket(self._queue.qsize())] += 1
+
+            items = [item for item, _ in batch]
+            try:
+                results = await loop.run_in_executor(self._executor, self.run_batch, items)
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            for (_, future), result in zip(batch, results):
+                if not future.done():
+                    future.set_result((result, len(batch)))
+
+    def stats(self):
+        """返回当前队列深度、批大小与队列深度直方图"""
+        return {
+            "queue_depth": self._queue.qsize() if self._queue is not None else 0,
+            "requests": self.requests,
+            "batches": self.batches,
+            "mean_batch_size": self.requests / self.batches if self.batches else 0.0,
+            "max_batch": self.max_batch,
+            "max_wait_ms": self.max_wait * 1000.0,
+            "batch_size_histogram": {str(k): v for k, v in sorted(self.batch_sizes.items())},
+            "queue_depth_histogram": dict(
+                sorted(self.queue_depths.items(), key=lambda kv: int(kv[0].split("-")[0]))
+            ),
+        }
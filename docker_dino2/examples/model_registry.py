@@ -0,0 +1,287 @@
+#!/usr/bin/env python3
+"""
+DINOv2 模型注册表
+在进程内缓存已加载的模型，按 (模型名称, 设备, 数据类型, 加载选项) 复用，
+支持 LRU 淘汰与显存/内存上限
+
+模型可以离线加载: 用本地克隆的 dinov2 包构建网络结构，再从本地检查点目录
+读取权重，不经过 torch.hub (不访问 GitHub，也不导入 hub 代码)
+"""
+
+import os
+import sys
+import threading
+from collections import OrderedDict
+from pathlib import Path
+
+import torch
+
+HUB_REPO = "facebookresearch/dinov2"
+
+# 本地 dinov2 源码目录 (Dockerfile 中克隆的位置) 与检查点目录，可用环境变量覆盖
+DEFAULT_REPO_DIR = Path(os.environ.get("DINOV2_REPO_DIR", "/workspace/dinov2"))
+CHECKPOINT_DIR_ENV = "DINOV2_CHECKPOINT_DIR"
+
+# 模型来源: local 只用本地检查点，hub 使用 torch.hub，auto 在本地检查点存在时优先使用
+MODEL_SOURCES = ("auto", "local", "hub")
+
+# 模型名称 -> (vision_transformer 中的构建函数, 额外参数)，与 dinov2 hub/backbones.py 一致
+_REGISTER_KWARGS = {
+    "num_register_tokens": 4,
+    "interpolate_antialias": True,
+    "interpolate_offset": 0.0,
+}
+MODEL_ARCHS = {
+    "dinov2_vits14": ("vit_small", {}),
+    "dinov2_vitb14": ("vit_base", {}),
+    "dinov2_vitl14": ("vit_large", {}),
+    "dinov2_vitg14": ("vit_giant2", {"ffn_layer": "swiglufused"}),
+    "dinov2_vits14_reg": ("vit_small", _REGISTER_KWARGS),
+    "dinov2_vitb14_reg": ("vit_base", _REGISTER_KWARGS),
+    "dinov2_vitl14_reg": ("vit_large", _REGISTER_KWARGS),
+    "dinov2_vitg14_reg": ("vit_giant2", dict(_REGISTER_KWARGS, ffn_layer="swiglufused")),
+}
+
+# 默认最多缓存的模型数量与总内存上限 (字节)
+DEFAULT_MAX_MODELS = 4
+DEFAULT_MAX_BYTES = 4 * 1024**3
+
+
+def model_nbytes(model):
+    """统计模型参数与缓冲区占用的字节数 (包括量化层打包后的权重)"""
+    total = 0
+    for value in model.state_dict().values():
+        tensors = value if isinstance(value, tuple) else (value,)
+        for tensor in tensors:
+            if isinstance(tensor, torch.Tensor):
+                total += tensor.numel() * tensor.element_size()
+    return total
+
+
+def quantize_linear_layers(model, quantize="int8"):
+    """
+    对模型中的 Linear 层做动态量化
+
+    DINOv2 ViT 的计算量集中在注意力 qkv/proj 与 MLP fc1/fc2 这些 Linear 层，
+    权重量化为 int8，激活在运行时动态量化，其余层保持 fp32
+
+    参数:
+        model: eval 模式下的 fp32 模型
+        quantize: 量化类型，目前只支持 'int8'
+
+    返回:
+        model: 量化后的模型
+    """
+    if quantize != "int8":
+        raise ValueError(f"不支持的量化类型: {quantize}")
+    return torch.ao.quantization.quantize_dynamic(
+        model, {torch.nn.Linear}, dtype=torch.qint8
+    )
+
+
+def default_checkpoint_dir():
+    """检查点目录: $DINOV2_CHECKPOINT_DIR，否则为 torch.hub 的 checkpoints 目录"""
+    if os.environ.get(CHECKPOINT_DIR_ENV):
+        return Path(os.environ[CHECKPOINT_DIR_ENV])
+    return Path(torch.hub.get_dir()) / "checkpoints"
+
+
+def checkpoint_path(model_name, checkpoint_dir=None):
+    """
+    模型权重文件路径，文件名与官方下载的检查点相同
+
+    例如 dinov2_vits14_pretrain.pth、dinov2_vits14_reg4_pretrain.pth
+    """
+    if model_name not in MODEL_ARCHS:
+        raise ValueError(f"不支持的模型: {model_name} (可选: {list(MODEL_ARCHS)})")
+    checkpoint_dir = Path(checkpoint_dir) if checkpoint_dir else default_checkpoint_dir()
+    file_name = model_name.replace("_reg", "_reg4") + "_pretrain.pth"
+    return checkpoint_dir / file_name
+
+
+def load_local_model(model_name, checkpoint_dir=None, repo_dir=DEFAULT_REPO_DIR):
+    """
+    离线构建 DINOv2 模型并加载本地权重
+
+    参数:
+        model_name: 模型名称 (见 MODEL_ARCHS)
+        checkpoint_dir: 检查点目录，默认见 default_checkpoint_dir()
+        repo_dir: 本地克隆的 dinov2 源码目录，dinov2 包不可导入时加入 sys.path
+
+    返回:
+        model: 已加载权重的 fp32 CPU 模型
+    """
+    path = checkpoint_path(model_name, checkpoint_dir)
+    if not path.is_file():
+        raise FileNotFoundError(
+            f"未找到本地检查点: {path} (可用 --checkpoint-dir 或 ${CHECKPOINT_DIR_ENV} 指定目录)"
+        )
+
+    try:
+        from dinov2.models import vision_transformer as vits
+    except ImportError:
+        if not Path(repo_dir).is_dir():
+            raise
+        sys.path.insert(0, str(repo_dir))
+        from dinov2.models import vision_transformer as vits
+
+    arch_name, arch_kwargs = MODEL_ARCHS[model_name]
+    model = getattr(vits, arch_name)(
+        img_size=518, patch_size=14, init_values=1.0, block_chunks=0, **arch_kwargs
+    )
+    state_dict = torch.load(path, map_location="cpu", weights_only=True)
+    model.load_state_dict(state_dict, strict=True)
+    return model
+
+
+class ModelRegistry:
+    """
+    进程级模型注册表
+
+    参数:
+        max_models: 最多同时保留的模型数量
+        max_bytes: 所有已缓存模型的总字节上限
+        source: 模型来源 ('auto'、'local' 或 'hub'，见 MODEL_SOURCES)
+        checkpoint_dir: 本地检查点目录，默认见 default_checkpoint_dir()
+    """
+
+    def __init__(
+        self,
+        max_models=DEFAULT_MAX_MODELS,
+        max_bytes=DEFAULT_MAX_BYTES,
+        source="auto",
+        checkpoint_dir=None,
+    ):
+        if source not in MODEL_SOURCES:
+            raise ValueError(f"不支持的模型来源: {source} (可选: {MODEL_SOURCES})")
+        self.max_models = max_models
+        self.max_bytes = max_bytes
+        self.source = source
+        self.checkpoint_dir = checkpoint_dir
+        self._models = OrderedDict()
+        self._sizes = {}
+        self._lock = threading.RLock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(model_name, device, dtype, **options):
+        # 只有启用的选项参与键，默认加载方式的键与选项无关
+        enabled = tuple(sorted((k, v) for k, v in options.items() if v))
+        return (model_name, str(torch.device(device)), dtype, enabled)
+
+    def get(self, model_name, device="cuda", dtype=torch.float32, **options):
+        """
+        获取模型，命中则直接返回已预热的实例，否则加载并登记
+
+        参数:
+            model_name: 模型名称
+            device: 计算设备
+            dtype: 模型参数的数据类型
+            options: 加载选项
+                compile: 使用 torch.compile 编译模型
+                channels_last: 参数转换为 channels_last 内存布局
+                quantize: 'int8' 时对注意力/MLP 的 Linear 层做动态 INT8 量化 (仅 CPU)
+
+        返回:
+            model: eval 模式下的模型
+        """
+        key = self.make_key(model_name, device, dtype, **options)
+        with self._lock:
+            if key in self._models:
+                self._models.move_to_end(key)
+                self.hits += 1
+                return self._models[key]
+
+            self.misses += 1
+            model = self._load(model_name, device, dtype, **options)
+            self._models[key] = model
+            self._sizes[key] = model_nbytes(model)
+            self._evict(keep=key)
+            return model
+
+    def _load(
+        self, model_name, device, dtype, compile=False, channels_last=False, quantize=None
+    ):
+        if quantize and torch.device(device).type != "cpu":
+            raise ValueError(f"动态 {quantize} 量化只支持 CPU，当前设备: {device}")
+
+        model = self._load_backbone(model_name)
+        model = model.to(device=device, dtype=dtype)
+        if channels_last:
+            model = model.to(memory_format=torch.channels_last)
+        model.eval()
+        if quantize:
+            model = quantize_linear_layers(model, quantize)
+        if compile:
+            # 编译在第一次前向时进行，之后复用同一个编译后的模块
+            model = torch.compile(model)
+        return model
+
+    def _load_backbone(self, model_name):
+        """按模型来源加载 fp32 骨干网络"""
+        source = self.source
+        if source == "auto":
+            local = (
+                model_name in MODEL_ARCHS
+                and checkpoint_path(model_name, self.checkpoint_dir).is_file()
+            )
+            source = "local" if local else "hub"
+
+        if source == "local":
+            path = checkpoint_path(model_name, self.checkpoint_dir)
+            print(f"加载模型: {model_name} (本地检查点 {path})...")
+            return load_local_model(model_name, self.checkpoint_dir)
+        print(f"加载模型: {model_name} (torch.hub)...")
+        return torch.hub.load(HUB_REPO, model_name)
+
+    def _evict(self, keep=None):
+        """按最近最少使用顺序淘汰，直到满足数量与内存上限"""
+        while len(self._models) > 1 and (
+            len(self._models) > self.max_models or self.total_bytes() > self.max_bytes
+        ):
+            oldest = next(iter(self._models))
+            if oldest == keep:
+                break
+            self.remove(oldest)
+
+    def remove(self, key):
+        with self._lock:
+            self._models.pop(key, None)
+            self._sizes.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._models.clear()
+            self._sizes.clear()
+
+    def total_bytes(self):
+        return sum(self._sizes.values())
+
+    def keys(self):
+        with self._lock:
+            return list(self._models.keys())
+
+    def stats(self):
+        """返回注册表的命中统计与内存占用"""
+        with self._lock:
+            return {
+                "models": len(self._models),
+                "bytes": self.total_bytes(),
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+
+# 进程内共享的默认注册表
+_default_registry = ModelRegistry()
+
+
+def get_registry():
+    """返回进程内共享的默认注册表"""
+    return _default_registry
+
+
+def get_model(model_name="dinov2_vits14", device="cuda", dtype=torch.float32, **options):
+    """从默认注册表获取模型"""
+    return _default_registry.get(model_name, device, dtype, **options)
@@ -0,0 +1,318 @@
+#!/usr/bin/env python3
+"""
+DINOv2 ONNX Runtime 推理后端
+把 DINOv2 模型导出为批大小可变的 ONNX 文件 (输入分辨率固定为预处理裁剪尺寸)，
+用 ONNX Runtime 推理得到与 PyTorch 相同的 CLS 特征
+
+用法:
+    # 导出单个模型 / 全部模型
+    python examples/onnx_backend.py export --model dinov2_vits14
+    python examples/onnx_backend.py export --all
+
+    # 在 data/test_images 上对比 ONNX Runtime 与 PyTorch 的特征
+    python examples/onnx_backend.py parity --model dinov2_vits14
+
+    # 特征提取使用 ONNX 后端 (模型文件不存在时自动导出)
+    python examples/extract_features.py --input-dir data/ --backend onnx --device cpu
+"""
+
+import copy
+import fcntl
+import os
+import threading
+import time
+from pathlib import Path
+
+import numpy as np
+
+from pipeline import DEFAULT_PREPROCESS, TRANSFORM_CONFIG, resolution_arg
+
+# 可选的推理后端
+BACKENDS = ("torch", "onnx")
+
+# 导出文件目录的环境变量
+ONNX_DIR_ENV = "DINOV2_ONNX_DIR"
+
+# 导出使用的 ONNX opset 版本
+DEFAULT_OPSET = 17
+
+INPUT_NAME = "pixel_values"
+OUTPUT_NAME = "features"
+
+# 进程内已创建的推理会话: {(路径, 设备): OnnxModel}
+_sessions = {}
+
+
+def default_onnx_dir():
+    """导出目录: $DINOV2_ONNX_DIR，否则为 ~/.cache/dinov2/onnx"""
+    return Path(os.getenv(ONNX_DIR_ENV, Path.home() / ".cache" / "dinov2" / "onnx"))
+
+
+def onnx_path(model_name, image_size=TRANSFORM_CONFIG["crop"], onnx_dir=None):
+    """导出文件路径，文件名包含输入分辨率"""
+    onnx_dir = Path(onnx_dir) if onnx_dir else default_onnx_dir()
+    return onnx_dir / f"{model_name}_{image_size}.onnx"
+
+
+def export_onnx(
+    model_name="dinov2_vits14",
+    path=None,
+    image_size=TRANSFORM_CONFIG["crop"],
+    opset=DEFAULT_OPSET,
+):
+    """
+    把模型导出为 ONNX，批大小为动态维度
+
+    DINOv2 按输入尺寸插值位置编码，插值比例在导出时无法追踪；
+    这里先按 image_size 计算好位置编码，在模型副本上作为常量写入，
+    注册表中共享的模型实例不受影响。先写入本进程独有的临时文件再原子替换
+
+    参数:
+        model_name: 模型名称
+        path: 导出文件路径，默认为 onnx_path(model_name, image_size)
+        image_size: 输入分辨率 (须为 patch 大小 14 的倍数)
+        opset: ONNX opset 版本
+
+    返回:
+        path: 导出文件路径
+    """
+    import torch
+
+    from model_registry import get_model
+
+    path = Path(path) if path else onnx_path(model_name, image_size)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    model = get_model(model_name, "cpu")
+
+    dummy = torch.zeros(2, 3, image_size, image_size)
+    with torch.no_grad():
+        tokens = model.patch_embed(dummy[:1])
+        tokens = torch.cat((model.cls_token.expand(1, -1, -1), tokens), dim=1)
+        pos_embed = model.interpolate_pos_encoding(tokens, image_size, image_size)
+
+    class _Exported(torch.nn.Module):
+        def __init__(self, backbone):
+            super().__init__()
+            self.backbone = backbone
+
+        def forward(self, pixel_values):
+            return self.backbone(pixel_values)
+
+    print(f"导出 ONNX: {model_name} ({image_size}x{image_size}) -> {path}")
+    start = time.perf_counter()
+    backbone = copy.deepcopy(model)
+    backbone.interpolate_pos_encoding = lambda x, w, h: pos_embed
+    tmp_path = path.with_name(f"{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    try:
+        torch.onnx.export(
+            _Exported(backbone),
+            (dummy,),
+            str(tmp_path),
+            input_names=[INPUT_NAME],
+            output_names=[OUTPUT_NAME],
+            dynamic_axes={INPUT_NAME: {0: "batch"}, OUTPUT_NAME: {0: "batch"}},
+            opset_version=opset,
+            dynamo=False,
+        )
+        os.replace(tmp_path, path)
+    finally:
+        tmp_path.unlink(missing_ok=True)
+    print(f"导出完成: {time.perf_counter() - start:.1f} 秒, {path.stat().st_size / 1e6:.1f} MB")
+    return path
+
+
+def ensure_onnx(model_name="dinov2_vits14", image_size=TRANSFORM_CONFIG["crop"], onnx_dir=None):
+    """
+    导出文件不存在时导出，返回导出文件路径
+
+    持有 <文件名>.lock 的文件锁，多个进程同时首次运行时只有一个进程导出，
+    其余进程等待后直接使用导出结果
+    """
+    path = onnx_path(model_name, image_size, onnx_dir)
+    if path.exists():
+        return path
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path.with_name(path.name + ".lock"), "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        if not path.exists():
+            export_onnx(model_name, path, image_size)
+    return path
+
+
+class OnnxModel:
+    """
+    ONNX Runtime 推理会话，调用方式与 PyTorch 模型相同: model(batch) -> (B, D)
+
+    输入输出均为 torch 张量，可直接替换特征提取函数中的 PyTorch 模型；
+    只提供 CLS 特征，不支持 forward_features
+
+    参数:
+        path: ONNX 文件路径
+        device: 'cpu' 或 'cuda' (需要 onnxruntime-gpu)
+        num_threads: 算子内线程数，默认与 torch 的线程数一致
+    """
+
+    def __init__(self, path, device="cpu", num_threads=None):
+        import onnxruntime as ort
+        import torch
+
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = num_threads or torch.get_num_threads()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        providers = ["CPUExecutionProvider"]
+        if device == "cuda":
+            providers.insert(0, "CUDAExecutionProvider")
+        self.path = Path(path)
+        self.session = ort.InferenceSession(str(path), options, providers=providers)
+        self.image_size = self.session.get_inputs()[0].shape[-1]
+
+    def __call__(self, batch):
+        import torch
+
+        if tuple(batch.shape[-2:]) != (self.image_size, self.image_size):
+            raise ValueError(
+                f"ONNX 模型输入分辨率为 {self.image_size}，实际为 {tuple(batch.shape[-2:])}"
+            )
+        pixels = np.ascontiguousarray(batch.float().cpu().numpy())
+        (features,) = self.session.run([OUTPUT_NAME], {INPUT_NAME: pixels})
+        return torch.from_numpy(features)
+
+    def __repr__(self):
+        return f"OnnxModel({self.path.name})"
+
+
+def get_onnx_model(
+    model_name="dinov2_vits14",
+    device="cpu",
+    mode=None,
+    onnx_dir=None,
+    image_size=TRANSFORM_CONFIG["crop"],
+):
+    """
+    获取 ONNX 推理会话，导出文件不存在时先导出；同一进程内复用会话
+
+    参数:
+        model_name: 模型名称
+        device: 计算设备
+        mode: 推理执行模式，ONNX 后端只支持 fp32 且不支持 torch.compile
+        onnx_dir: 导出目录
+        image_size: 输入分辨率，每个分辨率单独导出一个文件
+    """
+    if mode is not None and (mode.precision != "fp32" or mode.compile):
+        raise ValueError(f"ONNX 后端只支持 fp32 且不支持 --compile，当前为 {mode.describe()}")
+    path = onnx_path(model_name, image_size, onnx_dir)
+    key = (str(path), device)
+    if key not in _sessions:
+        ensure_onnx(model_name, image_size, onnx_dir)
+        _sessions[key] = OnnxModel(path, device)
+    return _sessions[key]
+
+
+def check_parity(image_paths, model_name="dinov2_vits14", batch_size=8, onnx_dir=None):
+    """
+    在同一批预处理输入上对比 ONNX Runtime 与 PyTorch 的特征和 CPU 吞吐量
+
+    返回:
+        report: 两个后端的吞吐量、加速比、最大绝对偏差和余弦相似度
+    """
+    import torch
+
+    from model_registry import get_model
+
+    batches = [
+        DEFAULT_PREPROCESS.load_batch(image_paths[i : i + batch_size])
+        for i in range(0, len(image_paths), batch_size)
+    ]
+    models = {
+        "torch": get_model(model_name, "cpu"),
+        "onnx": get_onnx_model(model_name, "cpu", onnx_dir=onnx_dir),
+    }
+
+    report = {"num_images": len(image_paths), "batch_size": batch_size}
+    outputs = {}
+    for name, model in models.items():
+        # 预热
+        with torch.no_grad():
+            outputs[name] = np.vstack([model(batch).numpy() for batch in batches])
+            start = time.perf_counter()
+            for batch in batches:
+                model(batch)
+        seconds = time.perf_counter() - start
+        report[name] = {"seconds": seconds, "images_per_sec": len(image_paths) / seconds}
+
+    reference, candidate = outputs["torch"], outputs["onnx"]
+    cosine = np.sum(reference * candidate, axis=1) / (
+        np.linalg.norm(reference, axis=1) * np.linalg.norm(candidate, axis=1)
+    )
+    report["speedup"] = report["torch"]["seconds"] / report["onnx"]["seconds"]
+    report["max_abs_deviation"] = float(np.max(np.abs(reference - candidate)))
+    report["min_cosine"] = float(np.min(cosine))
+    report["mean_cosine"] = float(np.mean(cosine))
+    return report
+
+
+def print_parity_report(report):
+    """打印 ONNX Runtime 与 PyTorch 的对比报告"""
+    print("\n" + "=" * 60)
+    print("ONNX Runtime vs PyTorch")
+    print("=" * 60)
+    print(f"  图像数量: {report['num_images']}  批大小: {report['batch_size']}")
+    for name in ("torch", "onnx"):
+        print(f"  {name:<10} {report[name]['images_per_sec']:>8.2f} images/sec")
+    print(f"  加速比: {report['speedup']:.2f}x")
+    print(f"  最大特征偏差: {report['max_abs_deviation']:.2e}")
+    print(f"  最小余弦相似度: {report['min_cosine']:.8f}")
+    print(f"  平均余弦相似度: {report['mean_cosine']:.8f}")
+
+
+def main():
+    import argparse
+
+    from extract_features import DEFAULT_IMAGE_DIR, MODEL_NAMES
+
+    parser = argparse.ArgumentParser(description="DINOv2 ONNX 导出与一致性检查")
+    parser.add_argument("command", choices=["export", "parity"], help="导出模型或对比特征")
+    parser.add_argument("--model", type=str, default="dinov2_vits14", choices=MODEL_NAMES)
+    parser.add_argument("--all", action="store_true", help="导出全部模型")
+    parser.add_argument(
+        "--onnx-dir",
+        type=str,
+        default=None,
+        help=f"导出目录 (默认 ${ONNX_DIR_ENV} 或 ~/.cache/dinov2/onnx)",
+    )
+    parser.add_argument("--opset", type=int, default=DEFAULT_OPSET, help="ONNX opset 版本")
+    parser.add_argument(
+        "--resolution",
+        type=resolution_arg,
+        default=TRANSFORM_CONFIG["crop"],
+        help="导出模型的输入分辨率 (14 的倍数)",
+    )
+    parser.add_argument("--batch-size", type=int, default=8, help="一致性检查的批大小")
+    parser.add_argument(
+        "--model-source",
+        type=str,
+        default="auto",
+        choices=["auto", "local", "hub"],
+        help="导出时 PyTorch 模型的来源",
+    )
+    parser.add_argument("--checkpoint-dir", type=str, default=None, help="本地检查点目录")
+    args = parser.parse_args()
+
+    from model_registry import get_registry
+
+    registry = get_registry()
+    registry.source = args.model_source
+    registry.checkpoint_dir = args.checkpoint_dir
+
+    if args.command == "export":
+        for model_name in MODEL_NAMES if args.all else [args.model]:
+            path = onnx_path(model_name, args.resolution, args.onnx_dir)
+            export_onnx(model_name, path, args.resolution, args.opset)
+    else:
+        image_paths = sorted(str(p) for p in DEFAULT_IMAGE_DIR.glob("*.jpg"))
+        report = check_parity(image_paths, args.model, args.batch_size, args.onnx_dir)
+        print_parity_report(report)
+
+
+if __name__ == "__main__":
+    main()
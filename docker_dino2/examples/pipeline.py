@@ -0,0 +1,525 @@
+#!/usr/bin/env python3
+"""
+DINOv2 批处理数据流水线
+用线程池在后台解码/预处理下一批图像，使解码与模型推理重叠执行
+
+torch 在第一次构造批次时才导入，解析命令行参数不会触发 torch 的加载
+"""
+
+import itertools
+import json
+import math
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import numpy as np
+from PIL import Image
+
+# 默认解码线程数与就绪批次队列深度
+DEFAULT_NUM_WORKERS = 4
+DEFAULT_QUEUE_DEPTH = 2
+
+# DINOv2 标准预处理参数 (同时作为特征缓存键的一部分)
+TRANSFORM_CONFIG = {
+    "resize": 256,
+    "crop": 224,
+    "mean": [0.485, 0.456, 0.406],
+    "std": [0.229, 0.224, 0.225],
+}
+
+# ViT patch 大小，输入分辨率必须是它的整数倍
+PATCH_SIZE = 14
+
+
+def transform_config_for(resolution):
+    """
+    指定输入分辨率的预处理参数: Resize 与 CenterCrop 保持标准的 256/224 比例
+
+    224 返回 TRANSFORM_CONFIG 本身，默认分辨率下的缓存键保持不变
+    """
+    if resolution <= 0 or resolution % PATCH_SIZE != 0:
+        raise ValueError(f"分辨率必须是 {PATCH_SIZE} 的正整数倍，实际为 {resolution}")
+    if resolution == TRANSFORM_CONFIG["crop"]:
+        return TRANSFORM_CONFIG
+    resize = round(resolution * TRANSFORM_CONFIG["resize"] / TRANSFORM_CONFIG["crop"])
+    return dict(TRANSFORM_CONFIG, resize=resize, crop=resolution)
+
+
+# 队列结束标记
+_DONE = object()
+
+
+def build_transform(config=TRANSFORM_CONFIG):
+    """
+    DINOv2 标准预处理: Resize(256) -> CenterCrop(224) -> ToTensor -> Normalize
+
+    torchvision 逐图像实现，作为 BatchTransform 的参考
+    """
+    import torchvision.transforms as transforms
+
+    return transforms.Compose(
+        [
+            transforms.Resize(config["resize"]),
+            transforms.CenterCrop(config["crop"]),
+            transforms.ToTensor(),
+            transforms.Normalize(mean=config["mean"], std=config["std"]),
+        ]
+    )
+
+
+class BatchTransform:
+    """
+    批量预处理，可直接替代 build_transform() 返回的变换
+
+    图像在 Resize/CenterCrop 后以 uint8 写入预分配的批次缓冲区，
+    整批一次性转换为 float 并归一化；数值与 torchvision 逐图像变换一致
+
+    参数:
+        config: 预处理参数 (resize/crop/mean/std)
+        pin_memory: 输出是否放在锁页内存中，默认在 CUDA 可用时启用
+    """
+
+    def __init__(self, config=TRANSFORM_CONFIG, pin_memory=None):
+        import torch
+
+        self.config = config
+        self.crop = config["crop"]
+        self.pin_memory = torch.cuda.is_available() if pin_memory is None else pin_memory
+        self._mean = torch.tensor(config["mean"]).view(1, 3, 1, 1)
+        self._std = torch.tensor(config["std"]).view(1, 3, 1, 1)
+
+    def resize_crop(self, image):
+        """
+        短边缩放到 resize 后中心裁剪，返回 (crop, crop, 3) uint8 数组
+
+        尺寸计算与取整方式和 torchvision 的 Resize/CenterCrop 相同
+        """
+        size = self.config["resize"]
+        width, height = image.size
+        if width <= height:
+            new_size = (size, int(size * height / width))
+        else:
+            new_size = (int(size * width / height), size)
+        if new_size != image.size:
+            image = image.resize(new_size, Image.BILINEAR)
+
+        left = int(round((new_size[0] - self.crop) / 2.0))
+        top = int(round((new_size[1] - self.crop) / 2.0))
+        image = image.crop((left, top, left + self.crop, top + self.crop))
+        return np.asarray(image, dtype=np.uint8)
+
+    def allocate(self, batch_size):
+        """分配 (batch_size, crop, crop, 3) 的 uint8 批次缓冲区，可重复使用"""
+        import torch
+
+        return torch.empty((batch_size, self.crop, self.crop, 3), dtype=torch.uint8)
+
+    def fill(self, buffer, index, image):
+        """把一张 RGB 图像缩放裁剪后写入缓冲区的第 index 个位置"""
+        self.write(buffer, index, self.resize_crop(image))
+
+    def write(self, buffer, index, crop):
+        """把已裁剪好的 (crop, crop, 3) uint8 数组写入缓冲区的第 index 个位置"""
+        buffer[index].numpy()[...] = crop
+
+    def normalize(self, buffer):
+        """
+        把 uint8 批次 (B, H, W, 3) 转换为归一化后的 float 批次 (B, 3, H, W)
+
+        输出为新分配的张量，缓冲区可以立即用于下一批
+        """
+        import torch
+
+        out = torch.empty(
+            (buffer.shape[0], 3, self.crop, self.crop),
+            dtype=torch.float32,
+            pin_memory=self.pin_memory,
+        )
+        out.copy_(buffer.permute(0, 3, 1, 2))
+        return out.div_(255).sub_(self._mean).div_(self._std)
+
+    def batch(self, images):
+        """预处理一组 RGB 图像，返回 (B, 3, crop, crop) 张量"""
+        buffer = self.allocate(len(images))
+        for i, image in enumerate(images):
+            self.fill(buffer, i, image)
+        return self.normalize(buffer)
+
+    def __call__(self, image):
+        """预处理单张图像，返回 (3, crop, crop) 张量"""
+        return self.batch([image])[0]
+
+
+# 缩放解码规则的版本，规则改变像素时递增，使旧的缓存条目失效
+FAST_DECODE_VERSION = 2
+
+
+def open_image_reduced(path, target=TRANSFORM_CONFIG["resize"]):
+    """
+    以接近目标尺寸的分辨率解码图像，短边保持不小于 2 * target
+
+    JPEG 使用 draft()，由 libjpeg 在 DCT 域直接按 1/2、1/4、1/8 缩放解码；
+    其他格式 (WebP/PNG 等) 解码器不支持缩放，解码后用 reduce() 做整数倍
+    盒式降采样，减少后续 Resize 的计算量。保留 2 倍余量，最后一步仍由
+    Resize 做抗锯齿缩小，与全分辨率解码的结果接近
+
+    参数:
+        path: 图像路径
+        target: 后续 Resize 的目标短边长度
+
+    返回:
+        image: RGB 图像
+    """
+    image = Image.open(path)
+    width, height = image.size
+    short = min(width, height)
+    keep = 2 * target
+    if short >= 2 * keep and image.format == "JPEG":
+        scale = keep / short
+        image.draft("RGB", (math.ceil(width * scale), math.ceil(height * scale)))
+    image = image.convert("RGB")
+
+    factor = min(image.size) // keep
+    if factor >= 2:
+        image = image.reduce(factor)
+    return image
+
+
+def open_image(path, fast_decode=False, target=TRANSFORM_CONFIG["resize"]):
+    """
+    读取 RGB 图像
+
+    参数:
+        path: 图像路径
+        fast_decode: 是否以接近目标尺寸的分辨率解码 (见 open_image_reduced)
+        target: 快速解码时后续 Resize 的目标短边长度
+    """
+    if fast_decode:
+        return open_image_reduced(path, target)
+    return Image.open(path).convert("RGB")
+
+
+class PreprocessConfig:
+    """
+    预处理配置: 决定图像如何解码并变换为模型输入
+
+    参数:
+        fast_decode: 是否以接近 Resize 目标的分辨率解码 (见 open_image_reduced)
+        crop_cache: 可选的 CropCache，命中时直接读取 uint8 裁剪结果，跳过解码与缩放
+        resolution: 模型输入分辨率 (PATCH_SIZE 的整数倍)，patch token 数为 (resolution/14)^2
+    """
+
+    def __init__(self, fast_decode=False, crop_cache=None, resolution=TRANSFORM_CONFIG["crop"]):
+        self.fast_decode = fast_decode
+        self.crop_cache = crop_cache
+        self._transform_config = transform_config_for(resolution)
+        if crop_cache is not None and crop_cache.crop != resolution:
+            raise ValueError(f"裁剪缓存尺寸 {crop_cache.crop} 与分辨率 {resolution} 不一致")
+        self._transform = None
+
+    @property
+    def transform_config(self):
+        return self._transform_config
+
+    @property
+    def resolution(self):
+        return self._transform_config["crop"]
+
+    @property
+    def transform(self):
+        if self._transform is None:
+            self._transform = BatchTransform(self.transform_config)
+        return self._transform
+
+    def load(self, path):
+        """读取并预处理单张图像，返回 (3, crop, crop) 张量"""
+        return self.load_batch([path])[0]
+
+    def crop_params(self):
+        """决定 uint8 裁剪像素的参数 (归一化参数不影响裁剪，不参与裁剪缓存键)"""
+        return {
+            "resize": self.transform_config["resize"],
+            "crop": self.transform_config["crop"],
+            "fast_decode": FAST_DECODE_VERSION if self.fast_decode else False,
+        }
+
+    def load_crop(self, path):
+        """读取单张图像并缩放裁剪，返回 (crop, crop, 3) uint8 数组"""
+        resize = self.transform_config["resize"]
+        if self.crop_cache is None:
+            return self.transform.resize_crop(open_image(path, self.fast_decode, resize))
+
+        key = self.crop_cache.make_key(path, self.crop_params())
+        crop = self.crop_cache.get(key)
+        if crop is None:
+            crop = self.transform.resize_crop(open_image(path, self.fast_decode, resize))
+            self.crop_cache.put(key, crop)
+        return crop
+
+    def load_into(self, buffer, index, path):
+        """读取单张图像，缩放裁剪后以 uint8 写入批次缓冲区"""
+        self.transform.write(buffer, index, self.load_crop(path))
+
+    def load_batch(self, paths, buffer=None, pool=None):
+        """
+        读取并预处理一批图像，返回 (B, 3, crop, crop) 张量
+
+        参数:
+            paths: 图像路径列表
+            buffer: 可复用的 uint8 缓冲区 (BatchTransform.allocate)，容量需不小于 len(paths)
+            pool: 并行解码用的线程池，为 None 时串行解码
+        """
+        if buffer is None or buffer.shape[0] < len(paths):
+            buffer = self.transform.allocate(len(paths))
+        buffer = buffer[: len(paths)]
+        if pool is None:
+            for i, path in enumerate(paths):
+                self.load_into(buffer, i, path)
+        else:
+            # 消费迭代器以等待全部完成并传播异常
+            list(pool.map(self.load_into, itertools.repeat(buffer), range(len(paths)), paths))
+        return self.transform.normalize(buffer)
+
+    def cache_config(self):
+        """
+        参与特征缓存键的预处理配置
+
+        快速解码会让像素有细微差别，因此单独计入；默认配置的键保持不变
+        """
+        if self.fast_decode:
+            return dict(self.transform_config, fast_decode=FAST_DECODE_VERSION)
+        return self.transform_config
+
+    def describe(self):
+        parts = [f"{self.transform_config['crop']}px"]
+        if self.fast_decode:
+            parts.append("fast_decode")
+        return "+".join(parts)
+
+
+# 与原始实现一致的默认预处理
+DEFAULT_PREPROCESS = PreprocessConfig()
+
+
+def resolution_arg(value):
+    """argparse 类型: PATCH_SIZE 的正整数倍"""
+    resolution = int(value)
+    transform_config_for(resolution)
+    return resolution
+
+
+def add_preprocess_args(parser):
+    """为命令行解析器添加预处理相关参数"""
+    parser.add_argument(
+        "--fast-decode",
+        action="store_true",
+        help="以接近 Resize 目标的分辨率解码 (JPEG draft / reduce)，跳过全分辨率解码",
+    )
+    parser.add_argument(
+        "--resolution",
+        type=resolution_arg,
+        default=TRANSFORM_CONFIG["crop"],
+        help=f"模型输入分辨率 ({PATCH_SIZE} 的倍数，如 112/168/224/280)，越小越快",
+    )
+    parser.add_argument(
+        "--crop-cache-dir",
+        type=str,
+        default=None,
+        help="预处理裁剪缓存目录 (各模型共用，命中时跳过解码与缩放)",
+    )
+
+
+def preprocess_from_args(args):
+    """根据命令行参数构造 PreprocessConfig"""
+    crop_cache = None
+    if args.crop_cache_dir:
+        from crop_cache import CropCache
+
+        crop_cache = CropCache(args.crop_cache_dir, args.resolution)
+    return PreprocessConfig(
+        fast_decode=args.fast_decode, crop_cache=crop_cache, resolution=args.resolution
+    )
+
+
+class ErrorLog:
+    """
+    批次组装时被跳过的图像记录
+
+    参数:
+        path: 可选的 JSONL 错误清单，每次失败立即追加一行 {"path", "error"}，
+            长时间任务中断后也能看到已跳过的文件；每次运行重新生成，
+            因为断点续跑时之前失败的图像会被再次尝试
+    """
+
+    def __init__(self, path=None):
+        self.path = Path(path) if path else None
+        self.entries = []
+        self._lock = threading.Lock()
+        if self.path is not None:
+            self.path.unlink(missing_ok=True)
+
+    def record(self, image_path, error):
+        entry = {"path": str(image_path), "error": f"{type(error).__name__}: {error}"}
+        with self._lock:
+            self.entries.append(entry)
+            if self.path is not None:
+                self.path.parent.mkdir(parents=True, exist_ok=True)
+                with open(self.path, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        print(f"\n⚠ 跳过无法读取的图像: {image_path} ({entry['error']})")
+
+    def paths(self):
+        return [entry["path"] for entry in self.entries]
+
+    def __len__(self):
+        return len(self.entries)
+
+
+# 视为"无法读取的图像"的解码异常 (PIL 的 UnidentifiedImageError 是 OSError 的子类)；
+# 其他异常 (程序错误等) 即使给出了 errors 也原样抛出
+DECODE_ERRORS = (OSError, ValueError, Image.DecompressionBombError)
+
+
+class BatchPrefetcher:
+    """
+    批次预取器
+
+    后台线程按顺序组装批次，每个批次内的图像由线程池并行解码并写入
+    同一个 uint8 缓冲区，整批归一化后放入有界队列；主线程迭代时取出即可推理。
+
+    给出 errors 时，无法读取的图像 (DECODE_ERRORS) 被记录并跳过，并从后续路径中
+    补齐批次，除最后一批外模型看到的始终是完整批次；其他异常原样抛出。
+
+    参数:
+        image_paths: 图像路径列表或可迭代对象 (按需读取)
+        preprocess: 预处理配置 (PreprocessConfig)，默认为标准预处理
+        batch_size: 批处理大小
+        num_workers: 解码线程数 (0 表示在主线程中串行解码)
+        queue_depth: 最多预先准备好的批次数
+        errors: 可选的 ErrorLog，给出时跳过无法读取的图像
+    """
+
+    def __init__(
+        self,
+        image_paths,
+        preprocess=None,
+        batch_size=8,
+        num_workers=DEFAULT_NUM_WORKERS,
+        queue_depth=DEFAULT_QUEUE_DEPTH,
+        errors=None,
+    ):
+        self.image_paths = image_paths
+        self.preprocess = preprocess or DEFAULT_PREPROCESS
+        self.batch_size = batch_size
+        self.num_workers = num_workers
+        self.queue_depth = max(1, queue_depth)
+        self.errors = errors
+        self._queue = None
+        self._stop = threading.Event()
+        self._thread = None
+        self._pool = None
+        self._buffer = None
+
+    def _load_crop(self, path):
+        if self.errors is None:
+            return self.preprocess.load_crop(path)
+        try:
+            return self.preprocess.load_crop(path)
+        except DECODE_ERRORS as e:
+            return e
+
+    def _batches(self, pool=None):
+        """
+        惰性组装批次，产出 (batch_paths, batch_tensor)
+
+        image_paths 可以是列表也可以是任意可迭代对象；批次由单个线程依次组装，
+        uint8 缓冲区可在批次间复用
+        """
+        transform = self.preprocess.transform
+        if self._buffer is None:
+            self._buffer = transform.allocate(self.batch_size)
+
+        it = iter(self.image_paths)
+        while True:
+            batch_paths = []
+            # 有图像被跳过时继续从后续路径补齐
+            while len(batch_paths) < self.batch_size:
+                candidates = list(itertools.islice(it, self.batch_size - len(batch_paths)))
+                if not candidates:
+                    break
+                if pool is None:
+                    crops = [self._load_crop(path) for path in candidates]
+                else:
+                    crops = list(pool.map(self._load_crop, candidates))
+                for path, crop in zip(candidates, crops):
+                    if isinstance(crop, Exception):
+                        self.errors.record(path, crop)
+                        continue
+                    transform.write(self._buffer, len(batch_paths), crop)
+                    batch_paths.append(path)
+
+            if not batch_paths:
+                return
+            yield batch_paths, transform.normalize(self._buffer[: len(batch_paths)])
+
+    def _put(self, item):
+        # 队列满时周期性检查停止标志，避免消费者提前退出后生产者永久阻塞
+        while not self._stop.is_set():
+            try:
+                self._queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _produce(self):
+        try:
+            for item in self._batches(self._pool):
+                if self._stop.is_set():
+                    return
+                if not self._put(item):
+                    return
+        except Exception as e:
+            self._put(e)
+        finally:
+            self._put(_DONE)
+
+    def __iter__(self):
+        """
+        依次产出 (batch_paths, batch_tensor)
+
+        解码过程中的异常会在主线程中原样抛出
+        """
+        if self.num_workers <= 0:
+            yield from self._batches()
+            return
+
+        self._stop.clear()
+        self._queue = queue.Queue(maxsize=self.queue_depth)
+        self._pool = ThreadPoolExecutor(
+            max_workers=self.num_workers, thread_name_prefix="dinov2-decode"
+        )
+        self._thread = threading.Thread(target=self._produce, daemon=True)
+        self._thread.start()
+        try:
+            while True:
+                item = self._queue.get()
+                if item is _DONE:
+                    return
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            self.close()
+
+    def close(self):
+        """停止后台线程并释放线程池"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        if self._pool is not None:
+            self._pool.shutdown(wait=True)
+            self._pool = None
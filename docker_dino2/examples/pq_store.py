@@ -0,0 +1,424 @@
+#!/usr/bin/env python3
+"""
+DINOv2 乘积量化 (PQ) 压缩特征存储
+把归一化特征切成 M 段，每段用 256 个中心的 k-means 码本量化为 1 字节，
+每条特征只占 M 字节 (384 维 float32 为 1536 字节，M=48 时压缩 32 倍)
+
+查询使用非对称距离计算 (ADC): 查询保持 float32，只有库中特征被压缩，
+相似度 q·x̂ = Σ_m q_m·C_m[code_m]，由查询与每段码本的内积查表累加得到
+
+目录结构:
+    <pq>/
+    ├── meta.json        # M、码本大小、维度、数量、来源特征存储
+    ├── codebooks.npy    # (M, ksub, D/M) float32 码本
+    └── codes.npy        # (N, M) uint8 编码，按特征存储的原始行顺序
+
+用法:
+    python examples/pq_store.py build --store output/features_store --pq output/pq_store --m 48
+    python examples/pq_store.py evaluate --pq output/pq_store
+"""
+
+import json
+import time
+from pathlib import Path
+
+import numpy as np
+
+from ann_index import DEFAULT_BUILD_BLOCK, read_rows, recall_at_k, sample_rows, train_kmeans
+from feature_store import FeatureStore
+from similarity import FeatureIndex, normalize, topk_rows
+
+META_NAME = "meta.json"
+
+# 每段码本的中心数 (编码为 uint8)
+DEFAULT_KSUB = 256
+# 默认分段数的上限: 取能整除特征维度且不超过该值的最大分段数
+# (vits14/vitb14/vitg14 为 48，vitl14 的 1024 维为 32)
+TARGET_M = 48
+DEFAULT_TRAIN_SIZE = 65536
+DEFAULT_PQ_ITERS = 20
+
+# 查询数不超过该值时按段查表累加，否则把编码逐块解码后做矩阵乘法 (两者结果相同)
+LOOKUP_MAX_QUERIES = 8
+
+# 检索时临时 float32 数据 (解码块、相似度块) 的字节上限，与库的大小无关
+ADC_BLOCK_BYTES = 64 * 1024**2
+
+
+def adc_block_rows(width, max_bytes=None):
+    """每块的行数，使 (行数, width) 的 float32 块不超过 max_bytes (默认 ADC_BLOCK_BYTES)"""
+    return max(1, (max_bytes or ADC_BLOCK_BYTES) // (4 * width))
+
+
+def valid_m_values(dim):
+    """能整除特征维度的分段数"""
+    return [m for m in range(1, dim + 1) if dim % m == 0]
+
+
+def default_m(dim, target=TARGET_M):
+    """能整除 dim 且不超过 target 的最大分段数"""
+    return max(m for m in valid_m_values(dim) if m <= target)
+
+
+def check_m(dim, m):
+    """分段数必须整除特征维度，否则报错并列出可选值"""
+    if m < 1 or dim % m:
+        valid = [v for v in valid_m_values(dim) if v <= DEFAULT_KSUB]
+        raise ValueError(f"分段数 {m} 不能整除特征维度 {dim}，可选值: {valid}")
+
+
+def _split(vectors, m):
+    """(N, D) -> (M, N, D/M)"""
+    n, dim = vectors.shape
+    return vectors.reshape(n, m, dim // m).transpose(1, 0, 2)
+
+
+def train_codebooks(vectors, m=None, ksub=DEFAULT_KSUB, iters=DEFAULT_PQ_ITERS, seed=0):
+    """
+    在训练样本上逐段训练 k-means 码本
+
+    参数:
+        vectors: (N, D) 训练特征 (已归一化)，D 必须能被 m 整除
+        m: 分段数 (每条特征编码后的字节数)，默认 default_m(D)
+        ksub: 每段的中心数 (不超过 256)
+
+    返回:
+        codebooks: (M, ksub, D/M) float32
+    """
+    vectors = np.asarray(vectors, dtype=np.float32)
+    m = m or default_m(vectors.shape[1])
+    check_m(vectors.shape[1], m)
+    if not 1 <= ksub <= 256:
+        raise ValueError(f"码本大小必须在 1-256 之间: {ksub}")
+    return np.stack(
+        [
+            train_kmeans(np.ascontiguousarray(sub), ksub, iters, seed + i, spherical=False)
+            for i, sub in enumerate(_split(vectors, m))
+        ]
+    )
+
+
+def encode(vectors, codebooks):
+    """把归一化特征编码为 (N, M) uint8，每段取欧氏距离最近的中心"""
+    m = len(codebooks)
+    # argmin ||x - c||^2 = argmax (x·c - ||c||^2 / 2)
+    half_norms = 0.5 * np.einsum("mkd,mkd->mk", codebooks, codebooks)
+    subs = _split(np.asarray(vectors, dtype=np.float32), m)
+    codes = np.empty((len(vectors), m), dtype=np.uint8)
+    for i in range(m):
+        scores = np.ascontiguousarray(subs[i]) @ codebooks[i].T
+        scores -= half_norms[i]
+        codes[:, i] = scores.argmax(axis=1)
+    return codes
+
+
+def decode(codes, codebooks):
+    """把 (N, M) 编码还原为近似特征 (N, D)"""
+    m, _, dsub = codebooks.shape
+    out = np.empty((len(codes), m * dsub), dtype=np.float32)
+    for i in range(m):
+        out[:, i * dsub : (i + 1) * dsub] = codebooks[i][codes[:, i]]
+    return out
+
+
+def distance_tables(queries, codebooks):
+    """查询每一段与对应码本中心的内积表 (B, M, ksub)"""
+    return np.einsum("mbd,mkd->bmk", _split(queries, len(codebooks)), codebooks)
+
+
+def adc_scores(queries, codes, codebooks):
+    """
+    非对称距离计算: 未压缩的查询与 PQ 编码之间的内积 (B, N)
+
+    查询较少时按段查表累加，每个 (查询, 编码) 对需要 M 次查表；
+    查询较多时查表在 NumPy 中比矩阵乘法慢一个数量级，改为把编码逐块解码后
+    与所有查询做一次矩阵乘法。解码块不超过 ADC_BLOCK_BYTES，
+    检索期间的额外内存与库的大小无关，常驻的仍只有每条 M 字节的编码
+    """
+    codes = np.asarray(codes)
+    scores = np.zeros((len(queries), len(codes)), dtype=np.float32)
+    if len(queries) > LOOKUP_MAX_QUERIES:
+        rows = adc_block_rows(queries.shape[1])
+        for lo in range(0, len(codes), rows):
+            scores[:, lo : lo + rows] = queries @ decode(codes[lo : lo + rows], codebooks).T
+        return scores
+    # (M, B, ksub)，每段的表连续存放，np.take 按编码取列
+    tables = np.ascontiguousarray(distance_tables(queries, codebooks).transpose(1, 0, 2))
+    for i in range(len(codebooks)):
+        scores += np.take(tables[i], codes[:, i], axis=1)
+    return scores
+
+
+class PQStore:
+    """
+    乘积量化压缩特征存储，余弦相似度 (编码前先归一化)
+
+    使用 PQStore.build() 构建并保存，PQStore.load() 以内存映射方式打开
+    """
+
+    def __init__(self, root, meta, codebooks, codes):
+        self.root = Path(root)
+        self.meta = meta
+        self.codebooks = codebooks
+        self.codes = codes
+        self._paths = None
+
+    @classmethod
+    def build(
+        cls,
+        source,
+        root,
+        m=None,
+        ksub=DEFAULT_KSUB,
+        train_size=DEFAULT_TRAIN_SIZE,
+        iters=DEFAULT_PQ_ITERS,
+        seed=0,
+        block_size=DEFAULT_BUILD_BLOCK,
+    ):
+        """
+        在随机样本上训练码本，再按块编码全部特征并保存到 root
+
+        参数:
+            source: 特征存储目录、FeatureStore 或 (N, D) 数组 (可以是内存映射)
+            root: 输出目录 (已存在时覆盖)
+            m: 分段数，即每条特征的字节数；默认按特征维度选择 (见 default_m)
+            ksub: 每段码本的中心数 (样本不足时自动减小)
+            train_size: 码本训练样本数
+            iters: k-means 迭代次数
+            seed: 随机种子
+            block_size: 编码时每次读取的行数
+
+        返回:
+            store: 以内存映射方式打开的 PQStore
+        """
+        store_dir = None
+        if isinstance(source, (str, Path)):
+            store_dir = str(source)
+            source = FeatureStore.open(source)
+        elif isinstance(source, FeatureStore):
+            store_dir = str(source.root)
+
+        n = len(source)
+        if n == 0:
+            raise ValueError("没有可压缩的特征")
+        dim = read_rows(source, 0, 1).shape[1]
+        m = m or default_m(dim)
+        check_m(dim, m)
+        root = Path(root)
+        root.mkdir(parents=True, exist_ok=True)
+
+        start = time.perf_counter()
+        train = normalize(sample_rows(source, train_size, seed, block_size))
+        ksub = min(ksub, len(train))
+        codebooks = train_codebooks(train, m, ksub, iters, seed)
+        del train
+        print(f"训练码本: M={m}, ksub={ksub}, {time.perf_counter() - start:.1f} 秒")
+
+        start = time.perf_counter()
+        codes = np.lib.format.open_memmap(root / "codes.npy", mode="w+", dtype=np.uint8, shape=(n, m))
+        for lo in range(0, n, block_size):
+            block = normalize(read_rows(source, lo, lo + block_size))
+            codes[lo : lo + len(block)] = encode(block, codebooks)
+        codes.flush()
+        del codes
+        print(f"编码: {n} 条, {time.perf_counter() - start:.1f} 秒")
+
+        np.save(root / "codebooks.npy", codebooks)
+        meta = {
+            "version": 1,
+            "metric": "cosine",
+            "num_vectors": n,
+            "dim": dim,
+            "m": m,
+            "ksub": ksub,
+            "store_dir": store_dir,
+            "model_name": source.model_name if isinstance(source, FeatureStore) else None,
+        }
+        with open(root / META_NAME, "w", encoding="utf-8") as f:
+            json.dump(meta, f, ensure_ascii=False, indent=2)
+        return cls.load(root)
+
+    @classmethod
+    def load(cls, root, mmap=True):
+        """打开压缩存储；mmap 为 True 时编码以只读内存映射方式打开"""
+        root = Path(root)
+        with open(root / META_NAME, "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        return cls(
+            root,
+            meta,
+            np.load(root / "codebooks.npy"),
+            np.load(root / "codes.npy", mmap_mode="r" if mmap else None),
+        )
+
+    def __len__(self):
+        return self.meta["num_vectors"]
+
+    @property
+    def dim(self):
+        return self.meta["dim"]
+
+    @property
+    def m(self):
+        return self.meta["m"]
+
+    @property
+    def nbytes(self):
+        """编码与码本占用的字节数"""
+        return self.codes.nbytes + self.codebooks.nbytes
+
+    @property
+    def paths(self):
+        """来源特征存储中与行号对应的图像路径"""
+        if self._paths is None and self.meta.get("store_dir"):
+            self._paths = FeatureStore.open(self.meta["store_dir"]).paths
+        return self._paths
+
+    def reconstruct(self, ids):
+        """还原指定行的近似 (归一化) 特征"""
+        return decode(np.asarray(self.codes[ids]), self.codebooks)
+
+    def search(self, queries, k=10, exclude=None, block_size=None):
+        """
+        用 ADC 查询最相似的 k 个特征
+
+        参数:
+            queries: (B, D) 查询特征 (不必归一化) 或单个 (D,) 向量
+            k: 返回个数
+            exclude: 可选的长度为 B 的行号数组，第 i 个查询不返回 exclude[i]，-1 表示不排除
+            block_size: 每次读取的编码行数，默认使 (B, block_size) 的相似度块
+                不超过 ADC_BLOCK_BYTES
+
+        返回:
+            (ids, scores): (B, k) 行号与近似余弦相似度，按相似度从高到低
+        """
+        queries = normalize(np.atleast_2d(queries))
+        if queries.shape[1] != self.dim:
+            raise ValueError(f"查询维度 {queries.shape[1]} 与存储维度 {self.dim} 不一致")
+        k = min(k, len(self))
+        block_size = block_size or adc_block_rows(len(queries))
+        best_ids = np.empty((len(queries), 0), dtype=np.int64)
+        best_scores = np.empty((len(queries), 0), dtype=np.float32)
+
+        for lo in range(0, len(self), block_size):
+            hi = min(lo + block_size, len(self))
+            scores = adc_scores(queries, self.codes[lo:hi], self.codebooks)
+            if exclude is not None:
+                local = np.asarray(exclude) - lo
+                rows = np.nonzero((local >= 0) & (local < hi - lo))[0]
+                scores[rows, local[rows]] = -np.inf
+            candidates = np.concatenate([best_scores, scores], axis=1)
+            columns = np.concatenate(
+                [best_ids, np.broadcast_to(np.arange(lo, hi), scores.shape)], axis=1
+            )
+            best_ids, best_scores = topk_rows(candidates, min(k, candidates.shape[1]), columns)
+        return best_ids, best_scores
+
+
+def evaluate_pq(store, features, queries, k=10, exclude=None):
+    """
+    对比 PQ 压缩存储与 float32 特征的内存占用和检索效果
+
+    参数:
+        store: PQStore
+        features: 与 store 行号对应的原始特征
+        queries: (B, D) 查询特征
+        k: top-k
+        exclude: 可选的每个查询要排除的行号 (查询来自存储自身时传入)
+
+    返回:
+        report: {"float32_bytes", "pq_bytes", "compression", "recall", "exact_qps", "pq_qps",
+                 "mean_cosine", ...}
+    """
+    exact = FeatureIndex(features)
+    start = time.perf_counter()
+    exact_ids, _ = exact.topk(queries, k, exclude=exclude)
+    exact_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    pq_ids, _ = store.search(queries, k, exclude=exclude)
+    pq_seconds = time.perf_counter() - start
+
+    # 重建误差: 抽样行的还原特征与原始归一化特征的余弦相似度
+    rows = np.sort(np.random.default_rng(0).choice(len(store), min(len(store), 10000), replace=False))
+    original = exact.vectors[rows]
+    restored = store.reconstruct(rows)
+    cosine = np.einsum("ij,ij->i", original, normalize(restored))
+
+    float32_bytes = len(store) * store.dim * 4
+    return {
+        "num_vectors": len(store),
+        "num_queries": len(queries),
+        "dim": store.dim,
+        "m": store.m,
+        "k": k,
+        "float32_bytes": float32_bytes,
+        "pq_bytes": store.nbytes,
+        "bytes_per_vector": store.m,
+        "compression": float32_bytes / store.nbytes,
+        "recall": recall_at_k(pq_ids, exact_ids),
+        "exact_qps": len(queries) / exact_seconds,
+        "pq_qps": len(queries) / pq_seconds,
+        "mean_cosine": float(cosine.mean()),
+    }
+
+
+def print_pq_report(report):
+    """打印 PQ 压缩评估报告"""
+    print("\n" + "=" * 60)
+    print(
+        f"PQ 压缩评估: {report['num_vectors']} 条, {report['dim']} 维, "
+        f"M={report['m']}, {report['num_queries']} 个查询"
+    )
+    print("=" * 60)
+    print(f"  float32 特征:   {report['float32_bytes'] / 1024**2:>10.2f} MB ({report['dim'] * 4} 字节/条)")
+    print(
+        f"  PQ 编码+码本:   {report['pq_bytes'] / 1024**2:>10.2f} MB "
+        f"({report['bytes_per_vector']} 字节/条)"
+    )
+    print(f"  压缩比:         {report['compression']:>10.1f}x")
+    print(f"  重建余弦相似度: {report['mean_cosine']:>10.4f}")
+    print(f"  recall@{report['k']}:      {report['recall']:>10.4f} (召回损失 {1 - report['recall']:.4f})")
+    print(f"  精确搜索:       {report['exact_qps']:>10.1f} queries/sec")
+    print(f"  PQ 搜索 (ADC):  {report['pq_qps']:>10.1f} queries/sec")
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="DINOv2 乘积量化压缩特征存储")
+    parser.add_argument("command", choices=["build", "evaluate"], help="构建压缩存储或评估")
+    parser.add_argument("--store", type=str, help="特征存储目录 (build)")
+    parser.add_argument("--pq", type=str, required=True, help="压缩存储目录")
+    parser.add_argument(
+        "--m",
+        type=int,
+        default=None,
+        help=f"分段数 (每条特征的字节数)，默认取能整除特征维度且不超过 {TARGET_M} 的最大值",
+    )
+    parser.add_argument("--train-size", type=int, default=DEFAULT_TRAIN_SIZE, help="码本训练样本数")
+    parser.add_argument("--iters", type=int, default=DEFAULT_PQ_ITERS, help="k-means 迭代次数")
+    parser.add_argument("--k", type=int, default=10, help="评估的 top-k")
+    parser.add_argument("--num-queries", type=int, default=1000, help="评估查询数 (从存储中抽样)")
+    args = parser.parse_args()
+
+    if args.command == "build":
+        if not args.store:
+            parser.error("build 需要 --store")
+        store = PQStore.build(args.store, args.pq, m=args.m, train_size=args.train_size, iters=args.iters)
+        print(f"压缩存储已保存: {args.pq} ({len(store)} 条, {store.nbytes / 1024**2:.2f} MB)")
+        return
+
+    store = PQStore.load(args.pq)
+    if not store.meta.get("store_dir"):
+        parser.error("评估需要压缩存储记录的来源特征存储")
+    features = FeatureStore.open(store.meta["store_dir"]).features()
+    rows = np.sort(
+        np.random.default_rng(0).choice(len(features), min(args.num_queries, len(features)), replace=False)
+    )
+    report = evaluate_pq(store, features, features[rows], args.k, exclude=rows)
+    print_pq_report(report)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,206 @@
+#!/usr/bin/env python3
+"""
+DINOv2 特征提取 HTTP 服务
+并发的单张图像请求经动态微批处理 (MicroBatcher) 合并为批次推理，
+每个请求返回一个特征向量；/metrics 暴露队列深度与批大小直方图
+
+配置 (环境变量):
+    DINOV2_MODEL          模型名称，默认 dinov2_vits14
+    DINOV2_DEVICE         计算设备，默认 CUDA 可用时为 cuda，否则为 cpu
+    DINOV2_PRECISION      推理精度 fp32/bf16/int8，默认 fp32
+    DINOV2_BACKEND        推理后端 torch/onnx，默认 torch
+    DINOV2_RESOLUTION     输入分辨率 (14 的倍数)，默认 224
+    DINOV2_MAX_BATCH      单批最大请求数，默认 16
+    DINOV2_MAX_WAIT_MS    凑批最长等待时间 (毫秒)，默认 5
+    DINOV2_MODEL_SOURCE   模型来源 auto/local/hub，默认 auto
+    DINOV2_CHECKPOINT_DIR 本地检查点目录 (见 model_registry)
+    DINOV2_IMAGE_ROOT     允许通过 path 读取的图像目录；未设置时只接受 image_base64
+
+运行:
+    cd examples && uvicorn server:app --host 0.0.0.0 --port 8000
+"""
+
+import base64
+import binascii
+import io
+import os
+from contextlib import asynccontextmanager
+from pathlib import Path
+
+from fastapi import FastAPI, HTTPException
+from pydantic import BaseModel, model_validator
+from starlette.concurrency import run_in_threadpool
+
+from execution import ExecutionMode
+from microbatch import DEFAULT_MAX_BATCH, DEFAULT_MAX_WAIT_MS, MicroBatcher
+from pipeline import DECODE_ERRORS, TRANSFORM_CONFIG, PreprocessConfig
+
+IMAGE_ROOT_ENV = "DINOV2_IMAGE_ROOT"
+
+
+def resolve_image_path(path, image_root):
+    """
+    把请求中的 path 解析为 image_root 下的真实路径
+
+    相对路径相对于 image_root；解析符号链接和 .. 之后不在 image_root 内的路径
+    以及未配置 image_root 时一律拒绝 (PermissionError)，避免客户端读取服务器上的任意文件
+    """
+    if image_root is None:
+        raise PermissionError(f"未设置 {IMAGE_ROOT_ENV}，不接受 path，请改用 image_base64")
+    root = Path(image_root).resolve()
+    resolved = (root / path).resolve()
+    if not resolved.is_relative_to(root):
+        raise PermissionError(f"路径不在 {IMAGE_ROOT_ENV} 内: {path}")
+    return str(resolved)
+
+
+class EmbedRequest(BaseModel):
+    """二选一: base64 编码的图像内容，或 DINOV2_IMAGE_ROOT 下的图像路径"""
+
+    image_base64: str | None = None
+    path: str | None = None
+
+    @model_validator(mode="after")
+    def check_source(self):
+        if (self.image_base64 is None) == (self.path is None):
+            raise ValueError("image_base64 与 path 必须且只能提供一个")
+        return self
+
+
+class EmbedResponse(BaseModel):
+    model: str
+    dim: int
+    embedding: list[float]
+    batch_size: int
+
+
+class FeatureService:
+    """
+    模型、预处理与微批处理器的组合
+
+    参数:
+        model_name: 模型名称
+        device: 计算设备
+        mode: 推理执行模式 (ExecutionMode)
+        backend: 推理后端 ('torch' 或 'onnx')
+        resolution: 输入分辨率 (14 的倍数)
+        max_batch: 单批最大请求数
+        max_wait_ms: 凑批最长等待时间 (毫秒)
+        image_root: 允许通过 path 读取的图像目录，为 None 时不接受 path
+    """
+
+    def __init__(
+        self,
+        model_name="dinov2_vits14",
+        device="cpu",
+        mode=None,
+        backend="torch",
+        resolution=TRANSFORM_CONFIG["crop"],
+        max_batch=DEFAULT_MAX_BATCH,
+        max_wait_ms=DEFAULT_MAX_WAIT_MS,
+        image_root=None,
+    ):
+        from extract_features import load_model
+
+        self.model_name = model_name
+        self.device = device
+        self.mode = mode or ExecutionMode()
+        self.preprocess = PreprocessConfig(resolution=resolution)
+        self.backend = backend
+        self.image_root = image_root
+        self.model = load_model(model_name, device, self.mode, backend, resolution)
+        self.batcher = MicroBatcher(self.run_batch, max_batch, max_wait_ms)
+        self._buffer = self.preprocess.transform.allocate(max_batch)
+
+    def decode(self, source):
+        """解码并缩放裁剪单张图像 (在线程池中执行)，返回 uint8 裁剪"""
+        return self.preprocess.load_crop(source)
+
+    def run_batch(self, crops):
+        """把一批 uint8 裁剪写入缓冲区，一次前向得到 (B, D) 特征"""
+        transform = self.preprocess.transform
+        buffer = self._buffer[: len(crops)]
+        for i, crop in enumerate(crops):
+            transform.write(buffer, i, crop)
+        batch = self.mode.prepare_input(transform.normalize(buffer), self.device)
+        with self.mode.grad_context():
+            features = self.model(batch)
+        return self.mode.to_numpy(features)
+
+
+def _service_from_env():
+    from model_registry import get_registry
+
+    get_registry().source = os.getenv("DINOV2_MODEL_SOURCE", "auto")
+    device = os.getenv("DINOV2_DEVICE")
+    if device is None:
+        import torch
+
+        device = "cuda" if torch.cuda.is_available() else "cpu"
+    return FeatureService(
+        model_name=os.getenv("DINOV2_MODEL", "dinov2_vits14"),
+        device=device,
+        mode=ExecutionMode(precision=os.getenv("DINOV2_PRECISION", "fp32")),
+        backend=os.getenv("DINOV2_BACKEND", "torch"),
+        resolution=int(os.getenv("DINOV2_RESOLUTION", TRANSFORM_CONFIG["crop"])),
+        max_batch=int(os.getenv("DINOV2_MAX_BATCH", DEFAULT_MAX_BATCH)),
+        max_wait_ms=float(os.getenv("DINOV2_MAX_WAIT_MS", DEFAULT_MAX_WAIT_MS)),
+        image_root=os.getenv(IMAGE_ROOT_ENV),
+    )
+
+
+@asynccontextmanager
+async def lifespan(app):
+    service = _service_from_env()
+    service.batcher.start()
+    app.state.service = service
+    yield
+    await service.batcher.stop()
+
+
+app = FastAPI(title="DINOv2 Feature Service", lifespan=lifespan)
+
+
+@app.get("/ping")
+def ping() -> dict[str, str]:
+    return {"message": "pong"}
+
+
+@app.post("/embed", response_model=EmbedResponse)
+async def embed(request: EmbedRequest) -> EmbedResponse:
+    service = app.state.service
+    if request.path is not None:
+        try:
+            source = resolve_image_path(request.path, service.image_root)
+        except PermissionError as e:
+            raise HTTPException(status_code=403, detail=str(e))
+    else:
+        try:
+            source = io.BytesIO(base64.b64decode(request.image_base64, validate=True))
+        except (binascii.Error, ValueError) as e:
+            raise HTTPException(status_code=400, detail=f"无效的 base64 图像: {e}")
+
+    try:
+        crop = await run_in_threadpool(service.decode, source)
+    except DECODE_ERRORS as e:
+        # 文件不存在、无法识别或已损坏的图像；推理中的异常不在此处理，按 500 返回
+        raise HTTPException(status_code=400, detail=f"无法读取图像: {e}")
+    vector, batch_size = await service.batcher.submit(crop)
+
+    return EmbedResponse(
+        model=service.model_name,
+        dim=len(vector),
+        embedding=vector.tolist(),
+        batch_size=batch_size,
+    )
+
+
+@app.get("/metrics")
+def metrics() -> dict:
+    return app.state.service.batcher.stats()
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    uvicorn.run("server:app", host="0.0.0.0", port=8000)
@@ -0,0 +1,309 @@
+#!/usr/bin/env python3
+"""
+DINOv2 多进程分片特征提取
+把待处理路径按顺序切成 N 个连续分片，每个工作进程使用独立的 torch 线程数
+与各自的输出存储，全部完成后按分片顺序合并为一个特征存储
+
+目录结构:
+    <output>/              # 合并后的特征存储 (路径顺序与输入一致)
+    <output>.parts/
+    ├── plan.json          # 分片计划 (进程数、待处理数量)，续跑时校验
+    ├── worker_00/         # 各工作进程的特征存储，可单独断点续跑
+    └── worker_01/
+
+中断后重新运行同一命令: 已合并的图像被跳过，各工作进程从自己的存储继续
+"""
+
+import json
+import multiprocessing
+import os
+import shutil
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from feature_store import FeatureStore, MANIFEST_NAME
+
+PARTS_SUFFIX = ".parts"
+PLAN_NAME = "plan.json"
+ERRORS_NAME = "errors.jsonl"
+
+
+def split_shards(paths, num_shards):
+    """把路径列表切成 num_shards 个连续分片，拼接后与原顺序一致"""
+    num_shards = max(1, min(num_shards, len(paths)))
+    size, rest = divmod(len(paths), num_shards)
+    shards = []
+    start = 0
+    for i in range(num_shards):
+        stop = start + size + (1 if i < rest else 0)
+        shards.append(paths[start:stop])
+        start = stop
+    return shards
+
+
+def default_threads_per_worker(num_procs):
+    """平分 CPU 核心，每个工作进程至少 1 个 torch 线程"""
+    return max(1, (os.cpu_count() or 1) // num_procs)
+
+
+def _extract_worker(task):
+    """
+    工作进程入口: 设置线程数、加载模型并把自己的分片写入独立存储
+
+    返回:
+        report: {"worker", "images", "skipped", "threads", "seconds", "images_per_sec"}
+    """
+    import torch
+
+    torch.set_num_threads(task["threads"])
+    torch.set_num_interop_threads(1)
+
+    from extract_features import extract_to_store, load_model
+    from model_registry import get_registry
+    from pipeline import ErrorLog
+
+    registry = get_registry()
+    registry.source = task["model_source"]
+    registry.checkpoint_dir = task["checkpoint_dir"]
+    mode = task["mode"]
+    # 模型加载不计入吞吐量
+    resolution = task["preprocess"].resolution if task["preprocess"] else None
+    load_model(task["model_name"], task["device"], mode, task["backend"], resolution)
+
+    errors = ErrorLog(Path(task["store_dir"]) / ERRORS_NAME) if task["skip_errors"] else None
+    before = _store_rows(task["store_dir"])
+    start = time.perf_counter()
+    store = extract_to_store(
+        task["paths"],
+        task["store_dir"],
+        task["model_name"],
+        batch_size=task["batch_size"],
+        device=task["device"],
+        num_workers=task["num_workers"],
+        queue_depth=task["queue_depth"],
+        shard_size=task["shard_size"],
+        mode=mode,
+        checkpoint_every=task["checkpoint_every"],
+        preprocess=task["preprocess"],
+        tta=task["tta"],
+        errors=errors,
+        backend=task["backend"],
+    )
+    seconds = time.perf_counter() - start
+    images = len(store) - before
+    return {
+        "worker": task["worker"],
+        "images": images,
+        "skipped": len(errors) if errors is not None else 0,
+        "threads": task["threads"],
+        "seconds": seconds,
+        "images_per_sec": images / seconds if seconds > 0 else 0.0,
+    }
+
+
+def _store_rows(store_dir):
+    if not (Path(store_dir) / MANIFEST_NAME).exists():
+        return 0
+    return len(FeatureStore.open(store_dir))
+
+
+def _check_plan(parts_dir, num_procs, num_pending):
+    """续跑时分片划分必须与上次一致，否则同一路径可能落入不同工作进程"""
+    plan_path = parts_dir / PLAN_NAME
+    plan = {"num_procs": num_procs, "num_pending": num_pending}
+    if plan_path.exists():
+        with open(plan_path, "r", encoding="utf-8") as f:
+            previous = json.load(f)
+        if previous != plan:
+            raise ValueError(
+                f"分片计划与未完成的上次运行不一致: {previous}，当前 {plan}；"
+                f"请使用相同的进程数续跑，或删除 {parts_dir} 重新开始"
+            )
+        return
+    parts_dir.mkdir(parents=True, exist_ok=True)
+    with open(plan_path, "w", encoding="utf-8") as f:
+        json.dump(plan, f)
+
+
+def extract_sharded(
+    image_paths,
+    store_dir,
+    model_name="dinov2_vits14",
+    num_procs=2,
+    threads_per_worker=None,
+    batch_size=8,
+    device="cpu",
+    num_workers=1,
+    queue_depth=2,
+    shard_size=None,
+    mode=None,
+    checkpoint_every=10,
+    preprocess=None,
+    tta=None,
+    skip_errors=True,
+    model_source="auto",
+    checkpoint_dir=None,
+    backend="torch",
+):
+    """
+    多进程分片提取特征并合并为一个特征存储
+
+    参数:
+        image_paths: 图像路径列表
+        store_dir: 合并后的特征存储目录 (已存在时跳过其中的路径并追加)
+        model_name: 模型名称
+        num_procs: 工作进程数
+        threads_per_worker: 每个进程的 torch 线程数，默认平分 CPU 核心
+        batch_size: 批处理大小 ('auto' 表示在各进程中按其线程数自动调优)
+        device: 计算设备
+        num_workers: 每个进程的后台解码线程数
+        queue_depth: 每个进程预先解码好的批次数上限
+        shard_size: 特征存储每个分片的行数
+        mode: 推理执行模式 (ExecutionMode)
+        checkpoint_every: 每处理多少批落盘一次检查点
+        preprocess: 预处理配置 (PreprocessConfig)
+        tta: 可选的测试时增强 (TestTimeAugmentation)
+        skip_errors: 是否跳过无法读取的图像 (记入 errors.jsonl)
+        model_source: 模型来源 ('auto'、'local' 或 'hub')
+        checkpoint_dir: 本地检查点目录
+        backend: 推理后端 ('torch' 或 'onnx')
+
+    返回:
+        report: {"images", "seconds", "images_per_sec", "merge_seconds", "rows", "workers": [...]}
+    """
+    from execution import BASELINE_MODE
+    from feature_store import DEFAULT_SHARD_SIZE
+
+    mode = mode or BASELINE_MODE
+    shard_size = shard_size or DEFAULT_SHARD_SIZE
+    threads = threads_per_worker or default_threads_per_worker(num_procs)
+    store_dir = Path(store_dir)
+    parts_dir = store_dir.with_name(store_dir.name + PARTS_SUFFIX)
+
+    # 上次合并在替换存储时中断: 先恢复出完整的存储
+    FeatureStore.recover(store_dir)
+
+    # 已合并的图像不再分配给工作进程
+    done = set()
+    if (store_dir / MANIFEST_NAME).exists():
+        existing = FeatureStore.open(store_dir)
+        if existing.model_name != model_name:
+            raise ValueError(
+                f"存储中的特征来自 {existing.model_name}，与当前模型 {model_name} 不一致"
+            )
+        done = set(existing.paths)
+    pending = [str(p) for p in image_paths if str(p) not in done]
+    if done:
+        print(f"已合并 {len(done)} 张，剩余 {len(pending)} 张")
+    if not pending:
+        print("没有需要处理的图像")
+        return {
+            "images": 0,
+            "seconds": 0.0,
+            "images_per_sec": 0.0,
+            "merge_seconds": 0.0,
+            "rows": len(done),
+            "workers": [],
+        }
+
+    shards = split_shards(pending, num_procs)
+    _check_plan(parts_dir, num_procs, len(pending))
+    tasks = [
+        {
+            "worker": i,
+            "paths": shard,
+            "store_dir": str(parts_dir / f"worker_{i:02d}"),
+            "threads": threads,
+            "model_name": model_name,
+            "batch_size": batch_size,
+            "device": device,
+            "num_workers": num_workers,
+            "queue_depth": queue_depth,
+            "shard_size": shard_size,
+            "mode": mode,
+            "checkpoint_every": checkpoint_every,
+            "preprocess": preprocess,
+            "tta": tta,
+            "skip_errors": skip_errors,
+            "model_source": model_source,
+            "checkpoint_dir": checkpoint_dir,
+            "backend": backend,
+        }
+        for i, shard in enumerate(shards)
+    ]
+    print(
+        f"启动 {len(tasks)} 个工作进程，每个 {threads} 个 torch 线程，"
+        f"分片大小 {[len(shard) for shard in shards]}"
+    )
+
+    if backend == "onnx":
+        # 首次运行时在主进程中导出一次，工作进程直接加载导出文件
+        from model_registry import get_registry
+        from onnx_backend import ensure_onnx
+        from pipeline import DEFAULT_PREPROCESS
+
+        registry = get_registry()
+        registry.source = model_source
+        registry.checkpoint_dir = checkpoint_dir
+        ensure_onnx(model_name, (preprocess or DEFAULT_PREPROCESS).resolution)
+
+    # spawn 启动: 子进程重新初始化 torch，避免 fork 继承父进程的线程状态
+    start = time.perf_counter()
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=len(tasks), mp_context=context) as pool:
+        workers = list(pool.map(_extract_worker, tasks))
+    seconds = time.perf_counter() - start
+
+    # 按分片顺序合并: 已有存储在前，各工作进程的输出依次追加
+    merge_start = time.perf_counter()
+    sources = [store_dir] if done else []
+    sources += [task["store_dir"] for task in tasks]
+    merged = FeatureStore.merge(store_dir, sources, shard_size=shard_size, overwrite=True)
+    _merge_errors(store_dir, [task["store_dir"] for task in tasks])
+    shutil.rmtree(parts_dir)
+    merge_seconds = time.perf_counter() - merge_start
+
+    images = sum(w["images"] for w in workers)
+    return {
+        "images": images,
+        "seconds": seconds,
+        "images_per_sec": images / seconds if seconds > 0 else 0.0,
+        "merge_seconds": merge_seconds,
+        "rows": len(merged),
+        "workers": workers,
+    }
+
+
+def _merge_errors(store_dir, part_dirs):
+    """把各工作进程的错误清单按分片顺序合并到存储目录"""
+    lines = []
+    for part_dir in part_dirs:
+        path = Path(part_dir) / ERRORS_NAME
+        if path.exists():
+            with open(path, "r", encoding="utf-8") as f:
+                lines.extend(f.readlines())
+    target = Path(store_dir) / ERRORS_NAME
+    if lines:
+        with open(target, "w", encoding="utf-8") as f:
+            f.writelines(lines)
+    else:
+        target.unlink(missing_ok=True)
+
+
+def print_sharded_report(report):
+    """打印总吞吐量与各工作进程吞吐量"""
+    print("\n" + "=" * 60)
+    print("多进程提取结果")
+    print("=" * 60)
+    print(f"{'进程':<6} {'线程':>6} {'图像数':>8} {'跳过':>6} {'耗时(秒)':>10} {'images/sec':>12}")
+    for w in report["workers"]:
+        print(
+            f"{w['worker']:<6} {w['threads']:>6} {w['images']:>8} {w['skipped']:>6} "
+            f"{w['seconds']:>10.2f} {w['images_per_sec']:>12.2f}"
+        )
+    print(
+        f"\n总计: {report['images']} 张, 用时 {report['seconds']:.2f} 秒, "
+        f"{report['images_per_sec']:.2f} images/sec (合并 {report['merge_seconds']:.2f} 秒)"
+    )
+    print(f"合并后存储共 {report['rows']} 条")
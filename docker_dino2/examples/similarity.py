@@ -0,0 +1,371 @@
+#!/usr/bin/env python3
+"""
+DINOv2 特征相似度分析
+特征只归一化一次，用一次矩阵乘法得到余弦相似度矩阵，最相似匹配、
+相似分组、最不相似图像对与平均相似度都在矩阵上做向量化计算；
+10k 张图像的完整分析只需数秒
+
+N 达到数万以上时完整矩阵放不进内存，改用分块计算:
+    write_similarity_matrix  逐块写入 float16 内存映射 .npy 文件
+    row_reductions           只计算每行的 top-k、最大值与均值，不生成完整矩阵
+
+批量最近邻查询使用 FeatureIndex.topk: 一次矩阵乘法 + argpartition
+"""
+
+from pathlib import Path
+
+import numpy as np
+
+from feature_store import FeatureStore
+
+# 相似分组的默认阈值
+DEFAULT_GROUP_THRESHOLD = 0.85
+
+# 分块计算的默认块大小 (行数)，每个相似度块占 block_size^2 * 4 字节
+DEFAULT_BLOCK_SIZE = 2048
+
+# 批量查询时每次矩阵乘法的查询数，得分矩阵占 query_batch * N * 4 字节
+DEFAULT_QUERY_BATCH = 1024
+
+
+def normalize(features):
+    """按行 L2 归一化为 float32；范数为 0 的行保持为 0 (与任何特征的相似度为 0)"""
+    features = np.asarray(features, dtype=np.float32)
+    norms = np.linalg.norm(features, axis=1, keepdims=True)
+    return np.divide(features, norms, out=np.zeros_like(features), where=norms > 0)
+
+
+def similarity_matrix(features, others=None):
+    """
+    余弦相似度矩阵
+
+    参数:
+        features: (N, D) 特征
+        others: 可选的 (M, D) 特征，为 None 时计算 features 自身之间的相似度
+
+    返回:
+        similarity: (N, M) float32 矩阵
+    """
+    normed = normalize(features)
+    if others is None:
+        return normed @ normed.T
+    return normed @ normalize(others).T
+
+
+def _with_diagonal(similarity, value, reduce):
+    """临时把对角线设为 value 后执行 reduce(similarity)，避免复制整个矩阵"""
+    diagonal = similarity.diagonal().copy()
+    np.fill_diagonal(similarity, value)
+    try:
+        return reduce(similarity)
+    finally:
+        np.fill_diagonal(similarity, diagonal)
+
+
+def nearest_neighbors(similarity):
+    """
+    每张图像的最相似图像 (排除自身)
+
+    返回:
+        (indices, scores): 两个长度为 N 的数组
+    """
+    indices = _with_diagonal(similarity, -np.inf, lambda s: s.argmax(axis=1))
+    return indices, similarity[np.arange(len(indices)), indices]
+
+
+def ranked_neighbors(similarity):
+    """
+    每张图像的其他图像按相似度从高到低排序的索引 (N, N-1)，不含自身
+
+    相似度相同时按索引顺序排列
+    """
+    order = _with_diagonal(
+        similarity, -np.inf, lambda s: np.argsort(-s, axis=1, kind="stable")
+    )
+    # 自身的相似度为 -inf，总是排在最后
+    return order[:, :-1]
+
+
+def extreme_pair(similarity, largest=False):
+    """
+    相似度最低 (或最高) 的一对不同图像
+
+    矩阵对称，整体 argmin 的第一个位置就是上三角中按行优先的第一个极值对
+
+    返回:
+        (i, j, score)，其中 i < j
+    """
+    if similarity.shape[0] < 2:
+        raise ValueError("至少需要 2 张图像")
+    if largest:
+        flat = _with_diagonal(similarity, -np.inf, np.argmax)
+    else:
+        flat = _with_diagonal(similarity, np.inf, np.argmin)
+    i, j = np.unravel_index(flat, similarity.shape)
+    i, j = (int(i), int(j)) if i < j else (int(j), int(i))
+    return i, j, float(similarity[i, j])
+
+
+def pair_statistics(similarity):
+    """
+    所有不同图像对 (上三角) 的相似度统计
+
+    返回:
+        {"pairs", "mean", "min", "max", "min_pair", "max_pair"}
+    """
+    n = similarity.shape[0]
+    if n < 2:
+        raise ValueError("至少需要 2 张图像")
+    # 对称矩阵: 上三角之和 = (全部之和 - 对角线之和) / 2
+    total = float(similarity.sum(dtype=np.float64) - np.trace(similarity, dtype=np.float64))
+    low_i, low_j, low = extreme_pair(similarity)
+    high_i, high_j, high = extreme_pair(similarity, largest=True)
+    return {
+        "pairs": n * (n - 1) // 2,
+        "mean": total / (n * (n - 1)),
+        "min": low,
+        "max": high,
+        "min_pair": (low_i, low_j),
+        "max_pair": (high_i, high_j),
+    }
+
+
+def greedy_groups(similarity, threshold=DEFAULT_GROUP_THRESHOLD):
+    """
+    贪心分组: 按顺序取尚未分组的图像作为种子，把其后相似度超过阈值且
+    尚未分组的图像归入同一组；只返回包含 2 张及以上图像的组
+
+    每个种子只做一次整行的向量化比较
+    """
+    n = similarity.shape[0]
+    used = np.zeros(n, dtype=bool)
+    groups = []
+    for i in range(n):
+        if used[i]:
+            continue
+        used[i] = True
+        members = np.flatnonzero((similarity[i, i + 1 :] > threshold) & ~used[i + 1 :]) + i + 1
+        if members.size:
+            used[members] = True
+            groups.append([i] + members.tolist())
+    return groups
+
+
+def analyze(features, threshold=DEFAULT_GROUP_THRESHOLD):
+    """
+    完整的相似度分析
+
+    参数:
+        features: (N, D) 特征 (可以是特征存储的内存映射)
+        threshold: 相似分组阈值
+
+    返回:
+        report: {"similarity", "nearest", "nearest_scores", "groups", "stats"}
+    """
+    similarity = similarity_matrix(features)
+    nearest, nearest_scores = nearest_neighbors(similarity)
+    return {
+        "similarity": similarity,
+        "nearest": nearest,
+        "nearest_scores": nearest_scores,
+        "groups": greedy_groups(similarity, threshold),
+        "stats": pair_statistics(similarity),
+    }
+
+
+def topk_rows(scores, k, indices=None):
+    """
+    每行取最大的 k 个值，按从大到小排序 (相似度相同时的先后顺序不保证)
+
+    参数:
+        scores: (B, M) 相似度
+        k: 保留个数 (不超过 M)
+        indices: 可选的 (B, M) 或 (M,) 列索引，默认为列号
+
+    返回:
+        (indices, scores): 两个 (B, k) 数组
+    """
+    if k < scores.shape[1]:
+        part = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    else:
+        part = np.broadcast_to(np.arange(scores.shape[1]), scores.shape)
+    top = np.take_along_axis(scores, part, axis=1)
+    order = np.argsort(-top, axis=1, kind="stable")
+    part = np.take_along_axis(part, order, axis=1)
+    top = np.take_along_axis(top, order, axis=1)
+    if indices is not None:
+        indices = np.broadcast_to(indices, scores.shape)
+        part = np.take_along_axis(indices, part, axis=1)
+    return part, top
+
+
+def _normalized_blocks(features, block_size, start=0):
+    """从 start 行开始逐块读取并归一化特征 (可以是内存映射，每次只读入一块)"""
+    for begin in range(start, len(features), block_size):
+        end = min(begin + block_size, len(features))
+        yield begin, end, normalize(features[begin:end])
+
+
+def write_similarity_matrix(features, path, block_size=DEFAULT_BLOCK_SIZE, dtype=np.float16):
+    """
+    分块计算相似度矩阵并写入内存映射的 .npy 文件
+
+    矩阵对称，只计算上三角的块，再把转置写入对应的下三角位置；
+    内存占用只有两块特征和一个 block_size x block_size 的相似度块
+
+    参数:
+        features: (N, D) 特征 (可以是特征存储的内存映射)
+        path: 输出 .npy 路径，可用 np.load(path, mmap_mode="r") 打开
+        block_size: 块大小
+        dtype: 输出数据类型，默认 float16 (N=100k 时约 20 GB)
+
+    返回:
+        matrix: (N, N) 内存映射
+    """
+    n = len(features)
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    matrix = np.lib.format.open_memmap(path, mode="w+", dtype=dtype, shape=(n, n))
+    for row_start, row_end, rows in _normalized_blocks(features, block_size):
+        for col_start, col_end, cols in _normalized_blocks(features, block_size, row_start):
+            tile = (rows @ cols.T).astype(dtype)
+            matrix[row_start:row_end, col_start:col_end] = tile
+            if col_start != row_start:
+                matrix[col_start:col_end, row_start:row_end] = tile.T
+        matrix.flush()
+    return matrix
+
+
+def row_reductions(features, k=10, block_size=DEFAULT_BLOCK_SIZE, exclude_self=True):
+    """
+    分块计算每行的相似度归约，不生成完整矩阵
+
+    每个行块依次与所有列块相乘，维护当前的 top-k、最大值与累计和，
+    内存占用与 N 成线性关系
+
+    参数:
+        features: (N, D) 特征 (可以是特征存储的内存映射)
+        k: 每行保留的最相似个数，0 表示不计算 top-k
+        block_size: 块大小
+        exclude_self: 是否排除每行与自身的相似度
+
+    返回:
+        {"indices": (N, k), "scores": (N, k), "max": (N,), "mean": (N,)}
+    """
+    n = len(features)
+    others = n - 1 if exclude_self else n
+    if others < 1:
+        raise ValueError("排除自身后至少需要 2 张图像")
+    k = min(k, others)
+
+    top_indices = np.empty((n, k), dtype=np.int64)
+    top_scores = np.empty((n, k), dtype=np.float32)
+    maxima = np.empty(n, dtype=np.float32)
+    means = np.empty(n, dtype=np.float32)
+
+    for row_start, row_end, rows in _normalized_blocks(features, block_size):
+        count = row_end - row_start
+        best_indices = np.empty((count, 0), dtype=np.int64)
+        best_scores = np.empty((count, 0), dtype=np.float32)
+        total = np.zeros(count, dtype=np.float64)
+        maximum = np.full(count, -np.inf, dtype=np.float32)
+
+        for col_start, col_end, cols in _normalized_blocks(features, block_size):
+            tile = rows @ cols.T
+            if exclude_self and col_start < row_end and row_start < col_end:
+                # 当前块中落在对角线上的位置
+                diag = np.arange(max(row_start, col_start), min(row_end, col_end))
+                tile[diag - row_start, diag - col_start] = 0.0
+                total += tile.sum(axis=1, dtype=np.float64)
+                tile[diag - row_start, diag - col_start] = -np.inf
+            else:
+                total += tile.sum(axis=1, dtype=np.float64)
+            np.maximum(maximum, tile.max(axis=1), out=maximum)
+
+            if k:
+                candidates = np.concatenate([best_scores, tile], axis=1)
+                columns = np.concatenate(
+                    [best_indices, np.broadcast_to(np.arange(col_start, col_end), tile.shape)],
+                    axis=1,
+                )
+                best_indices, best_scores = topk_rows(candidates, min(k, candidates.shape[1]), columns)
+
+        top_indices[row_start:row_end] = best_indices
+        top_scores[row_start:row_end] = best_scores
+        maxima[row_start:row_end] = maximum
+        means[row_start:row_end] = total / others
+
+    return {"indices": top_indices, "scores": top_scores, "max": maxima, "mean": means}
+
+
+class FeatureIndex:
+    """
+    精确最近邻检索: 特征归一化一次后常驻内存，查询按批做矩阵乘法
+
+    参数:
+        features: (N, D) 特征
+        paths: 可选的与特征行对应的图像路径
+    """
+
+    def __init__(self, features, paths=None):
+        self.vectors = normalize(features)
+        self.paths = list(paths) if paths is not None else None
+
+    @classmethod
+    def from_store(cls, store_dir):
+        """从特征存储构建索引"""
+        store = FeatureStore.open(store_dir)
+        return cls(store.features(), store.paths)
+
+    def __len__(self):
+        return len(self.vectors)
+
+    @property
+    def dim(self):
+        return self.vectors.shape[1]
+
+    def topk(self, queries, k=10, exclude=None, query_batch=DEFAULT_QUERY_BATCH):
+        """
+        批量查询最相似的 k 个特征
+
+        参数:
+            queries: (B, D) 查询特征 (不必归一化) 或单个 (D,) 向量
+            k: 返回个数 (超过可返回的数量时截断)
+            exclude: 可选的长度为 B 的整数数组，第 i 个查询不返回索引 exclude[i]
+                (通常是查询自身在索引中的位置)，-1 表示不排除
+            query_batch: 每次矩阵乘法的查询数，限制得分矩阵的内存
+
+        返回:
+            (indices, scores): (B, k) int64 索引与 float32 余弦相似度，按相似度从高到低
+        """
+        queries = normalize(np.atleast_2d(queries))
+        if queries.shape[1] != self.dim:
+            raise ValueError(f"查询维度 {queries.shape[1]} 与索引维度 {self.dim} 不一致")
+        if exclude is not None:
+            exclude = np.asarray(exclude, dtype=np.int64)
+            if exclude.shape != (len(queries),):
+                raise ValueError(f"exclude 长度应为 {len(queries)}，实际为 {exclude.shape}")
+        k = min(k, len(self) - (1 if exclude is not None else 0))
+        if k < 1:
+            raise ValueError("索引中没有可返回的特征")
+
+        indices = np.empty((len(queries), k), dtype=np.int64)
+        scores = np.empty((len(queries), k), dtype=np.float32)
+        for start in range(0, len(queries), query_batch):
+            stop = min(start + query_batch, len(queries))
+            batch_scores = queries[start:stop] @ self.vectors.T
+            if exclude is not None:
+                rows = np.flatnonzero(exclude[start:stop] >= 0)
+                batch_scores[rows, exclude[start:stop][rows]] = -np.inf
+            indices[start:stop], scores[start:stop] = topk_rows(batch_scores, k)
+        return indices, scores
+
+    def topk_self(self, k=10, ids=None, query_batch=DEFAULT_QUERY_BATCH):
+        """
+        以索引中已有的特征为查询，排除自身
+
+        参数:
+            ids: 查询的行号，默认为全部行
+        """
+        ids = np.arange(len(self)) if ids is None else np.asarray(ids, dtype=np.int64)
+        return self.topk(self.vectors[ids], k, exclude=ids, query_batch=query_batch)
@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+"""
+DINOv2 测试时增强 (TTA)
+把每张图像在同一个批次张量中展开为 K 个视图 (翻转/多裁剪)，
+一次前向后再按图像平均，得到更稳健的检索特征
+"""
+
+import numpy as np
+
+# 多裁剪视图的边长比例: 从 224 裁剪中取 196 像素的角落区域再放大回 224
+CROP_SCALE = 0.875
+
+# 可用的视图
+VIEWS = ("identity", "hflip", "top_left", "top_right", "bottom_left", "bottom_right")
+
+# 预设视图组合
+TTA_PRESETS = {
+    "flip": ("identity", "hflip"),
+    "five_crop": ("identity", "top_left", "top_right", "bottom_left", "bottom_right"),
+    "flip_five_crop": (
+        "identity",
+        "top_left",
+        "top_right",
+        "bottom_left",
+        "bottom_right",
+        "hflip",
+        "hflip+top_left",
+        "hflip+top_right",
+        "hflip+bottom_left",
+        "hflip+bottom_right",
+    ),
+}
+
+
+def _corner_crop(batch, corner, scale=CROP_SCALE):
+    """从 (B, 3, H, W) 批次中裁剪一个角落区域并双线性放大回原尺寸"""
+    import torch.nn.functional as F
+
+    h, w = batch.shape[-2:]
+    ch, cw = int(round(h * scale)), int(round(w * scale))
+    top = 0 if corner.startswith("top") else h - ch
+    left = 0 if corner.endswith("left") else w - cw
+    crop = batch[..., top : top + ch, left : left + cw]
+    return F.interpolate(crop, size=(h, w), mode="bilinear", align_corners=False)
+
+
+def apply_view(batch, view):
+    """
+    对整批输入应用一个视图变换
+
+    参数:
+        batch: 预处理后的输入批次 (B, 3, H, W)
+        view: 视图名称，VIEWS 中的一项或用 '+' 连接的组合 (如 'hflip+top_left')
+    """
+    import torch
+
+    for op in view.split("+"):
+        if op not in VIEWS:
+            raise ValueError(f"不支持的视图: {op} (可选: {VIEWS})")
+        if op == "hflip":
+            batch = torch.flip(batch, dims=[-1])
+        elif op != "identity":
+            batch = _corner_crop(batch, op)
+    return batch
+
+
+class TestTimeAugmentation:
+    """
+    测试时增强配置
+
+    参数:
+        views: 预设名称 (见 TTA_PRESETS) 或视图名称序列
+    """
+
+    def __init__(self, views="flip"):
+        if isinstance(views, str):
+            if views not in TTA_PRESETS:
+                raise ValueError(f"不支持的 TTA 预设: {views} (可选: {list(TTA_PRESETS)})")
+            self.name = views
+            views = TTA_PRESETS[views]
+        else:
+            self.name = None
+        self.views = tuple(views)
+        if not self.views:
+            raise ValueError("TTA 至少需要一个视图")
+
+    @property
+    def num_views(self):
+        return len(self.views)
+
+    def expand(self, batch):
+        """
+        把 (B, 3, H, W) 展开为 (K*B, 3, H, W)
+
+        视图优先排列: 第 k 个视图的整批图像位于 [k*B, (k+1)*B)
+        """
+        import torch
+
+        return torch.cat([apply_view(batch, view) for view in self.views])
+
+    def reduce(self, features):
+        """
+        把 K*B 行的输出按图像平均回 B 行
+
+        参数:
+            features: (K*B, ...) numpy 数组，或 {输出类型: 数组} 字典
+        """
+        if isinstance(features, dict):
+            return {name: self.reduce(value) for name, value in features.items()}
+        k = self.num_views
+        features = features.reshape((k, features.shape[0] // k) + features.shape[1:])
+        return features.mean(axis=0, dtype=np.float32)
+
+    def cache_extra(self):
+        """特征缓存键中与 TTA 相关的部分"""
+        return {"tta": list(self.views)}
+
+    def describe(self):
+        return self.name or "+".join(self.views)
+
+    def __repr__(self):
+        return f"TestTimeAugmentation({self.describe()})"
+
+
+def add_tta_args(parser):
+    """为命令行解析器添加 TTA 相关参数"""
+    parser.add_argument(
+        "--tta",
+        type=str,
+        default=None,
+        choices=list(TTA_PRESETS),
+        help="测试时增强: 每张图像展开为多个视图在同一批次中推理并取平均",
+    )
+
+
+def tta_from_args(args):
+    """根据命令行参数构造 TestTimeAugmentation，未启用时返回 None"""
+    if args.tta is None:
+        return None
+    return TestTimeAugmentation(args.tta)
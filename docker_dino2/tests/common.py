@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+"""
+测试公用工具
+带簇结构的合成特征与由它们写成的特征存储，供索引/压缩测试共用；
+以及 data/ 下测试图像的收集，供各基准测试共用
+"""
+
+import sys
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "examples"))
+from feature_store import FeatureStore
+
+DATA_DIR = Path(__file__).resolve().parent.parent / "data"
+
+# 基准测试使用的图像目录及其文件模式
+IMAGE_DIRS = {
+    "test_images": ["*.jpg"],
+    "test_photo": ["*.jpg", "*.jpeg", "*.png", "*.webp", "*.bmp"],
+}
+
+
+def collect_images(name, patterns):
+    """收集目录下的图像文件"""
+    files = []
+    for pattern in patterns:
+        files.extend((DATA_DIR / name).glob(pattern))
+    return sorted(str(f) for f in files)
+
+
+# 合成特征配置
+SYNTHETIC_CONFIG = {
+    "num_vectors": 50000,
+    "dim": 384,
+    "num_clusters": 500,  # 合成数据的真实簇数
+    "noise": 1.5,  # 簇内噪声相对簇中心的标准差
+    "shard_size": 20000,
+}
+
+
+def make_features(seed=0, config=SYNTHETIC_CONFIG):
+    """生成带簇结构的合成特征 (簇中心 + 噪声)，模拟真实嵌入的分布"""
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((config["num_clusters"], config["dim"]))
+    labels = rng.integers(0, config["num_clusters"], config["num_vectors"])
+    noise = rng.standard_normal((config["num_vectors"], config["dim"]))
+    return (centers[labels] + config["noise"] * noise).astype(np.float32)
+
+
+def write_store(features, store_dir, shard_size=SYNTHETIC_CONFIG["shard_size"]):
+    """把特征写入多分片特征存储，返回对应的图像路径列表"""
+    paths = [f"img_{i:06d}.jpg" for i in range(len(features))]
+    with FeatureStore.create(
+        store_dir, dim=features.shape[1], model_name="synthetic", shard_size=shard_size
+    ) as store:
+        store.append(paths, features)
+    return paths
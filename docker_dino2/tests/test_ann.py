@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+"""
+DINOv2 IVF 近似最近邻索引测试
+在带聚类结构的合成特征上检查: 召回率随 nprobe 上升、nprobe = nlist 时
+与精确搜索一致、从特征存储构建并以内存映射方式加载
+
+用法:
+    python3 tests/test_ann.py
+"""
+
+import sys
+import tempfile
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "examples"))
+from common import make_features, write_store
+from ann_index import IVFIndex, benchmark_index, print_benchmark_report, recall_at_k
+from similarity import FeatureIndex
+
+# 测试配置
+TEST_CONFIG = {
+    "nlist": 256,
+    "num_queries": 500,
+    "k": 10,
+    "nprobes": [1, 4, 16, 64],
+    "min_recall_nprobe_16": 0.9,
+}
+
+
+def test_recall(features, tmp_dir):
+    """召回率随 nprobe 单调上升，nprobe = nlist 时与精确搜索一致"""
+    print("=" * 60)
+    print(f"召回率测试: {len(features)} 条, nlist={TEST_CONFIG['nlist']}")
+    print("=" * 60)
+
+    try:
+        index = IVFIndex.build(features, Path(tmp_dir) / "array_index", nlist=TEST_CONFIG["nlist"])
+        rows = np.random.default_rng(1).choice(len(features), TEST_CONFIG["num_queries"], replace=False)
+        report = benchmark_index(
+            index, features, features[rows], TEST_CONFIG["k"], TEST_CONFIG["nprobes"], exclude=rows
+        )
+        print_benchmark_report(report)
+
+        recalls = [r["recall"] for r in report["results"]]
+        assert recalls == sorted(recalls), f"召回率应随 nprobe 上升: {recalls}"
+        recall_16 = report["results"][TEST_CONFIG["nprobes"].index(16)]["recall"]
+        assert recall_16 >= TEST_CONFIG["min_recall_nprobe_16"], f"nprobe=16 召回率过低: {recall_16:.4f}"
+
+        exact_ids, exact_scores = FeatureIndex(features).topk(features[rows], TEST_CONFIG["k"], exclude=rows)
+        ids, scores = index.search(features[rows], TEST_CONFIG["k"], nprobe=index.nlist, exclude=rows)
+        assert recall_at_k(ids, exact_ids) == 1.0, "nprobe = nlist 时应与精确搜索一致"
+        assert np.allclose(scores, exact_scores, atol=1e-5)
+        assert (ids != rows[:, None]).all(), "exclude 的行不应出现在结果中"
+        print(f"\n✓ nprobe=nlist 与精确搜索一致")
+        return True
+
+    except Exception as e:
+        print(f"✗ 召回率测试失败: {e}")
+        return False
+
+
+def test_store_roundtrip(features, tmp_dir):
+    """从多分片特征存储构建，加载后为内存映射且结果与构建时一致"""
+    print("=" * 60)
+    print("特征存储构建与内存映射加载测试")
+    print("=" * 60)
+
+    try:
+        store_dir = Path(tmp_dir) / "store"
+        paths = write_store(features, store_dir)
+
+        index_dir = Path(tmp_dir) / "store_index"
+        built = IVFIndex.build(store_dir, index_dir, nlist=TEST_CONFIG["nlist"], block_size=7000)
+        queries = features[:50]
+        ids, scores = built.search(queries, TEST_CONFIG["k"], nprobe=8)
+
+        loaded = IVFIndex.load(index_dir)
+        assert isinstance(loaded.vectors, np.memmap), "倒排向量应以内存映射方式加载"
+        assert isinstance(loaded.ids, np.memmap), "行号应以内存映射方式加载"
+        assert len(loaded) == len(features) and loaded.meta["model_name"] == "synthetic"
+        assert np.array_equal(np.sort(loaded.ids), np.arange(len(features))), "每一行应恰好出现在一个列表中"
+
+        loaded_ids, loaded_scores = loaded.search(queries, TEST_CONFIG["k"], nprobe=8)
+        assert (loaded_ids == ids).all() and np.allclose(loaded_scores, scores)
+        assert loaded.paths[ids[0, 0]] == paths[0], "查询自身应是第一个结果"
+        print(f"  列表大小: {loaded.list_sizes().min()}-{loaded.list_sizes().max()}")
+        print(f"\n✓ 构建/加载一致")
+        return True
+
+    except Exception as e:
+        print(f"✗ 特征存储测试失败: {e}")
+        return False
+
+
+def main():
+    """主测试函数"""
+    print("\n" + "=" * 60)
+    print("DINOv2 IVF 近似最近邻索引测试")
+    print("=" * 60 + "\n")
+
+    features = make_features()
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        results = [test_recall(features, tmp_dir), test_store_roundtrip(features, tmp_dir)]
+
+    passed = sum(results)
+    total = len(results)
+    print("=" * 60)
+    print(f"通过测试: {passed}/{total}")
+
+    return 0 if passed == total else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
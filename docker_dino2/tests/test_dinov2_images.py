@@ -8,12 +8,26 @@ import os
 import sys
 import time
 import json
+import shutil
 import torch
 import numpy as np
 from PIL import Image
-import torchvision.transforms as transforms
 from pathlib import Path
 
+# 复用 examples/ 中的模型注册表
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "examples"))
+from model_registry import get_model
+from feature_store import FeatureStore
+from pipeline import BatchTransform
+from similarity import (
+    FeatureIndex,
+    extreme_pair,
+    greedy_groups,
+    nearest_neighbors,
+    similarity_matrix,
+    write_similarity_matrix,
+)
+
 # 设置设备
 device = "cuda" if torch.cuda.is_available() else "cpu"
 print(f"使用设备: {device}")
@@ -21,14 +35,7 @@ if device == "cuda":
     print(f"GPU: {torch.cuda.get_device_name(0)}")
 
 # 图像预处理
-transform = transforms.Compose(
-    [
-        transforms.Resize(256),
-        transforms.CenterCrop(224),
-        transforms.ToTensor(),
-        transforms.Normalize(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225]),
-    ]
-)
+transform = BatchTransform()
 
 
 def load_model():
@@ -37,9 +44,7 @@ def load_model():
     print("加载 DINOv2 模型...")
     print("=" * 60)
 
-    model = torch.hub.load("facebookresearch/dinov2", "dinov2_vits14")
-    model = model.to(device)
-    model.eval()
+    model = get_model("dinov2_vits14", device)
 
     print(f"✓ 模型加载成功")
     print(f"✓ 模型类型: DINOv2 ViT-S/14")
@@ -60,31 +65,22 @@ def extract_features(model, image_path):
     return features.cpu().numpy().flatten()
 
 
-def compute_similarity(features1, features2):
-    """计算余弦相似度"""
-    norm1 = np.linalg.norm(features1)
-    norm2 = np.linalg.norm(features2)
-
-    if norm1 == 0 or norm2 == 0:
-        return 0.0
-
-    return np.dot(features1, features2) / (norm1 * norm2)
-
-
 def find_most_similar(query_features, all_features, all_names, top_k=3):
-    """找出最相似的图片"""
-    similarities = []
-    for i, features in enumerate(all_features):
-        sim = compute_similarity(query_features, features)
-        similarities.append((all_names[i], sim, i))
+    """找出最相似的图片，返回 [(名称, 相似度, 索引), ...]"""
+    indices, scores = FeatureIndex(all_features).topk(query_features, top_k)
+    return [(all_names[i], float(sim), int(i)) for i, sim in zip(indices[0], scores[0])]
 
-    # 排序并返回前K个
-    similarities.sort(key=lambda x: x[1], reverse=True)
-    return similarities[:top_k]
 
+def test_all_images(model, test_dir, store_dir=None):
+    """
+    测试所有图片
 
-def test_all_images(model, test_dir):
-    """测试所有图片"""
+    参数:
+        model: DINOv2 模型
+        test_dir: 测试图片目录
+        store_dir: 特征存储目录，给出时特征增量写入分片存储，
+                   相似度分析直接读取其内存映射
+    """
     print("\n" + "=" * 60)
     print("开始测试10张图片")
     print("=" * 60)
@@ -103,6 +99,11 @@ def test_all_images(model, test_dir):
     all_names = []
     all_categories = []
 
+    store = None
+    if store_dir:
+        shutil.rmtree(store_dir, ignore_errors=True)
+        store = FeatureStore.create(store_dir, model_name="dinov2_vits14")
+
     # 提取所有图片的特征
     print("正在提取特征...")
     start_time = time.time()
@@ -113,13 +114,22 @@ def test_all_images(model, test_dir):
         category = categories.get(base_name, base_name)
 
         features = extract_features(model, img_path)
-        all_features.append(features)
+        if store is not None:
+            store.append([img_path], features)
+        else:
+            all_features.append(features)
         all_names.append(base_name)
         all_categories.append(category)
 
         print(f"  {i}. {img_file:25s} -> {category}")
 
     elapsed = time.time() - start_time
+
+    if store is not None:
+        store.close()
+        # 以零拷贝内存映射方式打开，后续分析不再复制特征
+        all_features = FeatureStore.open(store_dir).features()
+
     print(f"\n✓ 特征提取完成，耗时: {elapsed:.2f}秒")
     print(f"✓ 平均每张图片: {elapsed / len(image_files):.3f}秒")
 
@@ -130,22 +140,16 @@ def test_all_images(model, test_dir):
 
     # 1. 显示特征统计
     print("\n【特征统计】")
-    features_array = np.array(all_features)
+    features_array = np.asarray(all_features)
     print(f"  特征矩阵形状: {features_array.shape}")
     print(f"  特征均值: {features_array.mean():.4f}")
     print(f"  特征标准差: {features_array.std():.4f}")
     print(f"  特征最小值: {features_array.min():.4f}")
     print(f"  特征最大值: {features_array.max():.4f}")
 
-    # 2. 计算相似度矩阵
+    # 2. 计算相似度矩阵 (归一化一次，一次矩阵乘法)
     print("\n【相似度分析】")
-    similarity_matrix = np.zeros((len(image_files), len(image_files)))
-
-    for i in range(len(image_files)):
-        for j in range(len(image_files)):
-            similarity_matrix[i][j] = compute_similarity(
-                all_features[i], all_features[j]
-            )
+    sim_matrix = similarity_matrix(all_features)
 
     # 3. 为每张图片找出最相似的图片
     print("\n【每张图片的最相似匹配】")
@@ -153,15 +157,10 @@ def test_all_images(model, test_dir):
     print(f"{'查询图片':<20} {'类别':<15} {'最相似':<20} {'相似度':>10}")
     print("-" * 80)
 
+    # 排除自身，找最相似的
+    nearest, nearest_scores = nearest_neighbors(sim_matrix)
     for i in range(len(image_files)):
-        # 排除自身，找最相似的
-        similarities = []
-        for j in range(len(image_files)):
-            if i != j:
-                similarities.append((j, similarity_matrix[i][j]))
-
-        similarities.sort(key=lambda x: x[1], reverse=True)
-        most_similar_idx, max_sim = similarities[0]
+        most_similar_idx, max_sim = nearest[i], nearest_scores[i]
 
         query_name = all_names[i]
         query_cat = all_categories[i]
@@ -188,7 +187,7 @@ def test_all_images(model, test_dir):
             if i == j:
                 row += f" {'---':>6}"
             else:
-                row += f" {similarity_matrix[i][j]:>6.3f}"
+                row += f" {sim_matrix[i][j]:>6.3f}"
         print(row)
     print("-" * 100)
     print("注: 数值越高表示越相似 (范围: -1 到 1)")
@@ -196,23 +195,7 @@ def test_all_images(model, test_dir):
     # 5. 聚类分析 - 将相似的图片分组
     print("\n【相似图片分组】(相似度 > 0.8)")
     threshold = 0.8
-    groups = []
-    used = set()
-
-    for i in range(len(image_files)):
-        if i in used:
-            continue
-
-        group = [i]
-        used.add(i)
-
-        for j in range(i + 1, len(image_files)):
-            if j not in used and similarity_matrix[i][j] > threshold:
-                group.append(j)
-                used.add(j)
-
-        if len(group) > 1:
-            groups.append(group)
+    groups = greedy_groups(sim_matrix, threshold)
 
     if groups:
         for idx, group in enumerate(groups, 1):
@@ -224,16 +207,7 @@ def test_all_images(model, test_dir):
 
     # 6. 最不相似的图片对
     print("\n【最不相似的图片对】(差异最大)")
-    min_sim = float("inf")
-    min_pair = (0, 0)
-
-    for i in range(len(image_files)):
-        for j in range(i + 1, len(image_files)):
-            if similarity_matrix[i][j] < min_sim:
-                min_sim = similarity_matrix[i][j]
-                min_pair = (i, j)
-
-    i, j = min_pair
+    i, j, min_sim = extreme_pair(sim_matrix)
     print(f"  {all_names[i]} ({all_categories[i]})")
     print(f"  vs")
     print(f"  {all_names[j]} ({all_categories[j]})")
@@ -246,7 +220,7 @@ def test_all_images(model, test_dir):
     print(f"  平均时间: {elapsed / len(image_files) * 1000:.2f}ms/张")
     print(f"  吞吐量: {len(image_files) / elapsed:.2f}张/秒")
 
-    return all_features, all_names, all_categories, similarity_matrix
+    return all_features, all_names, all_categories, sim_matrix
 
 
 def main():
@@ -272,18 +246,22 @@ def main():
         print("请先运行: python3 data/test_images/generate_images.py")
         sys.exit(1)
 
+    output_dir = "/home/ubuntu2204/kimi_prj/docker_dino2/output"
+    os.makedirs(output_dir, exist_ok=True)
+    store_dir = os.path.join(output_dir, "features_store")
+
     # 运行测试
-    features, names, categories, sim_matrix = test_all_images(model, test_dir)
+    features, names, categories, sim_matrix = test_all_images(
+        model, test_dir, store_dir
+    )
 
     # 保存结果
-    output_dir = "/home/ubuntu2204/kimi_prj/docker_dino2/output"
-    os.makedirs(output_dir, exist_ok=True)
 
     # 保存特征
     np.save(os.path.join(output_dir, "features.npy"), np.array(features))
 
-    # 保存相似度矩阵
-    np.save(os.path.join(output_dir, "similarity_matrix.npy"), sim_matrix)
+    # 保存相似度矩阵 (分块写入 float16 内存映射，图像数量很大时也不会占满内存)
+    write_similarity_matrix(features, os.path.join(output_dir, "similarity_matrix.npy"))
 
     # 保存结果摘要
     results = {
@@ -301,6 +279,7 @@ def main():
     print("测试结果已保存")
     print("=" * 60)
     print(f"  特征文件: output/features.npy")
+    print(f"  特征存储: output/features_store/")
     print(f"  相似度矩阵: output/similarity_matrix.npy")
     print(f"  结果摘要: output/results.json")
 
@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+"""
+DINOv2 无法读取图像的容错测试
+在 data/test_images 中混入不存在的文件和损坏的文件，检查批量提取
+(带或不带特征缓存) 会记录并跳过它们，其余图像的特征不受影响；
+解码以外的异常不会被当作坏图像吞掉
+"""
+
+import sys
+import tempfile
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "examples"))
+from extract_features import batch_extract_features
+from feature_cache import FeatureCache
+from pipeline import BatchPrefetcher, ErrorLog, PreprocessConfig
+
+DATA_DIR = Path(__file__).resolve().parent.parent / "data"
+
+# 测试配置
+TEST_CONFIG = {
+    "model_name": "dinov2_vits14",
+    "device": "cpu",
+    "batch_size": 4,
+    "max_abs_deviation": 1e-5,
+}
+
+
+def make_bad_paths(tmp_dir):
+    """返回 (不存在的路径, 损坏的图像路径)"""
+    missing = str(Path(tmp_dir) / "missing.jpg")
+    corrupt = Path(tmp_dir) / "corrupt.jpg"
+    corrupt.write_bytes(b"not an image")
+    return missing, str(corrupt)
+
+
+def test_skip(image_paths, bad_paths, cache=None, label="无缓存"):
+    """坏图像被记录并跳过，其余图像的特征与全部正常时一致"""
+    print("=" * 60)
+    print(f"容错测试: {label}")
+    print("=" * 60)
+
+    try:
+        reference = batch_extract_features(
+            image_paths,
+            TEST_CONFIG["model_name"],
+            batch_size=TEST_CONFIG["batch_size"],
+            device=TEST_CONFIG["device"],
+        )
+        # 坏图像插在批次中间，检查跳过后结果顺序仍然对齐
+        mixed = image_paths[:3] + [bad_paths[0]] + image_paths[3:6] + [bad_paths[1]] + image_paths[6:]
+        errors = ErrorLog()
+        features = batch_extract_features(
+            mixed,
+            TEST_CONFIG["model_name"],
+            batch_size=TEST_CONFIG["batch_size"],
+            device=TEST_CONFIG["device"],
+            cache=cache,
+            errors=errors,
+        )
+
+        assert sorted(errors.paths()) == sorted(bad_paths), f"错误记录不符: {errors.paths()}"
+        assert features.shape == reference.shape, f"特征数量不符: {features.shape}"
+        deviation = float(np.max(np.abs(features - reference)))
+        assert deviation <= TEST_CONFIG["max_abs_deviation"], f"最大偏差 {deviation:.2e}"
+        print(f"  跳过 {len(errors)} 张, 保留 {len(features)} 张, 最大偏差 {deviation:.2e}")
+        print(f"\n✓ {label}: 坏图像被记录并跳过")
+        return True
+
+    except Exception as e:
+        print(f"✗ {label}: 容错测试失败: {type(e).__name__}: {e}")
+        return False
+
+
+class BrokenPreprocess(PreprocessConfig):
+    """解码正常、但在指定图像上抛出程序错误的预处理"""
+
+    def __init__(self, broken_path):
+        super().__init__()
+        self.broken_path = broken_path
+
+    def load_crop(self, path):
+        if path == self.broken_path:
+            raise RuntimeError("预处理程序错误")
+        return super().load_crop(path)
+
+
+def test_non_decode_error(image_paths, bad_paths):
+    """给出 errors 时，解码以外的异常仍然抛出，不记为无法读取的图像"""
+    print("=" * 60)
+    print("非解码异常传递测试")
+    print("=" * 60)
+
+    try:
+        for num_workers in (0, 2):
+            errors = ErrorLog()
+            prefetcher = BatchPrefetcher(
+                list(bad_paths) + image_paths,
+                BrokenPreprocess(image_paths[2]),
+                batch_size=TEST_CONFIG["batch_size"],
+                num_workers=num_workers,
+                errors=errors,
+            )
+            try:
+                list(prefetcher)
+                raise AssertionError("程序错误不应被跳过")
+            except RuntimeError as e:
+                print(f"  num_workers={num_workers}: 抛出 {type(e).__name__}: {e}")
+            assert errors.paths() == list(bad_paths), f"只应记录坏图像: {errors.paths()}"
+        print(f"\n✓ 非解码异常原样抛出")
+        return True
+
+    except Exception as e:
+        print(f"✗ 非解码异常传递测试失败: {type(e).__name__}: {e}")
+        return False
+
+
+def main():
+    """主测试函数"""
+    print("\n" + "=" * 60)
+    print("DINOv2 无法读取图像的容错测试")
+    print("=" * 60 + "\n")
+
+    image_paths = sorted(str(p) for p in (DATA_DIR / "test_images").glob("*.jpg"))
+    if len(image_paths) < 7:
+        print(f"⚠ 图像不足 7 张: {DATA_DIR / 'test_images'}")
+        return 1
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        bad_paths = make_bad_paths(tmp_dir)
+        cache = FeatureCache(Path(tmp_dir) / "cache")
+        results = [
+            test_skip(image_paths, bad_paths),
+            # 第一次缓存全部未命中，第二次正常图像全部命中
+            test_skip(image_paths, bad_paths, cache, "特征缓存 (未命中)"),
+            test_skip(image_paths, bad_paths, cache, "特征缓存 (命中)"),
+            test_non_decode_error(image_paths, bad_paths),
+        ]
+
+    passed = sum(results)
+    total = len(results)
+    print("=" * 60)
+    print(f"通过测试: {passed}/{total}")
+
+    return 0 if passed == total else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
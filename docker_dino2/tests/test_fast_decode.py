@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+"""
+DINOv2 缩放解码基准测试
+对比全分辨率解码与缩放解码 (JPEG draft / reduce) 在 data/test_photo 上的
+预处理耗时、输入张量差异与特征余弦相似度
+"""
+
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+import torch
+from PIL import Image
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "examples"))
+from model_registry import get_model
+from pipeline import TRANSFORM_CONFIG, PreprocessConfig, open_image_reduced
+
+DATA_DIR = Path(__file__).resolve().parent.parent / "data"
+
+# 测试配置
+TEST_CONFIG = {
+    "device": "cuda" if torch.cuda.is_available() else "cpu",
+    "model_name": "dinov2_vits14",
+    "repeats": 5,
+    "jpeg_scale": 3,  # 重新编码为 JPEG 时的放大倍数，模拟大尺寸相机照片
+    "min_cosine": 0.999,  # 解码结果短边保留 2 倍余量，特征应与全分辨率解码几乎一致
+}
+
+
+def collect_photos():
+    """收集 data/test_photo 中的照片"""
+    files = []
+    for ext in ["*.jpg", "*.jpeg", "*.png", "*.webp", "*.bmp"]:
+        files.extend((DATA_DIR / "test_photo").glob(ext))
+    return sorted(str(f) for f in files)
+
+
+def make_large_jpegs(photo_files, output_dir):
+    """把照片放大后重新编码为 JPEG，用于测试 draft() 路径"""
+    jpeg_files = []
+    for i, path in enumerate(photo_files):
+        image = Image.open(path).convert("RGB")
+        w, h = image.size
+        scale = TEST_CONFIG["jpeg_scale"]
+        image = image.resize((w * scale, h * scale), Image.BICUBIC)
+        out = Path(output_dir) / f"{i:02d}_{Path(path).stem}.jpg"
+        image.save(out, quality=92)
+        jpeg_files.append(str(out))
+    return jpeg_files
+
+
+def time_preprocess(preprocess, files):
+    """返回每张图像的平均预处理耗时 (毫秒) 与预处理结果"""
+    tensors = [preprocess.load(f) for f in files]  # 预热
+    start = time.perf_counter()
+    for _ in range(TEST_CONFIG["repeats"]):
+        for f in files:
+            preprocess.load(f)
+    elapsed = time.perf_counter() - start
+    return elapsed / (TEST_CONFIG["repeats"] * len(files)) * 1000, torch.stack(tensors)
+
+
+def test_decode_paths(name, files, model):
+    """对比两种解码路径"""
+    print("=" * 60)
+    print(f"缩放解码基准: {name} ({len(files)} 张)")
+    print("=" * 60)
+
+    results = []
+
+    try:
+        target = TRANSFORM_CONFIG["resize"]
+        for f in files:
+            image = Image.open(f)
+            reduced = open_image_reduced(f, target)
+            print(
+                f"  {Path(f).name:<45} {image.format:<5} {image.size[0]}x{image.size[1]}"
+                f" -> {reduced.size[0]}x{reduced.size[1]}"
+            )
+            # 缩放解码后短边不小于 2 * target，且不超过原图
+            assert min(reduced.size) >= min(2 * target, min(image.size)), "缩放解码后短边过小"
+            assert min(reduced.size) <= min(image.size)
+
+        full_ms, full = time_preprocess(PreprocessConfig(), files)
+        fast_ms, fast = time_preprocess(PreprocessConfig(fast_decode=True), files)
+
+        print(f"\n  全分辨率解码: {full_ms:8.2f} ms/张")
+        print(f"  缩放解码:     {fast_ms:8.2f} ms/张")
+        print(f"  加速比:       {full_ms / fast_ms:8.2f}x")
+        print(f"  输入张量平均绝对差: {(full - fast).abs().mean().item():.4f}")
+
+        with torch.no_grad():
+            feat_full = model(full.to(TEST_CONFIG["device"])).cpu().numpy()
+            feat_fast = model(fast.to(TEST_CONFIG["device"])).cpu().numpy()
+        cosine = np.sum(feat_full * feat_fast, axis=1) / (
+            np.linalg.norm(feat_full, axis=1) * np.linalg.norm(feat_fast, axis=1)
+        )
+        print(f"  特征最小余弦相似度: {cosine.min():.6f}")
+
+        assert cosine.min() >= TEST_CONFIG["min_cosine"], "缩放解码后特征偏差过大"
+        print(f"✓ 缩放解码验证通过")
+        results.append(True)
+
+    except Exception as e:
+        print(f"✗ 缩放解码测试失败: {e}")
+        results.append(False)
+
+    print()
+    return results
+
+
+def main():
+    """主测试函数"""
+    print("\n" + "=" * 60)
+    print("DINOv2 缩放解码基准测试")
+    print("=" * 60 + "\n")
+
+    photo_files = collect_photos()
+    if not photo_files:
+        print(f"错误: 未找到照片: {DATA_DIR / 'test_photo'}")
+        return 1
+
+    model = get_model(TEST_CONFIG["model_name"], TEST_CONFIG["device"])
+
+    all_results = []
+    all_results.extend(test_decode_paths("test_photo", photo_files, model))
+
+    # WebP 解码器不支持缩放，额外用大尺寸 JPEG 验证 draft() 路径
+    with tempfile.TemporaryDirectory() as tmp:
+        jpeg_files = make_large_jpegs(photo_files, tmp)
+        all_results.extend(test_decode_paths("test_photo (JPEG x3)", jpeg_files, model))
+
+    passed = sum(all_results)
+    total = len(all_results)
+    print("=" * 60)
+    print(f"通过测试: {passed}/{total}")
+
+    return 0 if passed == total else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+"""
+DINOv2 特征缓存测试
+检查覆盖写入同一键时总大小不漂移、内容哈希记忆按 LRU 限制条数
+(特征缓存与裁剪缓存共用，可在多个线程中并发查询)、
+读取后条目被其他进程淘汰时 get() 按未命中处理而不抛异常
+
+用法:
+    python3 tests/test_feature_cache.py
+"""
+
+import sys
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "examples"))
+import feature_cache
+from crop_cache import CropCache
+from feature_cache import FeatureCache, file_digest
+
+# 测试配置
+TEST_CONFIG = {
+    "feature_dim": 384,
+    "num_overwrites": 5,
+    "num_files": 10,
+    "max_digests": 4,
+    "num_threads": 8,
+    "lookups_per_thread": 200,
+}
+
+
+def make_files(tmp_dir, prefix):
+    """写入 num_files 个内容各不相同的小文件"""
+    paths = []
+    for i in range(TEST_CONFIG["num_files"]):
+        path = Path(tmp_dir) / f"{prefix}_{i}.bin"
+        path.write_bytes(bytes([i]) * 100)
+        paths.append(str(path))
+    return paths
+
+
+def test_overwrite_accounting(tmp_dir):
+    """同一键反复写入不同大小的特征，总大小始终等于磁盘上的实际大小"""
+    print("=" * 60)
+    print(f"覆盖写入计数测试: {TEST_CONFIG['num_overwrites']} 次")
+    print("=" * 60)
+
+    try:
+        cache = FeatureCache(Path(tmp_dir) / "overwrite")
+        for i in range(TEST_CONFIG["num_overwrites"]):
+            cache.put("same", np.zeros((i + 1, TEST_CONFIG["feature_dim"]), dtype=np.float32))
+        on_disk = sum(p.stat().st_size for p in cache._entries())
+        print(f"  记录: {cache.total_bytes()} 字节, 磁盘: {on_disk} 字节")
+        assert cache.total_bytes() == on_disk, "覆盖写入后总大小与磁盘不一致"
+        print(f"\n✓ 覆盖写入不会使总大小漂移")
+        return True
+
+    except Exception as e:
+        print(f"✗ 覆盖写入计数测试失败: {e}")
+        return False
+
+
+def test_digest_bound(tmp_dir):
+    """内容哈希记忆超过上限时淘汰最久未用的条目"""
+    print("=" * 60)
+    print(f"内容哈希记忆上限测试: max_digests={TEST_CONFIG['max_digests']}")
+    print("=" * 60)
+
+    try:
+        cache = FeatureCache(Path(tmp_dir) / "digests", max_digests=TEST_CONFIG["max_digests"])
+        paths = make_files(tmp_dir, "image")
+        first = cache.content_hash(paths[0])
+        for path in paths[1:]:
+            cache.content_hash(path)
+            cache.content_hash(paths[0])  # 反复使用的条目不会被淘汰
+        assert len(cache._digests) == TEST_CONFIG["max_digests"], f"记忆条数 {len(cache._digests)}"
+        assert any(key[0] == paths[0] for key in cache._digests), "最近使用的条目被淘汰"
+        assert cache.content_hash(paths[0]) == first
+        print(f"  记忆条数: {len(cache._digests)}")
+        print(f"\n✓ 内容哈希记忆受上限约束")
+        return True
+
+    except Exception as e:
+        print(f"✗ 内容哈希记忆上限测试失败: {e}")
+        return False
+
+
+def test_concurrent_digests(tmp_dir):
+    """裁剪缓存在预取线程池中并发查询内容哈希: 结果正确且记忆条数受上限约束"""
+    print("=" * 60)
+    print(f"并发内容哈希测试: {TEST_CONFIG['num_threads']} 个线程")
+    print("=" * 60)
+
+    try:
+        cache = CropCache(Path(tmp_dir) / "crops", max_digests=TEST_CONFIG["max_digests"])
+        paths = make_files(tmp_dir, "crop")
+        expected = {path: file_digest(path) for path in paths}
+
+        def lookup(worker):
+            for i in range(TEST_CONFIG["lookups_per_thread"]):
+                path = paths[(worker * 7 + i) % len(paths)]
+                assert cache.content_hash(path) == expected[path], f"内容哈希错误: {path}"
+
+        with ThreadPoolExecutor(TEST_CONFIG["num_threads"]) as pool:
+            list(pool.map(lookup, range(TEST_CONFIG["num_threads"])))
+        assert len(cache._digests) <= TEST_CONFIG["max_digests"], f"记忆条数 {len(cache._digests)}"
+        print(f"  记忆条数: {len(cache._digests)}")
+        print(f"\n✓ 并发查询结果正确，记忆条数受上限约束")
+        return True
+
+    except Exception as e:
+        print(f"✗ 并发内容哈希测试失败: {e}")
+        return False
+
+
+def test_vanished_entry(tmp_dir):
+    """读取条目后、刷新修改时间前条目被删除，get() 返回 None 并计为未命中"""
+    print("=" * 60)
+    print("条目并发淘汰测试")
+    print("=" * 60)
+
+    try:
+        cache = FeatureCache(Path(tmp_dir) / "vanish")
+        cache.put("key", np.ones(TEST_CONFIG["feature_dim"], dtype=np.float32))
+        entry = cache._entry_path("key")
+
+        # 模拟另一个进程在 np.load 与 os.utime 之间淘汰了条目
+        original_load = feature_cache.np.load
+
+        def load_then_evict(path, *args, **kwargs):
+            data = original_load(path, *args, **kwargs)
+            Path(path).unlink()
+            return data
+
+        feature_cache.np.load = load_then_evict
+        try:
+            result = cache.get("key")
+        finally:
+            feature_cache.np.load = original_load
+
+        assert result is None, "已被淘汰的条目应按未命中处理"
+        assert not entry.exists()
+        assert cache.hits == 0 and cache.misses == 1, f"命中 {cache.hits}, 未命中 {cache.misses}"
+        print(f"\n✓ 被并发淘汰的条目按未命中处理")
+        return True
+
+    except Exception as e:
+        print(f"✗ 条目并发淘汰测试失败: {type(e).__name__}: {e}")
+        return False
+
+
+def main():
+    """主测试函数"""
+    print("\n" + "=" * 60)
+    print("DINOv2 特征缓存测试")
+    print("=" * 60 + "\n")
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        results = [
+            test_overwrite_accounting(tmp_dir),
+            test_digest_bound(tmp_dir),
+            test_concurrent_digests(tmp_dir),
+            test_vanished_entry(tmp_dir),
+        ]
+
+    passed = sum(results)
+    total = len(results)
+    print("=" * 60)
+    print(f"通过测试: {passed}/{total}")
+
+    return 0 if passed == total else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+"""
+DINOv2 特征存储合并测试
+检查按来源顺序合并 (包括合并到来源之一的目录)，以及替换存储时中断后
+recover() 能恢复出完整的存储
+
+用法:
+    python3 tests/test_feature_store.py
+"""
+
+import sys
+import tempfile
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "examples"))
+from common import make_features, write_store
+import feature_store
+from feature_store import FeatureStore
+
+# 测试配置
+TEST_CONFIG = {
+    "num_vectors": 3000,
+    "dim": 64,
+    "num_clusters": 10,
+    "noise": 1.0,
+    "shard_size": 700,
+}
+
+
+def make_parts(tmp_dir):
+    """写入两个来源存储，返回 (全部特征, 来源目录列表)"""
+    features = make_features(config=TEST_CONFIG)
+    half = len(features) // 2
+    sources = []
+    for i, part in enumerate((features[:half], features[half:])):
+        store_dir = Path(tmp_dir) / f"part_{i}"
+        write_store(part, store_dir, TEST_CONFIG["shard_size"])
+        sources.append(store_dir)
+    return features, sources
+
+
+def test_merge_order(tmp_dir):
+    """合并后的行顺序为各来源依次拼接；root 本身作为来源时可以原地合并"""
+    print("=" * 60)
+    print("合并顺序测试")
+    print("=" * 60)
+
+    try:
+        features, sources = make_parts(Path(tmp_dir) / "order")
+        root = Path(tmp_dir) / "order" / "merged"
+        merged = FeatureStore.merge(root, sources[:1], shard_size=500)
+        merged = FeatureStore.merge(root, [root, sources[1]], shard_size=500, overwrite=True)
+        assert len(merged) == len(features)
+        assert np.array_equal(FeatureStore.open(root).features(), features), "合并后特征顺序不符"
+        leftovers = [p.name for p in root.parent.iterdir() if p.name.startswith("merged.")]
+        assert not leftovers, f"残留临时目录: {leftovers}"
+        print(f"  合并 {len(merged)} 条, 分片大小 {merged.shard_size}")
+        print(f"\n✓ 合并顺序正确")
+        return True
+
+    except Exception as e:
+        print(f"✗ 合并顺序测试失败: {e}")
+        return False
+
+
+def test_interrupted_replace(tmp_dir):
+    """旧存储已移开、新存储尚未换入时中断: recover() 恢复旧存储，再次合并成功"""
+    print("=" * 60)
+    print("替换中断恢复测试")
+    print("=" * 60)
+
+    try:
+        features, sources = make_parts(Path(tmp_dir) / "crash")
+        root = Path(tmp_dir) / "crash" / "merged"
+        FeatureStore.merge(root, sources[:1])
+
+        # 模拟在第二次 os.replace (换入新存储) 之前崩溃
+        original_replace = feature_store.os.replace
+
+        def crash_on_swap(src, dst):
+            if str(src).endswith(feature_store.MERGING_SUFFIX):
+                raise KeyboardInterrupt("模拟崩溃")
+            return original_replace(src, dst)
+
+        feature_store.os.replace = crash_on_swap
+        try:
+            FeatureStore.merge(root, [root, sources[1]], overwrite=True)
+            raise AssertionError("应在替换时中断")
+        except KeyboardInterrupt:
+            pass
+        finally:
+            feature_store.os.replace = original_replace
+        assert not root.exists(), "中断时 root 应已被移开"
+
+        FeatureStore.recover(root)
+        half = len(features) // 2
+        assert np.array_equal(FeatureStore.open(root).features(), features[:half]), "恢复的存储不完整"
+
+        FeatureStore.merge(root, [root, sources[1]], overwrite=True)
+        assert np.array_equal(FeatureStore.open(root).features(), features)
+        print(f"\n✓ 中断后恢复出完整存储并可继续合并")
+        return True
+
+    except Exception as e:
+        print(f"✗ 替换中断恢复测试失败: {e}")
+        return False
+
+
+def main():
+    """主测试函数"""
+    print("\n" + "=" * 60)
+    print("DINOv2 特征存储合并测试")
+    print("=" * 60 + "\n")
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        results = [
+            test_merge_order(tmp_dir),
+            test_interrupted_replace(tmp_dir),
+        ]
+
+    passed = sum(results)
+    total = len(results)
+    print("=" * 60)
+    print(f"通过测试: {passed}/{total}")
+
+    return 0 if passed == total else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+"""
+DINOv2 ONNX Runtime 后端一致性测试
+在 data/test_images 上对比 ONNX Runtime 与 PyTorch 的特征，
+并检查导出模型的动态批大小、--backend onnx 的批量提取结果，
+以及多个调用方同时首次使用时只导出一次
+"""
+
+import os
+import sys
+import tempfile
+import threading
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "examples"))
+from extract_features import batch_extract_features
+import onnx_backend
+from model_registry import get_model
+from onnx_backend import OnnxModel, check_parity, ensure_onnx, print_parity_report
+
+DATA_DIR = Path(__file__).resolve().parent.parent / "data"
+
+# 测试配置
+TEST_CONFIG = {
+    "model_name": "dinov2_vits14",
+    "device": "cpu",
+    "batch_size": 4,
+    "min_cosine": 0.9999,  # 每张图像 ONNX 特征与 PyTorch 特征的最低余弦相似度
+    "max_abs_deviation": 1e-3,  # 特征的最大绝对偏差
+    "concurrent_callers": 3,
+}
+
+
+def test_parity(image_paths, onnx_dir):
+    """同一批预处理输入上 ONNX Runtime 与 PyTorch 的特征一致"""
+    print("=" * 60)
+    print(f"ONNX 一致性测试: test_images ({len(image_paths)} 张)")
+    print("=" * 60)
+
+    try:
+        report = check_parity(
+            image_paths,
+            TEST_CONFIG["model_name"],
+            TEST_CONFIG["batch_size"],
+            onnx_dir=onnx_dir,
+        )
+        print_parity_report(report)
+
+        assert report["min_cosine"] >= TEST_CONFIG["min_cosine"], (
+            f"最小余弦相似度 {report['min_cosine']:.6f} 低于阈值 {TEST_CONFIG['min_cosine']}"
+        )
+        assert report["max_abs_deviation"] <= TEST_CONFIG["max_abs_deviation"], (
+            f"最大偏差 {report['max_abs_deviation']:.2e} 超过阈值 {TEST_CONFIG['max_abs_deviation']}"
+        )
+        print(f"\n✓ 特征一致性验证通过")
+        return True
+
+    except Exception as e:
+        print(f"✗ 一致性测试失败: {e}")
+        return False
+
+
+def test_backend_extraction(image_paths):
+    """--backend onnx 的批量提取与 PyTorch 结果一致，且不受批大小影响"""
+    print("=" * 60)
+    print("ONNX 后端批量提取测试")
+    print("=" * 60)
+
+    try:
+        reference = batch_extract_features(
+            image_paths,
+            TEST_CONFIG["model_name"],
+            batch_size=TEST_CONFIG["batch_size"],
+            device=TEST_CONFIG["device"],
+        )
+        for batch_size in (1, 3, len(image_paths)):
+            features = batch_extract_features(
+                image_paths,
+                TEST_CONFIG["model_name"],
+                batch_size=batch_size,
+                device=TEST_CONFIG["device"],
+                backend="onnx",
+            )
+            deviation = float(np.max(np.abs(features - reference)))
+            print(f"  批大小 {batch_size:>2}: 最大偏差 {deviation:.2e}")
+            assert features.shape == reference.shape
+            assert deviation <= TEST_CONFIG["max_abs_deviation"]
+        print(f"\n✓ 动态批大小验证通过")
+        return True
+
+    except Exception as e:
+        print(f"✗ 批量提取测试失败: {e}")
+        return False
+
+
+def test_concurrent_export(onnx_dir):
+    """多个调用方同时首次使用: 只导出一次、不留临时文件，共享的模型实例不被修改"""
+    print("=" * 60)
+    print(f"并发导出测试: {TEST_CONFIG['concurrent_callers']} 个调用方")
+    print("=" * 60)
+
+    export_dir = Path(onnx_dir) / "concurrent"
+    exports = []
+    original_export = onnx_backend.export_onnx
+
+    def counting_export(*args, **kwargs):
+        exports.append(args)
+        return original_export(*args, **kwargs)
+
+    try:
+        onnx_backend.export_onnx = counting_export
+        paths, failures = [], []
+
+        def call():
+            try:
+                paths.append(ensure_onnx(TEST_CONFIG["model_name"], onnx_dir=export_dir))
+            except Exception as e:
+                failures.append(e)
+
+        threads = [threading.Thread(target=call) for _ in range(TEST_CONFIG["concurrent_callers"])]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert not failures, f"导出失败: {failures}"
+        assert len(exports) == 1, f"应只导出一次，实际 {len(exports)} 次"
+        assert len(set(paths)) == 1 and OnnxModel(paths[0]).image_size == 224
+        leftovers = [p.name for p in export_dir.iterdir() if p.suffix == ".tmp"]
+        assert not leftovers, f"残留临时文件: {leftovers}"
+        model = get_model(TEST_CONFIG["model_name"], "cpu")
+        assert "interpolate_pos_encoding" not in vars(model), "导出修改了注册表中的模型"
+        print(f"\n✓ 只导出一次，共享模型未被修改")
+        return True
+
+    except Exception as e:
+        print(f"✗ 并发导出测试失败: {e}")
+        return False
+
+    finally:
+        onnx_backend.export_onnx = original_export
+
+
+def main():
+    """主测试函数"""
+    print("\n" + "=" * 60)
+    print("DINOv2 ONNX Runtime 后端测试")
+    print("=" * 60 + "\n")
+
+    image_paths = sorted(str(p) for p in (DATA_DIR / "test_images").glob("*.jpg"))
+    if not image_paths:
+        print(f"⚠ 未找到图像: {DATA_DIR / 'test_images'}")
+        return 1
+
+    with tempfile.TemporaryDirectory() as onnx_dir:
+        # 导出到临时目录，批量提取 (--backend onnx) 使用同一个导出文件
+        os.environ["DINOV2_ONNX_DIR"] = onnx_dir
+        results = [
+            test_parity(image_paths, onnx_dir),
+            test_backend_extraction(image_paths),
+            test_concurrent_export(onnx_dir),
+        ]
+
+    passed = sum(results)
+    total = len(results)
+    print("=" * 60)
+    print(f"通过测试: {passed}/{total}")
+
+    return 0 if passed == total else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
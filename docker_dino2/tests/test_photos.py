@@ -8,12 +8,20 @@ import os
 import sys
 import time
 import json
+import shutil
 import torch
 import numpy as np
 from PIL import Image
-import torchvision.transforms as transforms
 from pathlib import Path
 
+# 复用 examples/ 中的模型注册表
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "examples"))
+from model_registry import get_model
+from feature_cache import FeatureCache
+from feature_store import FeatureStore
+from pipeline import TRANSFORM_CONFIG, BatchTransform
+from similarity import greedy_groups, pair_statistics, ranked_neighbors, similarity_matrix
+
 # 设置设备
 device = "cuda" if torch.cuda.is_available() else "cpu"
 print(f"使用设备: {device}")
@@ -21,14 +29,7 @@ if device == "cuda":
     print(f"GPU: {torch.cuda.get_device_name(0)}")
 
 # 图像预处理
-transform = transforms.Compose(
-    [
-        transforms.Resize(256),
-        transforms.CenterCrop(224),
-        transforms.ToTensor(),
-        transforms.Normalize(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225]),
-    ]
-)
+transform = BatchTransform()
 
 
 def load_model():
@@ -37,9 +38,7 @@ def load_model():
     print("加载 DINOv2 模型...")
     print("=" * 60)
 
-    model = torch.hub.load("facebookresearch/dinov2", "dinov2_vits14")
-    model = model.to(device)
-    model.eval()
+    model = get_model("dinov2_vits14", device)
 
     print(f"✓ 模型加载成功")
     print(f"✓ 模型类型: DINOv2 ViT-S/14")
@@ -48,36 +47,35 @@ def load_model():
     return model
 
 
-def extract_features(model, image_path):
-    """提取单张图片的特征"""
+def extract_features(model, image_path, cache=None):
+    """提取单张图片的特征，给出 cache 时图像内容未变则直接复用缓存"""
     try:
         # 处理 webp 格式
-        image = Image.open(image_path).convert("RGB")
+        image = Image.open(image_path)
+        if cache is not None:
+            key = cache.make_key(image_path, "dinov2_vits14", TRANSFORM_CONFIG)
+            features = cache.get(key)
+            if features is not None:
+                return features, image.size
+
+        image = image.convert("RGB")
         input_tensor = transform(image).unsqueeze(0).to(device)
 
         with torch.no_grad():
             features = model(input_tensor)
 
-        return features.cpu().numpy().flatten(), image.size
+        features = features.cpu().numpy().flatten()
+        if cache is not None:
+            cache.put(key, features)
+        return features, image.size
     except Exception as e:
         print(f"✗ 处理 {os.path.basename(image_path)} 失败: {e}")
         return None, None
 
 
-def compute_similarity(features1, features2):
-    """计算余弦相似度"""
-    norm1 = np.linalg.norm(features1)
-    norm2 = np.linalg.norm(features2)
-
-    if norm1 == 0 or norm2 == 0:
-        return 0.0
-
-    return np.dot(features1, features2) / (norm1 * norm2)
-
-
-def analyze_photo(model, image_path):
+def analyze_photo(model, image_path, cache=None):
     """分析单张照片"""
-    features, image_size = extract_features(model, image_path)
+    features, image_size = extract_features(model, image_path, cache)
     if features is None:
         return None
 
@@ -95,34 +93,23 @@ def analyze_photo(model, image_path):
 
 def classify_by_similarity(all_results, all_names):
     """根据相似度对照片进行分类"""
-    n = len(all_results)
-    similarity_matrix = np.zeros((n, n))
-
-    for i in range(n):
-        for j in range(n):
-            similarity_matrix[i][j] = compute_similarity(
-                all_results[i]["features"], all_results[j]["features"]
-            )
-
-    # 为每张照片找到最相似的其他照片
-    similarities_info = []
-    for i in range(n):
-        # 排除自身，找最相似的
-        sims = []
-        for j in range(n):
-            if i != j:
-                sims.append(
-                    {
-                        "index": j,
-                        "name": all_names[j],
-                        "similarity": float(similarity_matrix[i][j]),
-                    }
-                )
+    sim_matrix = similarity_matrix([r["features"] for r in all_results])
 
-        sims.sort(key=lambda x: x["similarity"], reverse=True)
-        similarities_info.append(sims)
+    # 为每张照片按相似度排列其他照片 (排除自身)
+    ranked = ranked_neighbors(sim_matrix)
+    similarities_info = [
+        [
+            {
+                "index": int(j),
+                "name": all_names[j],
+                "similarity": float(sim_matrix[i, j]),
+            }
+            for j in row
+        ]
+        for i, row in enumerate(ranked)
+    ]
 
-    return similarity_matrix, similarities_info
+    return sim_matrix, similarities_info
 
 
 def detect_photo_category(filename, features):
@@ -192,15 +179,23 @@ def main():
     all_results = []
     all_names = []
 
+    # 特征增量写入分片存储
+    output_dir = "/home/ubuntu2204/kimi_prj/docker_dino2/output"
+    store_dir = os.path.join(output_dir, "photo_features_store")
+    shutil.rmtree(store_dir, ignore_errors=True)
+    store = FeatureStore.create(store_dir, model_name="dinov2_vits14")
+    cache = FeatureCache(os.path.join(output_dir, "feature_cache"))
+
     start_time = time.time()
 
     for i, photo_path in enumerate(photo_files, 1):
         print(f"\n[{i}/{len(photo_files)}] 分析: {os.path.basename(photo_path)}")
 
-        result = analyze_photo(model, photo_path)
+        result = analyze_photo(model, photo_path, cache)
         if result:
             all_results.append(result)
             all_names.append(os.path.basename(photo_path))
+            store.append([photo_path], result["features"])
 
             # 显示基本信息
             width, height = result["image_size"]
@@ -220,6 +215,12 @@ def main():
 
     elapsed = time.time() - start_time
 
+    # 以零拷贝内存映射方式打开，相似度分析直接读取存储中的特征
+    store.close()
+    stored_features = FeatureStore.open(store_dir).features()
+    for i, result in enumerate(all_results):
+        result["features"] = stored_features[i]
+
     if len(all_results) < 2:
         print("\n✗ 需要至少2张照片进行相似度分析")
         sys.exit(1)
@@ -229,7 +230,7 @@ def main():
     print("相似度分析")
     print("=" * 60)
 
-    similarity_matrix, similarities_info = classify_by_similarity(
+    sim_matrix, similarities_info = classify_by_similarity(
         all_results, all_names
     )
 
@@ -252,7 +253,7 @@ def main():
             if i == j:
                 row += f" {'---':>6}"
             else:
-                row += f" {similarity_matrix[i][j]:>6.3f}"
+                row += f" {sim_matrix[i][j]:>6.3f}"
         print(row)
     print("-" * 80)
 
@@ -272,23 +273,7 @@ def main():
     # 3. 相似照片分组
     print("\n【相似照片分组】(相似度 > 0.85)")
     threshold = 0.85
-    groups = []
-    used = set()
-
-    for i in range(len(all_names)):
-        if i in used:
-            continue
-
-        group = [i]
-        used.add(i)
-
-        for j in range(i + 1, len(all_names)):
-            if j not in used and similarity_matrix[i][j] > threshold:
-                group.append(j)
-                used.add(j)
-
-        if len(group) > 1:
-            groups.append(group)
+    groups = greedy_groups(sim_matrix, threshold)
 
     if groups:
         for idx, group in enumerate(groups, 1):
@@ -301,16 +286,9 @@ def main():
 
     # 4. 最不相似的照片对
     print("\n【最不相似的照片对】(内容差异最大)")
-    min_sim = float("inf")
-    min_pair = (0, 0)
-
-    for i in range(len(all_names)):
-        for j in range(i + 1, len(all_names)):
-            if similarity_matrix[i][j] < min_sim:
-                min_sim = similarity_matrix[i][j]
-                min_pair = (i, j)
-
-    i, j = min_pair
+    stats = pair_statistics(sim_matrix)
+    i, j = stats["min_pair"]
+    min_sim = stats["min"]
     print(f"  {all_names[i]}")
     print(f"  vs")
     print(f"  {all_names[j]}")
@@ -322,23 +300,22 @@ def main():
     print("识别结果总结")
     print("=" * 60)
 
-    # 计算平均相似度
-    avg_sims = []
-    for i in range(len(all_names)):
-        for j in range(i + 1, len(all_names)):
-            avg_sims.append(similarity_matrix[i][j])
-
-    avg_similarity = np.mean(avg_sims)
+    # 平均相似度 (所有不同照片对)
+    avg_similarity = stats["mean"]
 
     print(f"\n处理统计:")
     print(f"  照片总数: {len(all_names)}张")
     print(f"  总处理时间: {elapsed:.2f}秒")
     print(f"  平均每张: {elapsed / len(all_names) * 1000:.2f}ms")
+    cache_stats = cache.stats()
+    print(
+        f"  特征缓存: 命中 {cache_stats['hits']} / 未命中 {cache_stats['misses']}"
+    )
 
     print(f"\n相似度统计:")
     print(f"  平均相似度: {avg_similarity:.4f}")
-    print(f"  最高相似度: {np.max(avg_sims):.4f}")
-    print(f"  最低相似度: {np.min(avg_sims):.4f}")
+    print(f"  最高相似度: {stats['max']:.4f}")
+    print(f"  最低相似度: {stats['min']:.4f}")
 
     if avg_similarity > 0.8:
         print(f"\n结论: 这些照片内容高度相似，可能是同一场景的不同角度/时间拍摄")
@@ -348,13 +325,12 @@ def main():
         print(f"\n结论: 这些照片内容差异较大，属于不同场景或主题")
 
     # 保存结果
-    output_dir = "/home/ubuntu2204/kimi_prj/docker_dino2/output"
     os.makedirs(output_dir, exist_ok=True)
 
     # 保存特征
     features_array = np.array([r["features"] for r in all_results])
     np.save(os.path.join(output_dir, "photo_features.npy"), features_array)
-    np.save(os.path.join(output_dir, "photo_similarity_matrix.npy"), similarity_matrix)
+    np.save(os.path.join(output_dir, "photo_similarity_matrix.npy"), sim_matrix)
 
     # 保存详细结果
     results = {
@@ -371,7 +347,7 @@ def main():
             }
             for i in range(len(all_names))
         ],
-        "similarity_matrix": similarity_matrix.tolist(),
+        "similarity_matrix": sim_matrix.tolist(),
         "processing_time": elapsed,
         "average_similarity": float(avg_similarity),
     }
@@ -384,6 +360,7 @@ def main():
     print(f"\n结果已保存到 output/ 目录:")
     print(f"  - photo_features.npy")
     print(f"  - photo_similarity_matrix.npy")
+    print(f"  - photo_features_store/")
     print(f"  - photo_results.json")
 
     print("\n" + "=" * 60)
@@ -0,0 +1,195 @@
+#!/usr/bin/env python3
+"""
+DINOv2 乘积量化 (PQ) 压缩特征存储测试
+在带聚类结构的合成特征上检查: 压缩比、recall@10 随每条字节数 M 上升、
+查表与解码两种 ADC 实现结果一致、从特征存储构建并以内存映射方式加载、
+默认分段数随特征维度选择且不合法的分段数在构建前报错
+
+用法:
+    python3 tests/test_pq.py
+"""
+
+import sys
+import tempfile
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "examples"))
+from common import make_features, write_store
+import pq_store
+from pq_store import PQStore, adc_scores, decode, default_m, evaluate_pq, print_pq_report
+from similarity import normalize
+
+# 测试配置
+TEST_CONFIG = {
+    "num_queries": 300,
+    "k": 10,
+    "m_values": [16, 48],
+    "train_size": 10000,
+    "min_recall_m48": 0.4,  # 各向同性高斯噪声对 PQ 不利，合成数据的召回率偏低
+}
+
+
+def test_compression(features, tmp_dir):
+    """每条特征压缩为 M 字节，M 越大召回率越高"""
+    print("=" * 60)
+    print(f"压缩与召回率测试: {len(features)} 条, M={TEST_CONFIG['m_values']}")
+    print("=" * 60)
+
+    try:
+        rows = np.sort(np.random.default_rng(1).choice(len(features), TEST_CONFIG["num_queries"], replace=False))
+        recalls = []
+        for m in TEST_CONFIG["m_values"]:
+            store = PQStore.build(
+                features, Path(tmp_dir) / f"pq_{m}", m=m, train_size=TEST_CONFIG["train_size"]
+            )
+            report = evaluate_pq(store, features, features[rows], TEST_CONFIG["k"], exclude=rows)
+            print_pq_report(report)
+
+            assert store.codes.shape == (len(features), m) and store.codes.dtype == np.uint8
+            assert report["pq_bytes"] == len(features) * m + store.codebooks.nbytes, "每条特征应只占 M 字节"
+            recalls.append(report["recall"])
+
+        assert recalls == sorted(recalls), f"召回率应随 M 上升: {recalls}"
+        assert recalls[-1] >= TEST_CONFIG["min_recall_m48"], f"M=48 召回率过低: {recalls[-1]:.4f}"
+        print(f"\n✓ 压缩比与召回率符合预期")
+        return True
+
+    except Exception as e:
+        print(f"✗ 压缩测试失败: {e}")
+        return False
+
+
+def test_adc(features, tmp_dir):
+    """查表 ADC 与解码后矩阵乘法结果一致，且等于查询与还原特征的内积"""
+    print("=" * 60)
+    print("ADC 一致性测试")
+    print("=" * 60)
+
+    try:
+        store = PQStore.build(features[:5000], Path(tmp_dir) / "pq_adc", m=24, train_size=5000)
+        queries = normalize(features[5000:5005])
+        codes = np.asarray(store.codes)
+
+        lookup = adc_scores(queries, codes, store.codebooks)
+        decoded = queries @ decode(codes, store.codebooks).T
+        deviation = float(np.max(np.abs(lookup - decoded)))
+        print(f"  查表 vs 解码: 最大偏差 {deviation:.2e}")
+        assert len(queries) <= pq_store.LOOKUP_MAX_QUERIES
+        assert deviation < 1e-4
+
+        # 解码分支按字节上限分块，分块结果与整体解码一致
+        many = normalize(features[5000:5100])
+        default_bytes = pq_store.ADC_BLOCK_BYTES
+        pq_store.ADC_BLOCK_BYTES = 4 * features.shape[1] * 777
+        try:
+            assert pq_store.adc_block_rows(features.shape[1]) == 777
+            chunked = adc_scores(many, codes, store.codebooks)
+        finally:
+            pq_store.ADC_BLOCK_BYTES = default_bytes
+        deviation = float(np.max(np.abs(chunked - many @ decode(codes, store.codebooks).T)))
+        print(f"  分块解码 vs 整体解码: 最大偏差 {deviation:.2e}")
+        assert deviation < 1e-4
+
+        # 多查询时走解码分支，单个查询时走查表分支，检索结果一致
+        ids, scores = store.search(many, TEST_CONFIG["k"])
+        for i in (0, 50, 99):
+            single_ids, single_scores = store.search(many[i], TEST_CONFIG["k"])
+            assert np.allclose(single_scores[0], scores[i], atol=1e-5)
+        print(f"\n✓ ADC 两种实现一致")
+        return True
+
+    except Exception as e:
+        print(f"✗ ADC 测试失败: {e}")
+        return False
+
+
+def test_store_roundtrip(features, tmp_dir):
+    """从多分片特征存储构建，加载后编码为内存映射且检索结果一致"""
+    print("=" * 60)
+    print("特征存储构建与内存映射加载测试")
+    print("=" * 60)
+
+    try:
+        store_dir = Path(tmp_dir) / "store"
+        paths = write_store(features, store_dir)
+
+        pq_dir = Path(tmp_dir) / "pq_store"
+        built = PQStore.build(store_dir, pq_dir, m=48, train_size=TEST_CONFIG["train_size"], block_size=7000)
+        ids, scores = built.search(features[:50], TEST_CONFIG["k"], block_size=9000)
+
+        loaded = PQStore.load(pq_dir)
+        assert isinstance(loaded.codes, np.memmap), "编码应以内存映射方式加载"
+        assert len(loaded) == len(features) and loaded.meta["model_name"] == "synthetic"
+        loaded_ids, loaded_scores = loaded.search(features[:50], TEST_CONFIG["k"])
+        assert (loaded_ids == ids).all() and np.allclose(loaded_scores, scores, atol=1e-5)
+        assert loaded.paths[ids[0, 0]] == paths[0], "查询自身应是第一个结果"
+
+        excluded, _ = loaded.search(features[:50], TEST_CONFIG["k"], exclude=np.arange(50))
+        assert (excluded != np.arange(50)[:, None]).all(), "exclude 的行不应出现在结果中"
+        print(f"  压缩存储: {loaded.nbytes / 1024**2:.2f} MB")
+        print(f"\n✓ 构建/加载一致")
+        return True
+
+    except Exception as e:
+        print(f"✗ 特征存储测试失败: {e}")
+        return False
+
+
+def test_default_m(features, tmp_dir):
+    """各模型维度的默认分段数都能整除维度；1024 维默认构建可用，不合法的 M 在构建前报错"""
+    print("=" * 60)
+    print("分段数选择测试")
+    print("=" * 60)
+
+    try:
+        for dim, expected in [(384, 48), (768, 48), (1024, 32), (1536, 48)]:
+            assert default_m(dim) == expected, f"{dim} 维默认分段数应为 {expected}: {default_m(dim)}"
+
+        # vitl14 的 1024 维特征使用默认参数构建
+        wide = np.tile(features[:2000], (1, 3))[:, :1024]
+        store = PQStore.build(wide, Path(tmp_dir) / "pq_wide", train_size=2000, ksub=16, iters=2)
+        assert store.meta["m"] == 32 and store.codes.shape == (2000, 32)
+        print(f"  1024 维默认 M={store.meta['m']}")
+
+        bad_root = Path(tmp_dir) / "pq_bad"
+        try:
+            PQStore.build(wide, bad_root, m=48)
+            raise AssertionError("M=48 不能整除 1024，应报错")
+        except ValueError as e:
+            print(f"  M=48: {e}")
+            assert "32" in str(e) and not bad_root.exists(), "应在构建前报错并列出可选值"
+        print(f"\n✓ 分段数按维度选择与校验")
+        return True
+
+    except Exception as e:
+        print(f"✗ 分段数选择测试失败: {e}")
+        return False
+
+
+def main():
+    """主测试函数"""
+    print("\n" + "=" * 60)
+    print("DINOv2 乘积量化压缩存储测试")
+    print("=" * 60 + "\n")
+
+    features = make_features()
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        results = [
+            test_compression(features, tmp_dir),
+            test_adc(features, tmp_dir),
+            test_store_roundtrip(features, tmp_dir),
+            test_default_m(features, tmp_dir),
+        ]
+
+    passed = sum(results)
+    total = len(results)
+    print("=" * 60)
+    print(f"通过测试: {passed}/{total}")
+
+    return 0 if passed == total else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""
+DINOv2 INT8 动态量化精度测试
+对比量化模型与 fp32 模型在 data/test_images 和 data/test_photo 上的
+特征余弦相似度与 CPU 吞吐量
+"""
+
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "examples"))
+from common import DATA_DIR, IMAGE_DIRS, collect_images
+from execution import ExecutionMode
+from extract_features import benchmark_execution_mode, print_benchmark_report
+
+# 测试配置
+TEST_CONFIG = {
+    "model_name": "dinov2_vits14",
+    "device": "cpu",  # 动态量化只支持 CPU
+    "batch_size": 4,
+    "min_cosine": 0.98,  # 每张图像量化特征与 fp32 特征的最低余弦相似度
+}
+
+
+def test_quantized_accuracy(name, image_paths):
+    """测试单个目录上量化特征与 fp32 特征的一致性"""
+    print("=" * 60)
+    print(f"INT8 量化精度测试: {name} ({len(image_paths)} 张)")
+    print("=" * 60)
+
+    results = []
+
+    try:
+        report = benchmark_execution_mode(
+            image_paths,
+            ExecutionMode(precision="int8"),
+            model_name=TEST_CONFIG["model_name"],
+            batch_size=TEST_CONFIG["batch_size"],
+            device=TEST_CONFIG["device"],
+        )
+        print_benchmark_report(report)
+
+        assert report["min_cosine"] >= TEST_CONFIG["min_cosine"], (
+            f"最小余弦相似度 {report['min_cosine']:.4f} 低于阈值 {TEST_CONFIG['min_cosine']}"
+        )
+        print(f"\n✓ 量化精度验证通过 (阈值 {TEST_CONFIG['min_cosine']})")
+        results.append(True)
+
+    except Exception as e:
+        print(f"✗ 量化精度测试失败: {e}")
+        results.append(False)
+
+    print()
+    return results
+
+
+def main():
+    """主测试函数"""
+    print("\n" + "=" * 60)
+    print("DINOv2 INT8 动态量化测试")
+    print("=" * 60 + "\n")
+
+    all_results = []
+    for name, patterns in IMAGE_DIRS.items():
+        image_paths = collect_images(name, patterns)
+        if not image_paths:
+            print(f"⚠ 未找到图像: {DATA_DIR / name}，跳过")
+            continue
+        all_results.extend(test_quantized_accuracy(name, image_paths))
+
+    passed = sum(all_results)
+    total = len(all_results)
+    print("=" * 60)
+    print(f"通过测试: {passed}/{total}")
+
+    return 0 if total and passed == total else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+"""
+DINOv2 输入分辨率基准测试
+对比 112/168/224/280 等分辨率在 data/test_images 和 data/test_photo 上的
+吞吐量 (images/sec) 与最近邻检索结果相对 224 基准的一致程度，
+用于为大批量去重任务选择更低成本的分辨率
+
+用法:
+    python3 tests/test_resolution.py
+    python3 tests/test_resolution.py 112 140 168 196
+"""
+
+import sys
+from pathlib import Path
+
+import torch
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "examples"))
+from common import DATA_DIR, IMAGE_DIRS, collect_images
+from extract_features import benchmark_resolutions, print_resolution_report
+from pipeline import resolution_arg
+
+# 测试配置
+TEST_CONFIG = {
+    "device": "cuda" if torch.cuda.is_available() else "cpu",
+    "model_name": "dinov2_vits14",
+    "batch_size": 8,
+    "repeats": 3,
+    "resolutions": [112, 168, 224, 280],
+    "min_top1_agreement": 0.5,  # 非基准分辨率的最近邻与 224 相同的最低比例
+    "speed_tolerance": 0.25,  # 低于 224 的分辨率允许比 224 慢的比例 (计时噪声)
+}
+
+
+def test_resolutions(name, image_paths, resolutions):
+    """测试单个目录上各分辨率的吞吐量与最近邻一致性"""
+    print("=" * 60)
+    print(f"分辨率基准: {name} ({len(image_paths)} 张)")
+    print("=" * 60)
+
+    results = []
+
+    try:
+        report = benchmark_resolutions(
+            image_paths,
+            resolutions,
+            model_name=TEST_CONFIG["model_name"],
+            batch_size=TEST_CONFIG["batch_size"],
+            device=TEST_CONFIG["device"],
+            repeats=TEST_CONFIG["repeats"],
+        )
+        print_resolution_report(report)
+
+        for r in report["results"]:
+            if r["resolution"] == 224:
+                continue
+            assert r["top1_agreement"] >= TEST_CONFIG["min_top1_agreement"], (
+                f"{r['resolution']}px 最近邻一致率 {r['top1_agreement']:.2f} "
+                f"低于阈值 {TEST_CONFIG['min_top1_agreement']}"
+            )
+            if r["resolution"] < 224:
+                assert r["speedup"] >= 1 - TEST_CONFIG["speed_tolerance"], (
+                    f"{r['resolution']}px 比 224 更慢: 加速比 {r['speedup']:.2f}x"
+                )
+        print(f"\n✓ 各分辨率最近邻一致率达标，低分辨率不慢于 224")
+        results.append(True)
+
+    except Exception as e:
+        print(f"✗ 分辨率基准失败: {e}")
+        results.append(False)
+
+    print()
+    return results
+
+
+def main():
+    """主测试函数"""
+    print("\n" + "=" * 60)
+    print("DINOv2 输入分辨率基准测试")
+    print("=" * 60 + "\n")
+
+    resolutions = [resolution_arg(v) for v in sys.argv[1:]] or TEST_CONFIG["resolutions"]
+
+    all_results = []
+    for name, patterns in IMAGE_DIRS.items():
+        image_paths = collect_images(name, patterns)
+        if len(image_paths) < 2:
+            print(f"⚠ 图像不足 2 张: {DATA_DIR / name}，跳过")
+            continue
+        all_results.extend(test_resolutions(name, image_paths, resolutions))
+
+    passed = sum(all_results)
+    total = len(all_results)
+    print("=" * 60)
+    print(f"通过测试: {passed}/{total}")
+
+    return 0 if total and passed == total else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,285 @@
+#!/usr/bin/env python3
+"""
+DINOv2 特征服务测试
+用假的推理函数驱动 MicroBatcher: 检查并发请求被合并为批次、批大小不超过上限、
+每个请求拿到的是自己的结果、单个请求的等待时间受 max_wait_ms 限制；
+并检查 /embed 的 path 只能读取 DINOV2_IMAGE_ROOT 内的文件、
+只有图像解码失败返回 400，推理中的异常不会被当作坏图像
+
+用法:
+    python3 tests/test_server.py
+"""
+
+import asyncio
+import base64
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "examples"))
+from fastapi import HTTPException
+
+import server
+from microbatch import MicroBatcher
+from pipeline import PreprocessConfig
+from server import EmbedRequest, resolve_image_path
+
+# 测试配置
+TEST_CONFIG = {
+    "num_requests": 100,
+    "max_batch": 8,
+    "max_wait_ms": 20.0,
+    "batch_seconds": 0.01,  # 假推理每批耗时，推理期间新请求在队列中累积
+    "latency_slack": 0.2,  # 单个请求允许超出 max_wait_ms 的时间 (秒)
+}
+
+
+class FakeModel:
+    """记录每批输入的假推理函数，结果为输入的确定性变换"""
+
+    def __init__(self, delay=TEST_CONFIG["batch_seconds"]):
+        self.delay = delay
+        self.batches = []
+        self.threads = set()
+
+    def __call__(self, items):
+        self.batches.append(list(items))
+        self.threads.add(threading.get_ident())
+        time.sleep(self.delay)
+        return [item * 10 + 1 for item in items]
+
+
+async def _submit_all(batcher, items):
+    batcher.start()
+    try:
+        return await asyncio.gather(*(batcher.submit(item) for item in items))
+    finally:
+        await batcher.stop()
+
+
+def test_concurrent_batching():
+    """并发请求合并为批次，结果与请求一一对应"""
+    print("=" * 60)
+    print(f"并发凑批测试: {TEST_CONFIG['num_requests']} 个请求, max_batch={TEST_CONFIG['max_batch']}")
+    print("=" * 60)
+
+    try:
+        model = FakeModel()
+        batcher = MicroBatcher(model, TEST_CONFIG["max_batch"], TEST_CONFIG["max_wait_ms"])
+        items = list(range(TEST_CONFIG["num_requests"]))
+        results = asyncio.run(_submit_all(batcher, items))
+
+        sizes = [len(batch) for batch in model.batches]
+        print(f"  批次数: {len(sizes)}, 批大小: {sizes}")
+        for item, (result, batch_size) in zip(items, results):
+            assert result == item * 10 + 1, f"请求 {item} 拿到了错误的结果 {result}"
+            assert 1 <= batch_size <= TEST_CONFIG["max_batch"]
+        assert max(sizes) <= TEST_CONFIG["max_batch"], "批大小超过上限"
+        assert max(sizes) == TEST_CONFIG["max_batch"], "并发请求应能凑满批次"
+        assert sorted(sum(model.batches, [])) == items, "每个请求应恰好推理一次"
+        assert len(model.threads) == 1, "推理应在单个线程中按顺序执行"
+
+        # 每个请求报告的批大小与它实际所在的批次一致
+        batch_of = {item: len(batch) for batch in model.batches for item in batch}
+        assert all(batch_of[item] == size for item, (_, size) in zip(items, results))
+
+        stats = batcher.stats()
+        assert stats["requests"] == len(items) and stats["batches"] == len(sizes)
+        assert sum(stats["batch_size_histogram"].values()) == len(sizes)
+        print(f"  平均批大小: {stats['mean_batch_size']:.2f}")
+        print(f"\n✓ 凑批与结果分发正确")
+        return True
+
+    except Exception as e:
+        print(f"✗ 并发凑批测试失败: {e}")
+        return False
+
+
+def test_single_request_latency():
+    """单个请求等不到其他请求时，在 max_wait_ms 后以批大小 1 推理"""
+    print("=" * 60)
+    print("单请求延迟测试")
+    print("=" * 60)
+
+    try:
+        model = FakeModel(delay=0.0)
+        batcher = MicroBatcher(model, TEST_CONFIG["max_batch"], TEST_CONFIG["max_wait_ms"])
+
+        async def run():
+            batcher.start()
+            try:
+                start = time.perf_counter()
+                result = await batcher.submit(7)
+                return result, time.perf_counter() - start
+            finally:
+                await batcher.stop()
+
+        (result, batch_size), elapsed = asyncio.run(run())
+        limit = TEST_CONFIG["max_wait_ms"] / 1000.0 + TEST_CONFIG["latency_slack"]
+        print(f"  延迟: {elapsed * 1000:.1f} ms (上限 {limit * 1000:.0f} ms)")
+        assert result == 71 and batch_size == 1
+        assert elapsed < limit, "单个请求等待时间超过 max_wait_ms"
+        print(f"\n✓ 单请求延迟受 max_wait_ms 限制")
+        return True
+
+    except Exception as e:
+        print(f"✗ 单请求延迟测试失败: {e}")
+        return False
+
+
+def test_batch_error():
+    """推理出错时同批的每个请求都收到异常，后续批次不受影响"""
+    print("=" * 60)
+    print("推理异常传递测试")
+    print("=" * 60)
+
+    def run_batch(items):
+        if any(item < 0 for item in items):
+            raise ValueError("坏输入")
+        return [item * 10 + 1 for item in items]
+
+    try:
+        batcher = MicroBatcher(run_batch, TEST_CONFIG["max_batch"], TEST_CONFIG["max_wait_ms"])
+
+        async def run():
+            batcher.start()
+            try:
+                bad = await asyncio.gather(batcher.submit(-1), return_exceptions=True)
+                good = await batcher.submit(3)
+                return bad, good
+            finally:
+                await batcher.stop()
+
+        bad, good = asyncio.run(run())
+        assert isinstance(bad[0], ValueError), f"应收到推理异常: {bad}"
+        assert good == (31, 1)
+        print(f"\n✓ 异常只影响出错的批次")
+        return True
+
+    except Exception as e:
+        print(f"✗ 异常传递测试失败: {e}")
+        return False
+
+
+def test_image_root():
+    """path 只能指向 DINOV2_IMAGE_ROOT 内的文件"""
+    print("=" * 60)
+    print("图像路径限制测试")
+    print("=" * 60)
+
+    try:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            root = Path(tmp_dir) / "images"
+            (root / "sub").mkdir(parents=True)
+            (root / "sub" / "a.jpg").write_bytes(b"")
+            (root / "escape.jpg").symlink_to("/etc/passwd")
+            inside = str((root / "sub" / "a.jpg").resolve())
+
+            assert resolve_image_path("sub/a.jpg", root) == inside
+            assert resolve_image_path(inside, root) == inside
+            for path, root_dir in [
+                ("sub/a.jpg", None),  # 未配置目录时不接受 path
+                ("/etc/passwd", root),
+                ("../../etc/passwd", root),
+                ("sub/../../images_other/a.jpg", root),
+                ("escape.jpg", root),  # 指向目录外的符号链接
+            ]:
+                try:
+                    resolve_image_path(path, root_dir)
+                except PermissionError:
+                    print(f"  拒绝: {path}")
+                    continue
+                raise AssertionError(f"应拒绝路径: {path}")
+        print(f"\n✓ 目录外的路径被拒绝")
+        return True
+
+    except Exception as e:
+        print(f"✗ 图像路径限制测试失败: {e}")
+        return False
+
+
+class FakeService:
+    """真实解码 + 假推理的特征服务，推理时抛出指定异常"""
+
+    model_name = "fake"
+    image_root = None
+
+    def __init__(self, error):
+        self.preprocess = PreprocessConfig()
+        self.error = error
+        self.batcher = MicroBatcher(self.run_batch, TEST_CONFIG["max_batch"], TEST_CONFIG["max_wait_ms"])
+
+    def decode(self, source):
+        return self.preprocess.load_crop(source)
+
+    def run_batch(self, crops):
+        raise self.error
+
+
+def test_embed_errors():
+    """无法解码的图像返回 400；推理中的 ValueError 原样抛出 (由 FastAPI 返回 500)"""
+    print("=" * 60)
+    print("/embed 异常分类测试")
+    print("=" * 60)
+
+    image_path = sorted((Path(__file__).resolve().parent.parent / "data" / "test_images").glob("*.jpg"))[0]
+    valid = base64.b64encode(image_path.read_bytes()).decode("ascii")
+    garbage = base64.b64encode(b"not an image").decode("ascii")
+
+    async def call(service, image_base64):
+        server.app.state.service = service
+        service.batcher.start()
+        try:
+            return await server.embed(EmbedRequest(image_base64=image_base64))
+        finally:
+            await service.batcher.stop()
+
+    try:
+        try:
+            asyncio.run(call(FakeService(ValueError("形状错误")), garbage))
+            raise AssertionError("无法解码的图像应返回 400")
+        except HTTPException as e:
+            assert e.status_code == 400, f"状态码 {e.status_code}"
+            print(f"  无法解码: {e.status_code}")
+
+        try:
+            asyncio.run(call(FakeService(ValueError("形状错误")), valid))
+            raise AssertionError("推理异常应原样抛出")
+        except HTTPException as e:
+            raise AssertionError(f"推理异常被当作 HTTP {e.status_code} 返回")
+        except ValueError as e:
+            print(f"  推理异常: {type(e).__name__}: {e} (500)")
+        print(f"\n✓ 只有解码失败返回 400")
+        return True
+
+    except Exception as e:
+        print(f"✗ /embed 异常分类测试失败: {e}")
+        return False
+
+
+def main():
+    """主测试函数"""
+    print("\n" + "=" * 60)
+    print("DINOv2 特征服务测试")
+    print("=" * 60 + "\n")
+
+    results = [
+        test_concurrent_batching(),
+        test_single_request_latency(),
+        test_batch_error(),
+        test_image_root(),
+        test_embed_errors(),
+    ]
+
+    passed = sum(results)
+    total = len(results)
+    print("=" * 60)
+    print(f"通过测试: {passed}/{total}")
+
+    return 0 if passed == total else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,313 @@
+#!/usr/bin/env python3
+"""
+DINOv2 相似度分析测试
+验证向量化分析 (examples/similarity.py) 与原先逐对循环的结果一致，
+分块计算与完整矩阵一致，批量 top-k 查询与逐个排序一致，并测量 10k 张图像
+规模的完整分析耗时、20k 张图像的分块行归约耗时与批量查询相对逐个循环的加速比
+"""
+
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "examples"))
+from similarity import (
+    FeatureIndex,
+    analyze,
+    greedy_groups,
+    nearest_neighbors,
+    pair_statistics,
+    ranked_neighbors,
+    row_reductions,
+    similarity_matrix,
+    write_similarity_matrix,
+)
+
+# 测试配置
+TEST_CONFIG = {
+    "num_small": 120,  # 与逐对循环对比的图像数
+    "num_large": 10000,  # 规模测试的图像数
+    "dim": 384,  # DINOv2 ViT-S/14 特征维度
+    "num_clusters": 12,  # 合成特征的簇数，使分组阈值有意义
+    "threshold": 0.85,
+    "max_seconds": 30.0,  # 10k 张图像完整分析的耗时上限
+    "num_blocked": 3000,  # 分块计算与完整矩阵对比的图像数
+    "block_size": 700,  # 对比时故意使用不整除的块大小
+    "num_out_of_core": 20000,  # 分块行归约规模测试的图像数
+    "k": 10,
+    "num_loop_queries": 20,  # 逐个循环查询的计时样本数 (按比例推算全部查询)
+}
+
+
+def make_features(n, seed=0):
+    """合成带簇结构的特征，包含一个全零向量"""
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(TEST_CONFIG["num_clusters"], TEST_CONFIG["dim"]))
+    labels = rng.integers(0, TEST_CONFIG["num_clusters"], size=n)
+    features = centers[labels] + 0.4 * rng.normal(size=(n, TEST_CONFIG["dim"]))
+    features[n // 2] = 0.0
+    return features.astype(np.float32)
+
+
+def loop_similarity(f1, f2):
+    """原先的逐对余弦相似度"""
+    norm1, norm2 = np.linalg.norm(f1), np.linalg.norm(f2)
+    if norm1 == 0 or norm2 == 0:
+        return 0.0
+    return np.dot(f1, f2) / (norm1 * norm2)
+
+
+def loop_reference(features, threshold):
+    """原先 test_all_images() / classify_by_similarity() 中的循环实现"""
+    n = len(features)
+    matrix = np.zeros((n, n))
+    for i in range(n):
+        for j in range(n):
+            matrix[i][j] = loop_similarity(features[i], features[j])
+
+    nearest = []
+    for i in range(n):
+        sims = [(j, matrix[i][j]) for j in range(n) if i != j]
+        sims.sort(key=lambda x: x[1], reverse=True)
+        nearest.append(sims[0][0])
+
+    groups, used = [], set()
+    for i in range(n):
+        if i in used:
+            continue
+        group = [i]
+        used.add(i)
+        for j in range(i + 1, n):
+            if j not in used and matrix[i][j] > threshold:
+                group.append(j)
+                used.add(j)
+        if len(group) > 1:
+            groups.append(group)
+
+    min_sim, min_pair, pairs = float("inf"), (0, 0), []
+    for i in range(n):
+        for j in range(i + 1, n):
+            pairs.append(matrix[i][j])
+            if matrix[i][j] < min_sim:
+                min_sim, min_pair = matrix[i][j], (i, j)
+
+    return matrix, nearest, groups, min_pair, min_sim, float(np.mean(pairs))
+
+
+def test_matches_loops():
+    """向量化结果与逐对循环一致"""
+    print("=" * 60)
+    print(f"与逐对循环对比 ({TEST_CONFIG['num_small']} 张)")
+    print("=" * 60)
+
+    try:
+        features = make_features(TEST_CONFIG["num_small"])
+        threshold = TEST_CONFIG["threshold"]
+        matrix, nearest, groups, min_pair, min_sim, mean = loop_reference(features, threshold)
+
+        sim = similarity_matrix(features)
+        stats = pair_statistics(sim)
+        print(f"  相似度矩阵最大偏差: {np.abs(sim - matrix).max():.2e}")
+        print(f"  分组数: {len(groups)}  最不相似: {min_pair} {min_sim:.4f}  平均: {mean:.4f}")
+
+        assert np.allclose(sim, matrix, atol=1e-5), "相似度矩阵不一致"
+        assert nearest_neighbors(sim)[0].tolist() == nearest, "最相似匹配不一致"
+        assert ranked_neighbors(sim)[:, 0].tolist() == nearest, "排序后的首位不一致"
+        assert greedy_groups(sim, threshold) == groups, "相似分组不一致"
+        assert stats["min_pair"] == min_pair, "最不相似图像对不一致"
+        assert abs(stats["min"] - min_sim) < 1e-5
+        assert abs(stats["mean"] - mean) < 1e-5, "平均相似度不一致"
+        print("✓ 结果一致")
+        return True
+
+    except Exception as e:
+        print(f"✗ 对比失败: {e}")
+        return False
+
+
+def test_large_scale():
+    """10k 张图像的完整分析在数秒内完成"""
+    n = TEST_CONFIG["num_large"]
+    print("=" * 60)
+    print(f"规模测试 ({n} 张, {TEST_CONFIG['dim']} 维)")
+    print("=" * 60)
+
+    try:
+        features = make_features(n, seed=1)
+        start = time.perf_counter()
+        report = analyze(features, TEST_CONFIG["threshold"])
+        elapsed = time.perf_counter() - start
+
+        stats = report["stats"]
+        print(f"  图像对: {stats['pairs']:,}")
+        print(f"  分组数: {len(report['groups'])}")
+        print(f"  平均相似度: {stats['mean']:.4f}  最低: {stats['min']:.4f}")
+        print(f"  耗时: {elapsed:.2f} 秒")
+
+        assert elapsed < TEST_CONFIG["max_seconds"], f"耗时 {elapsed:.1f} 秒超过上限"
+        print("✓ 规模测试通过")
+        return True
+
+    except Exception as e:
+        print(f"✗ 规模测试失败: {e}")
+        return False
+
+
+def test_blocked_matches_dense():
+    """分块写入的 float16 矩阵与行归约结果和完整矩阵一致"""
+    n = TEST_CONFIG["num_blocked"]
+    print("=" * 60)
+    print(f"分块计算与完整矩阵对比 ({n} 张, 块大小 {TEST_CONFIG['block_size']})")
+    print("=" * 60)
+
+    try:
+        features = make_features(n, seed=2)
+        dense = similarity_matrix(features)
+        k = TEST_CONFIG["k"]
+
+        with tempfile.TemporaryDirectory() as tmp:
+            matrix = write_similarity_matrix(
+                features, Path(tmp) / "similarity.npy", TEST_CONFIG["block_size"]
+            )
+            deviation = float(np.abs(matrix.astype(np.float32) - dense).max())
+            print(f"  float16 矩阵最大偏差: {deviation:.2e} ({matrix.nbytes / 1e6:.1f} MB)")
+            assert matrix.dtype == np.float16
+            assert deviation < 2e-3, "分块矩阵与完整矩阵不一致"
+            del matrix
+
+        reductions = row_reductions(features, k, TEST_CONFIG["block_size"])
+        order = ranked_neighbors(dense)[:, :k]
+        expected_mean = (dense.sum(axis=1, dtype=np.float64) - np.diag(dense)) / (n - 1)
+        nearest, nearest_scores = nearest_neighbors(dense)
+
+        # 全零特征与所有图像的相似度都是 0，并列时的顺序不保证，只比较相似度
+        ties = n // 2
+        assert np.array_equal(np.delete(reductions["indices"], ties, 0), np.delete(order, ties, 0)), (
+            "top-k 索引不一致"
+        )
+        assert np.allclose(reductions["scores"], np.take_along_axis(dense, order, axis=1), atol=1e-5)
+        assert np.allclose(reductions["max"], nearest_scores, atol=1e-5), "行最大值不一致"
+        assert np.allclose(reductions["mean"], expected_mean, atol=1e-5), "行均值不一致"
+        print("✓ 分块结果一致")
+        return True
+
+    except Exception as e:
+        print(f"✗ 分块对比失败: {e}")
+        return False
+
+
+def test_out_of_core():
+    """从内存映射特征计算 20k 张图像的行归约，不生成完整矩阵"""
+    n = TEST_CONFIG["num_out_of_core"]
+    print("=" * 60)
+    print(f"分块行归约规模测试 ({n} 张)")
+    print("=" * 60)
+
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            path = Path(tmp) / "features.npy"
+            np.save(path, make_features(n, seed=3))
+            features = np.load(path, mmap_mode="r")
+
+            start = time.perf_counter()
+            reductions = row_reductions(features, TEST_CONFIG["k"])
+            elapsed = time.perf_counter() - start
+
+        dense_mb = n * n * 8 / 1e6
+        print(f"  完整 float64 矩阵需要: {dense_mb:,.0f} MB (未生成)")
+        print(f"  top-{TEST_CONFIG['k']} 形状: {reductions['indices'].shape}")
+        print(f"  平均最近邻相似度: {reductions['max'].mean():.4f}")
+        print(f"  耗时: {elapsed:.2f} 秒")
+        assert reductions["indices"].shape == (n, TEST_CONFIG["k"])
+        assert not np.any(reductions["indices"] == np.arange(n)[:, None]), "结果包含自身"
+        print("✓ 分块行归约完成")
+        return True
+
+    except Exception as e:
+        print(f"✗ 分块行归约失败: {e}")
+        return False
+
+
+def loop_find_most_similar(query, features, top_k):
+    """原先 find_most_similar() 的逐个循环实现，返回索引列表"""
+    sims = [(loop_similarity(query, f), i) for i, f in enumerate(features)]
+    sims.sort(key=lambda x: x[0], reverse=True)
+    return [i for _, i in sims[:top_k]]
+
+
+def test_topk():
+    """批量 top-k 与完整排序一致，支持排除自身，并比较与逐个循环的耗时"""
+    n, k = TEST_CONFIG["num_large"], TEST_CONFIG["k"]
+    print("=" * 60)
+    print(f"批量 top-k 查询 ({n} 张索引, k={k})")
+    print("=" * 60)
+
+    try:
+        features = make_features(n, seed=4)
+        index = FeatureIndex(features)
+        queries = make_features(1000, seed=5)
+
+        start = time.perf_counter()
+        indices, scores = index.topk(queries, k)
+        batched = time.perf_counter() - start
+
+        # 与完整排序对比 (跳过全零查询: 所有相似度并列)
+        dense = similarity_matrix(queries, features)
+        order = np.argsort(-dense, axis=1, kind="stable")[:, :k]
+        rows = np.delete(np.arange(len(queries)), len(queries) // 2)
+        assert indices.shape == (len(queries), k) and indices.dtype == np.int64
+        assert np.array_equal(indices[rows], order[rows]), "top-k 索引与完整排序不一致"
+        assert np.allclose(scores, np.take_along_axis(dense, indices, axis=1), atol=1e-6)
+        assert np.all(np.diff(scores, axis=1) <= 0), "结果未按相似度降序排列"
+
+        # 排除自身: 以索引中的特征查询时不返回自己
+        self_indices, _ = index.topk_self(k, ids=np.arange(100))
+        assert not np.any(self_indices == np.arange(100)[:, None]), "结果包含自身"
+        single, _ = index.topk(features[7], k, exclude=[7])
+        assert np.array_equal(single[0], self_indices[7]), "单个查询与批量查询不一致"
+
+        # 原先的逐个循环实现，计时部分查询后按比例推算
+        samples = TEST_CONFIG["num_loop_queries"]
+        start = time.perf_counter()
+        for i in range(samples):
+            assert loop_find_most_similar(queries[i], features, k) == indices[i].tolist()
+        looped = (time.perf_counter() - start) / samples * len(queries)
+
+        print(f"  批量查询 {len(queries)} 个: {batched:.3f} 秒")
+        print(f"  逐个循环 (推算): {looped:.1f} 秒")
+        print(f"  加速比: {looped / batched:.0f}x")
+        print("✓ 批量 top-k 查询通过")
+        return True
+
+    except Exception as e:
+        print(f"✗ 批量 top-k 查询失败: {e}")
+        return False
+
+
+def main():
+    """主测试函数"""
+    print("\n" + "=" * 60)
+    print("DINOv2 相似度分析测试")
+    print("=" * 60 + "\n")
+
+    results = [
+        test_matches_loops(),
+        test_large_scale(),
+        test_blocked_matches_dense(),
+        test_out_of_core(),
+        test_topk(),
+    ]
+
+    passed = sum(results)
+    total = len(results)
+    print("=" * 60)
+    print(f"通过测试: {passed}/{total}")
+
+    return 0 if passed == total else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())